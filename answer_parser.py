@@ -0,0 +1,77 @@
+import re
+import json
+
+# Сколько раз переспрашивать модель о вопросах без ответа
+MAX_RETRY_ROUNDS = 2
+
+_decoder = json.JSONDecoder()
+# Начало пары "ключ": значение, где ключ - ID вопроса
+_KEY_RE = re.compile(r'"\s*(\d+)\s*"\s*:\s*')
+
+
+def extract_answers(text) -> dict:
+    """
+    Достает пары {question_id: ответ} из ответа модели.
+
+    Сначала пробует разобрать JSON целиком, а если он обрезан или испорчен -
+    разбирает пары по одной и сохраняет все, что удалось прочитать.
+
+    :param text: Ответ модели
+    :return: Словарь {int question_id: str ответ или None}
+    """
+    text = str(text).replace("```json", "").replace("```", "")
+
+    start = text.find("{")
+    if start != -1:
+        try:
+            data, _ = _decoder.raw_decode(text, start)
+            if isinstance(data, dict):
+                return {int(k): v for k, v in data.items() if str(k).strip().isdigit()}
+        except ValueError:
+            pass
+
+    answers = {}
+    for match in _KEY_RE.finditer(text):
+        try:
+            value, _ = _decoder.raw_decode(text, match.end())
+        except ValueError:
+            continue
+        answers[int(match.group(1))] = value
+    return answers
+
+
+def is_valid_answer(answer) -> bool:
+    if answer is None or isinstance(answer, (dict, list)):
+        return False
+    return str(answer).strip().lower() not in ("", "null", "none")
+
+
+def find_missing(answers: dict, question_ids) -> list:
+    """ID вопросов, на которые нет ответа, ответ null или ответ непригоден"""
+    return [q_id for q_id in question_ids if not is_valid_answer(answers.get(q_id))]
+
+
+def collect_answers(dialogue: str, questions: dict, first_result, ask, max_rounds: int = MAX_RETRY_ROUNDS) -> dict:
+    """
+    Собирает ответы на все вопросы, переспрашивая модель только о недостающих.
+
+    :param dialogue: Диалог, по которому задаются вопросы
+    :param questions: Словарь {question_id: question_text}
+    :param first_result: Ответ модели на полный список вопросов
+    :param ask: Функция ask(dialogue, questions_str) -> ответ модели
+    :param max_rounds: Максимум повторных запросов
+    :return: Словарь {question_id: ответ}, None для вопросов без ответа
+    """
+    answers = {q_id: value for q_id, value in extract_answers(first_result).items() if q_id in questions}
+
+    for _ in range(max_rounds):
+        missing = find_missing(answers, questions)
+        if not missing:
+            break
+        retry = ask(dialogue, str({q_id: questions[q_id] for q_id in missing}))
+        for q_id, value in extract_answers(retry).items():
+            if q_id in questions and is_valid_answer(value):
+                answers[q_id] = value
+
+    return {q_id: answers.get(q_id) if is_valid_answer(answers.get(q_id)) else None
+            for q_id in questions}
@@ -1,21 +1,38 @@
 import streamlit as st
-import whisper
-import spacy
 import os
-import tempfile
-from spacy import displacy
+import json
 from sqlalchemy import create_engine, Column, Integer, String, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from passlib.hash import bcrypt
 
+import compliance
+import db
+import metrics
+import warmup
+from export import export_answers, save_to_excel, XLSX_MIME, CSV_MIME
+from migrations import migrate
+from model_registry import registry
+from search_index import search, KIND_NAMES
+from survey_catalogue import catalogue
+from text_analysis import get_engine
+from uploads import upload_key, spool_upload, enforce_session_budget, UploadTooLarge
+from ya_gpt import ya_request_1, ya_request_2
+
 # Инициализация состояния сессии
 if 'user' not in st.session_state:
     st.session_state.user = None
-if 'audio_data' not in st.session_state:
-    st.session_state.audio_data = None
+if 'upload_key' not in st.session_state:
+    st.session_state.upload_key = None
+if 'audio_digest' not in st.session_state:
+    st.session_state.audio_digest = None
 if 'transcription' not in st.session_state:
     st.session_state.transcription = None
+if 'transcription_mode' not in st.session_state:
+    st.session_state.transcription_mode = "auto"
+
+# Ключи сессии, которые не вытесняются при превышении бюджета памяти
+SESSION_KEYS = ("user", "upload_key", "audio_digest", "transcription", "transcription_mode")
 
 # ---- Настройка БД ----
 Base = declarative_base()
@@ -32,6 +49,15 @@ class User(Base):
 # Создаем таблицы при первом запуске
 Base.metadata.create_all(engine)
 
+# Приложение читает таблицы, которые создают миграции (каталог, поиск, сводка
+# стандартов), поэтому схема bot.db приводится к актуальной версии и без бота.
+# Один раз на процесс, а не при каждом перезапуске скрипта Streamlit
+@st.cache_resource
+def migrate_database():
+    return migrate(db.DB_NAME)
+
+migrate_database()
+
 # ---- Функции аутентификации ----
 def create_user(username, password, is_admin=False):
     with Session() as session:
@@ -51,23 +77,37 @@ def verify_user(username, password):
         return None
 
 # ---- Настройка моделей анализа ----
+WHISPER_MODEL = "medium"
+
+# Распознавание (numpy, torch) и spaCy импортируются не при открытии страницы входа,
+# а в фоне: Whisper загружается в общий реестр процесса один раз, повторные запуски
+# скрипта Streamlit прогрев не повторяют
+warmup.warm_up(models=(WHISPER_MODEL,), analysis=True)
+
 @st.cache_resource
+def load_nlp():
+    # Движок анализа держит spaCy без лишних компонентов и готовые PhraseMatcher
+    return get_engine()
+
 def load_models():
-    whisper_model = whisper.load_model("medium")
-    try:
-        nlp = spacy.load("ru_core_news_sm")
-    except OSError:
-        raise Exception("Модель ru_core_news_sm не установлена. Выполните: python -m spacy download ru_core_news_sm")
-    return whisper_model, nlp
+    return registry.get(WHISPER_MODEL), load_nlp()
 
 # ---- Функции анализа текста ----
-def analyze_text(text, nlp):
-    doc = nlp(text)
-    return {
-        "promo_mentioned": any(token.text.lower() in ["акция", "скидка", "промо"] for token in doc),
-        "was_polite": any(token.text.lower() in ["спасибо", "пожалуйста"] for token in doc),
-        "entities": [(ent.text, ent.label_) for ent in doc.ents]
-    }
+def analyze_text(text, nlp=None, survey_id=None):
+    return (nlp or load_nlp()).analyze(text, survey_id=survey_id)
+
+# ---- Анализ с помощью YandexGPT ----
+SURVEY_ID = 3
+
+def improve_text(text, use_cache=True):
+    return ya_request_1(text, use_cache=use_cache)
+
+def analyze_text_with_gpt(text, survey_id=SURVEY_ID, use_cache=True):
+    result = ya_request_2(text, catalogue.questions_prompt(survey_id), use_cache=use_cache)
+    try:
+        return json.loads(str(result).replace("```", ""))
+    except ValueError:
+        return {"raw": result}
 
 # ---- Основной интерфейс ----
 def main_app():
@@ -105,7 +145,12 @@ def main_app():
 
     # ---- Основной функционал ----
     if st.session_state.user:
+        from whisper_transcription import TRANSCRIPTION_MODES
+
         st.sidebar.subheader(f"Вы вошли как: {st.session_state.user['username']}")
+        st.sidebar.selectbox("Режим транскрипции", TRANSCRIPTION_MODES,
+                             key="transcription_mode",
+                             help="chunked - параллельно по фрагментам, auto - chunked для длинных записей")
 
         if st.session_state.user.get('is_admin'):
             admin_interface()
@@ -126,16 +171,74 @@ def admin_interface():
             else:
                 st.error("Ошибка создания")
 
+    # Поиск по расшифровкам и ответам всех проверок
+    with st.expander("Поиск по проверкам"):
+        query = st.text_input("Что найти", placeholder="трейд-ин")
+        if query:
+            results = search(query, limit=50, before="**", after="**")
+            if not results:
+                st.info("Ничего не найдено")
+            for result in results:
+                source = KIND_NAMES[result['kind']]
+                if result['question']:
+                    source = f"{source} на «{result['question']}»"
+                st.markdown(f"**#{result['inspection_id']}** ({source}): {result['snippet']}")
+
+    # Доля выполненных пунктов анкет по сводке compliance_stats
+    with st.expander("Выполнение стандартов"):
+        dimensions = st.multiselect("Разрезы", list(compliance.DIMENSIONS), default=["question"],
+                                    format_func=lambda name: compliance.DIMENSIONS[name][1])
+        surveys = db.get_connection().execute(
+            'SELECT survey_id, client_name FROM surveys ORDER BY survey_id').fetchall()
+        survey = st.selectbox("Анкета", [None] + surveys, key="compliance_survey",
+                              format_func=lambda s: "Все" if s is None else f"#{s[0]} {s[1]}")
+        months = compliance.months()
+        if months:
+            month_from, month_to = (st.select_slider("Период", months, value=(months[0], months[-1]))
+                                    if len(months) > 1 else (months[0], months[0]))
+            rows = compliance.pass_rates(dimensions, survey_id=survey[0] if survey else None,
+                                         month_from=month_from, month_to=month_to)
+            st.dataframe([{**row, "pass_rate": None if row["pass_rate"] is None else f"{row['pass_rate']:.0%}"}
+                          for row in rows], use_container_width=True)
+        else:
+            st.info("Ответов пока нет")
+
+    # Выгрузка ответов многих проверок
+    with st.expander("Выгрузка ответов"):
+        surveys = db.get_connection().execute(
+            'SELECT survey_id, client_name FROM surveys ORDER BY survey_id').fetchall()
+        survey = st.selectbox("Анкета", [None] + surveys,
+                              format_func=lambda s: "Все" if s is None else f"#{s[0]} {s[1]}")
+        client_name = st.text_input("Клиент")
+        dates = st.date_input("Период", value=())
+        fmt = st.radio("Формат", ["xlsx", "csv"], horizontal=True)
+        if st.button("Сформировать выгрузку"):
+            date_from, date_to = (dates + (None, None))[:2] if dates else (None, None)
+            with st.spinner("Формируем выгрузку..."):
+                data = export_answers(fmt, survey_id=survey[0] if survey else None,
+                                      client_name=client_name or None,
+                                      date_from=date_from, date_to=date_to or date_from)
+            st.download_button(
+                label="Скачать выгрузку",
+                data=data,
+                file_name=f"answers.{fmt}",
+                mime=XLSX_MIME if fmt == "xlsx" else CSV_MIME
+            )
+
     audio_file = st.file_uploader("Загрузите аудиофайл", type=["mp3", "wav"])
 
     if audio_file:
         process_audio(audio_file)
         
         if st.session_state.transcription:
+            # Повторный запрос к GPT вместо ответа из кэша
+            refresh = st.checkbox("Запросить GPT заново (без кэша)")
+
             # Шаг 1: Улучшение текста
             if st.button("Улучшить текст"):
                 with st.spinner("Улучшаем текст с помощью GPT..."):
-                    st.session_state.improved_text = improve_text(st.session_state.transcription)
+                    st.session_state.improved_text = improve_text(st.session_state.transcription,
+                                                                  use_cache=not refresh)
             
             if 'improved_text' in st.session_state:
                 st.subheader("Улучшенный текст")
@@ -147,21 +250,20 @@ def admin_interface():
                 # Шаг 2: Анализ
                 if st.button("Анализировать текст"):
                     with st.spinner("Анализируем текст..."):
-                        analysis = analyze_text_with_gpt(edited_text)
+                        analysis = analyze_text_with_gpt(edited_text, use_cache=not refresh)
                         st.session_state.analysis = analysis
                         
-                        # Сохранение в Excel
-                        save_to_excel(analysis, "analysis.xlsx")
+                        # Excel собирается в памяти: у каждого админа своя выгрузка
+                        report = save_to_excel(analysis, survey_id=SURVEY_ID)
                         st.success("Анализ завершен!")
                         
                         # Скачивание файла
-                        with open("analysis.xlsx", "rb") as f:
-                            st.download_button(
-                                label="Скачать анализ",
-                                data=f,
-                                file_name="analysis.xlsx",
-                                mime="application/vnd.ms-excel"
-                            )
+                        st.download_button(
+                            label="Скачать анализ",
+                            data=report,
+                            file_name="analysis.xlsx",
+                            mime=XLSX_MIME
+                        )
             
             # Отображение результатов
             if 'analysis' in st.session_state:
@@ -184,7 +286,7 @@ def user_interface():
                                        key="edited_text")
 
             if st.button("Анализировать"):
-                analysis = analyze_text(edited_text, load_models()[1])
+                analysis = analyze_text(edited_text, load_nlp())
 
                 st.subheader("Результаты анализа:")
                 st.write(f"Упомянуты акции: {'✅' if analysis['promo_mentioned'] else '❌'}")
@@ -196,23 +298,51 @@ def user_interface():
                         st.write(f"- {entity} ({label})")
 
 # ---- Обработка аудио ----
-def process_audio(audio_file):
-    # Если аудио уже обработано, не делаем транскрипцию снова
-    if st.session_state.audio_data == audio_file.getvalue():
-        return
+def set_local_dialogue(result, audio_path):
+    # Диалог по ролям без YandexGPT; кнопка "Улучшить текст" по-прежнему переписывает его моделью
+    from dialogue_formatter import local_dialogue
 
-    st.session_state.audio_data = audio_file.getvalue()
+    st.session_state.pop('improved_text', None)
+    dialogue = local_dialogue(result, audio_path)
+    if dialogue is not None:
+        st.session_state.improved_text = dialogue
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-        tmp.write(audio_file.read())
-        audio_path = tmp.name
+def process_audio(audio_file, mode=None):
+    from whisper_transcription import transcribe
 
-    whisper_model, nlp = load_models()
+    # Если аудио уже обработано, не делаем транскрипцию снова
+    key = upload_key(audio_file)
+    if st.session_state.upload_key == key:
+        return
 
-    with st.spinner("Обработка аудио..."):
-        st.session_state.transcription = whisper_model.transcribe(audio_path)["text"]
+    # Файл копируется на диск порциями с подсчетом хэша; в сессии остается только хэш
+    suffix = os.path.splitext(audio_file.name)[1] or ".mp3"
+    try:
+        with metrics.span("app.upload"):
+            digest, audio_path = spool_upload(audio_file, suffix=suffix)
+    except UploadTooLarge as e:
+        st.error(str(e))
+        return
+    # Распознавание прошлого файла не должно показываться как результат нового
+    st.session_state.transcription = None
 
-    os.unlink(audio_path)
+    try:
+        mode = mode or st.session_state.transcription_mode
+        # Хэш уже посчитан при копировании; если файл уже распознавали, результат возьмется из общего кэша
+        with st.spinner("Обработка аудио..."):
+            result = transcribe(audio_path, model_name=WHISPER_MODEL, mode=mode, digest=digest)
+        st.session_state.transcription = result["text"]
+        set_local_dialogue(result, audio_path)
+    finally:
+        os.unlink(audio_path)
+
+    # Файл считается обработанным только после успешного распознавания:
+    # после ошибки повторный запуск скрипта распознает его снова
+    st.session_state.upload_key = key
+    st.session_state.audio_digest = digest
+    enforce_session_budget(st.session_state, keep=SESSION_KEYS)
 
 if __name__ == "__main__":
+    # Сервер метрик один на процесс Streamlit, повторные запуски скрипта его не пересоздают
+    metrics.serve()
     main_app()
@@ -0,0 +1,312 @@
+"""
+Хранилище файлов проверок: записи, диалоги, ответы модели и отчеты.
+
+Файл хранится в ARTIFACT_DIR один раз по SHA-256 содержимого, а проверка
+ссылается на него по виду (audio, dialogue, ...). Число ссылок ведут
+триггеры в bot.db, поэтому одна и та же запись, присланная дважды, или
+одинаковые отчеты занимают место один раз.
+
+Запись идет порциями во временный файл с подсчетом хэша и переносится на
+место в транзакции, так что после падения процесса остаются только
+недописанные .part и файлы без записи в базе - их удаляет recover() при
+запуске. enforce_quota() держит хранилище в пределах ARTIFACT_MAX_MB и
+ARTIFACT_MAX_AGE_DAYS: сначала удаляются файлы без ссылок, потом те,
+к которым дольше всего не обращались.
+
+Вычисленный результат сохраняется с отпечатком входных данных (fingerprint):
+reuse() находит готовый диалог или отчет с тем же отпечатком, в том числе
+у другой проверки, и ссылается на него вместо повторного вычисления.
+"""
+import os
+import time
+import uuid
+import hashlib
+
+import db
+
+# ---- Настройки хранилища ----
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "artifacts")
+# Предельный размер хранилища, в мегабайтах
+ARTIFACT_MAX_MB = float(os.getenv("ARTIFACT_MAX_MB", "2000"))
+# Файлы, к которым не обращались дольше, удаляются; 0 - без ограничения по возрасту
+ARTIFACT_MAX_AGE_DAYS = float(os.getenv("ARTIFACT_MAX_AGE_DAYS", "14"))
+# Файлы, открытые за последние столько секунд, не вытесняются по размеру (их обрабатывают)
+PIN_SECONDS = float(os.getenv("ARTIFACT_PIN_SECONDS", "3600"))
+# Недописанные и неучтенные файлы моложе этого могут принадлежать другому процессу
+ORPHAN_GRACE_SECONDS = 600
+# Размер порции при записи
+CHUNK_SIZE = 1024 * 1024
+
+# Виды файлов проверки
+AUDIO = "audio"
+DIALOGUE = "dialogue"
+LLM_ANSWERS = "llm_answers"
+REPORT = "report"
+
+
+class ArtifactTooLarge(Exception):
+    pass
+
+
+class Artifact:
+    """Файл в хранилище"""
+
+    __slots__ = ("sha256", "path", "size")
+
+    def __init__(self, sha256: str, path: str, size: int):
+        self.sha256 = sha256
+        self.path = path
+        self.size = size
+
+    def read_bytes(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def read_text(self) -> str:
+        with open(self.path, encoding="utf-8") as f:
+            return f.read()
+
+
+def input_fingerprint(*parts) -> str:
+    """Отпечаток входных данных вычисления"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ArtifactStore:
+    """
+    Файлы проверок с учетом ссылок, квотами и восстановлением после сбоев.
+
+    Индекс хранится в таблицах artifact_blobs и artifacts (migrations.py).
+    Перенос файла на место и его удаление выполняются внутри транзакции
+    с блокировкой на запись, поэтому процессы бота не удаляют файлы,
+    на которые другой процесс как раз добавляет ссылку.
+    """
+
+    def __init__(self, root: str = ARTIFACT_DIR, max_mb: float = ARTIFACT_MAX_MB,
+                 max_age_days: float = ARTIFACT_MAX_AGE_DAYS, db_name: str = None):
+        self.root = root
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_age_days * 86400
+        self.db_name = db_name
+        self.blob_dir = os.path.join(root, "blobs")
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def _blob_path(self, sha256: str, suffix: str) -> str:
+        return os.path.join(self.blob_dir, sha256[:2], sha256 + suffix)
+
+    # ---- Запись ----
+    def write(self, inspection_id: int, kind: str, chunks, suffix: str = "", fingerprint: str = None,
+              max_bytes: int = None) -> Artifact:
+        """
+        Сохраняет файл проверки из итератора порций bytes, не собирая его в памяти.
+
+        :param kind: Вид файла (AUDIO, DIALOGUE, ...); прежний файл этого вида заменяется
+        :param suffix: Расширение файла на диске (".mp3"), нужно декодерам аудио
+        :param fingerprint: Отпечаток входных данных, по которому файл найдет reuse()
+        :param max_bytes: Предельный размер, больше - ArtifactTooLarge
+        """
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as out:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise ArtifactTooLarge(f"Файл больше {max_bytes / 1024 / 1024:g} МБ")
+                    digest.update(chunk)
+                    out.write(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            artifact = self._commit(tmp_path, digest.hexdigest(), size, suffix, inspection_id, kind, fingerprint)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.enforce_quota()
+        return artifact
+
+    def put_bytes(self, inspection_id: int, kind: str, data: bytes, suffix: str = "",
+                  fingerprint: str = None) -> Artifact:
+        return self.write(inspection_id, kind, (data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)),
+                          suffix, fingerprint)
+
+    def put_text(self, inspection_id: int, kind: str, text: str, fingerprint: str = None) -> Artifact:
+        return self.put_bytes(inspection_id, kind, text.encode("utf-8"), ".txt", fingerprint)
+
+    def _commit(self, tmp_path: str, sha256: str, size: int, suffix: str, inspection_id: int, kind: str,
+                fingerprint: str) -> Artifact:
+        now = time.time()
+        with db.transaction(self.db_name) as conn:
+            row = conn.execute('SELECT path FROM artifact_blobs WHERE sha256 = ?', (sha256,)).fetchone()
+            if row is not None and os.path.exists(row[0]):
+                # Такой файл уже есть - достаточно ссылки
+                path = row[0]
+            else:
+                path = self._blob_path(sha256, suffix)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            conn.execute('''
+                INSERT INTO artifact_blobs (sha256, path, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (sha256) DO UPDATE SET path = excluded.path, last_access = excluded.last_access
+            ''', (sha256, path, size, now, now))
+            self._link(conn, inspection_id, kind, sha256, fingerprint, now)
+        return Artifact(sha256, path, size)
+
+    @staticmethod
+    def _link(conn, inspection_id: int, kind: str, sha256: str, fingerprint: str, now: float):
+        conn.execute('''
+            INSERT INTO artifacts (inspection_id, kind, sha256, fingerprint, created_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (inspection_id, kind) DO UPDATE SET
+                sha256 = excluded.sha256, fingerprint = excluded.fingerprint, created_at = excluded.created_at
+        ''', (inspection_id, kind, sha256, fingerprint, now))
+
+    # ---- Чтение ----
+    def _existing(self, conn, row) -> Artifact:
+        """Artifact по строке (sha256, path, size) или None, если файла на диске нет"""
+        if row is None:
+            return None
+        sha256, path, size = row
+        if not os.path.exists(path):
+            # Файл удалили в обход хранилища: забываем его, результат вычислится заново
+            conn.execute('DELETE FROM artifact_blobs WHERE sha256 = ?', (sha256,))
+            return None
+        conn.execute('UPDATE artifact_blobs SET last_access = ? WHERE sha256 = ?', (time.time(), sha256))
+        return Artifact(sha256, path, size)
+
+    def get(self, inspection_id: int, kind: str, fingerprint: str = None) -> Artifact:
+        """
+        Файл проверки или None.
+
+        :param fingerprint: Если указан, файл с другим отпечатком не подходит
+        """
+        with db.transaction(self.db_name) as conn:
+            row = conn.execute('''
+                SELECT b.sha256, b.path, b.size FROM artifacts a
+                JOIN artifact_blobs b ON b.sha256 = a.sha256
+                WHERE a.inspection_id = ? AND a.kind = ? AND (? IS NULL OR a.fingerprint = ?)
+            ''', (inspection_id, kind, fingerprint, fingerprint)).fetchone()
+            return self._existing(conn, row)
+
+    def reuse(self, inspection_id: int, kind: str, fingerprint: str) -> Artifact:
+        """
+        Готовый файл с тем же отпечатком: свой или другой проверки (тогда на него добавляется ссылка).
+
+        :return: Artifact или None, если результат нужно вычислить
+        """
+        with db.transaction(self.db_name) as conn:
+            rows = conn.execute('''
+                SELECT b.sha256, b.path, b.size, a.inspection_id FROM artifacts a
+                JOIN artifact_blobs b ON b.sha256 = a.sha256
+                WHERE a.kind = ? AND a.fingerprint = ?
+                ORDER BY a.inspection_id = ? DESC, b.last_access DESC
+            ''', (kind, fingerprint, inspection_id)).fetchall()
+            for sha256, path, size, owner in rows:
+                artifact = self._existing(conn, (sha256, path, size))
+                if artifact is None:
+                    continue
+                if owner != inspection_id:
+                    self._link(conn, inspection_id, kind, sha256, fingerprint, time.time())
+                return artifact
+        return None
+
+    def release(self, inspection_id: int, kind: str = None) -> int:
+        """Удаляет ссылки проверки; файлы без ссылок вытесняются первыми. Возвращает число ссылок"""
+        with db.transaction(self.db_name) as conn:
+            cursor = conn.execute('DELETE FROM artifacts WHERE inspection_id = ? AND (? IS NULL OR kind = ?)',
+                                  (inspection_id, kind, kind))
+            return cursor.rowcount
+
+    # ---- Квоты и восстановление ----
+    def enforce_quota(self) -> int:
+        """
+        Удаляет файлы старше max_age и, пока хранилище больше max_bytes, файлы
+        без ссылок, затем давно не открывавшиеся.
+
+        :return: Число удаленных файлов
+        """
+        now = time.time()
+        with db.transaction(self.db_name) as conn:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM artifact_blobs').fetchone()[0]
+            victims = []
+            if self.max_age > 0:
+                victims = conn.execute('SELECT sha256, path, size FROM artifact_blobs WHERE last_access < ?',
+                                       (now - self.max_age,)).fetchall()
+                total -= sum(size for _, _, size in victims)
+            if total > self.max_bytes:
+                chosen = {sha256 for sha256, _, _ in victims}
+                for sha256, path, size, refcount, last_access in conn.execute('''
+                    SELECT sha256, path, size, refcount, last_access FROM artifact_blobs
+                    ORDER BY refcount > 0, last_access
+                ''').fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    # Недавно открытые файлы с ссылками сейчас обрабатываются
+                    if sha256 in chosen or (refcount > 0 and now - last_access < PIN_SECONDS):
+                        continue
+                    victims.append((sha256, path, size))
+                    total -= size
+            for sha256, path, _ in victims:
+                # Ссылки удаляются каскадом
+                conn.execute('DELETE FROM artifact_blobs WHERE sha256 = ?', (sha256,))
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return len(victims)
+
+    def recover(self) -> dict:
+        """
+        Наводит порядок после сбоев; вызывается при запуске.
+
+        Удаляет недописанные файлы, файлы без записи в базе и записи без файлов,
+        затем применяет квоты.
+
+        :return: {"partial", "orphans", "missing", "evicted"}
+        """
+        report = {"partial": 0, "orphans": 0, "missing": 0, "evicted": 0}
+        cutoff = time.time() - ORPHAN_GRACE_SECONDS
+        if os.path.isdir(self.tmp_dir):
+            for entry in os.scandir(self.tmp_dir):
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    report["partial"] += 1
+
+        with db.transaction(self.db_name) as conn:
+            known = {}
+            for sha256, path in conn.execute('SELECT sha256, path FROM artifact_blobs').fetchall():
+                known[os.path.abspath(path)] = sha256
+            for path, sha256 in known.items():
+                if not os.path.exists(path):
+                    conn.execute('DELETE FROM artifact_blobs WHERE sha256 = ?', (sha256,))
+                    report["missing"] += 1
+            if os.path.isdir(self.blob_dir):
+                for folder, _, names in os.walk(self.blob_dir):
+                    for name in names:
+                        path = os.path.abspath(os.path.join(folder, name))
+                        # Файл мог только что появиться у процесса, который еще не закончил транзакцию
+                        if path not in known and os.path.getmtime(path) < cutoff:
+                            os.remove(path)
+                            report["orphans"] += 1
+
+        report["evicted"] = self.enforce_quota()
+        if any(report.values()):
+            print(f"Хранилище файлов проверок: {report}")
+        return report
+
+    def stats(self) -> dict:
+        conn = db.get_connection(self.db_name)
+        files, size, unreferenced = conn.execute('''
+            SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount = 0), 0) FROM artifact_blobs
+        ''').fetchone()
+        references = conn.execute('SELECT COUNT(*) FROM artifacts').fetchone()[0]
+        return {"files": files, "size_mb": round(size / 1024 / 1024, 1), "unreferenced": unreferenced,
+                "references": references}
+
+
+# Общее хранилище процесса
+store = ArtifactStore()
@@ -0,0 +1,266 @@
+"""
+Подготовка записи к распознаванию (включается AUDIO_PREPROCESS=1).
+
+Файл декодируется в массив float32 16 кГц моно один раз; декодированный
+массив сохраняется в AUDIO_CACHE_DIR и при повторной обработке той же
+записи открывается через memory map без ffmpeg. Дальше громкость
+приводится к PREPROCESS_TARGET_DBFS, тишина по краям обрезается, а
+длинные паузы внутри (ожидание на линии, гудки) укорачиваются. Карта
+времени TimeMap переводит время сегментов обратно в исходную запись.
+"""
+import os
+import bisect
+import threading
+
+import numpy as np
+
+from transcription_backends import SAMPLE_RATE
+from transcription_cache import file_sha256
+
+# ---- Настройки подготовки аудио ----
+# Включается явно: обрезка пауз меняет вход модели, и на своих записях ее стоит сначала сравнить
+# с обычным распознаванием (bench_transcription.py)
+PREPROCESS = os.getenv("AUDIO_PREPROCESS", "0") == "1"
+# Кэш декодированных записей и его предельный размер, в мегабайтах
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "audio_cache")
+AUDIO_CACHE_MB = float(os.getenv("AUDIO_CACHE_MB", "2000"))
+# Целевая громкость речи и максимальное усиление, в дБ
+TARGET_DBFS = float(os.getenv("PREPROCESS_TARGET_DBFS", "-20"))
+MAX_GAIN_DB = float(os.getenv("PREPROCESS_MAX_GAIN_DB", "30"))
+# energy - по энергии кадров, silero - VAD из faster-whisper (если установлен)
+VAD = os.getenv("PREPROCESS_VAD", "energy")
+# Кадр считается речью, если он громче шумового фона на столько дБ
+SPEECH_MARGIN_DB = float(os.getenv("PREPROCESS_SPEECH_MARGIN_DB", "12"))
+# Абсолютный порог тишины, в dBFS
+SILENCE_DBFS = float(os.getenv("PREPROCESS_SILENCE_DBFS", "-50"))
+# Паузы длиннее этого укорачиваются, по краям речи остается KEEP_SILENCE_SECONDS, в секундах
+MIN_SILENCE_SECONDS = float(os.getenv("PREPROCESS_MIN_SILENCE_SECONDS", "2.0"))
+KEEP_SILENCE_SECONDS = float(os.getenv("PREPROCESS_KEEP_SILENCE_SECONDS", "0.4"))
+
+FRAME_SECONDS = 0.03
+
+_cache_lock = threading.Lock()
+
+
+class TimeMap:
+    """
+    Соответствие времени в подготовленной записи времени в исходной.
+
+    Подготовленная запись склеена из кусков исходной; для каждого куска
+    хранится (начало в подготовленной, начало в исходной, длина) в секундах.
+    """
+
+    def __init__(self, pieces: list):
+        self.pieces = pieces
+        self._starts = [piece[0] for piece in pieces]
+
+    @classmethod
+    def identity(cls, seconds: float):
+        return cls([(0.0, 0.0, seconds)])
+
+    def to_source(self, t: float, end: bool = False) -> float:
+        """
+        :param end: Время - конец сегмента; на стыке кусков относится к предыдущему
+        """
+        if not self.pieces:
+            return t
+        find = bisect.bisect_left if end else bisect.bisect_right
+        i = max(0, find(self._starts, t) - 1)
+        out_start, src_start, length = self.pieces[i]
+        return src_start + min(max(t - out_start, 0.0), length)
+
+    def remap(self, segments: list) -> list:
+        """Переводит start/end сегментов во время исходной записи"""
+        for seg in segments:
+            seg["start"] = round(self.to_source(seg["start"]), 3)
+            seg["end"] = round(self.to_source(seg["end"], end=True), 3)
+        return segments
+
+
+class PreparedAudio:
+    """Подготовленная запись, карта времени и статистика подготовки"""
+
+    __slots__ = ("audio", "time_map", "stats")
+
+    def __init__(self, audio: np.ndarray, time_map: TimeMap, stats: dict):
+        self.audio = audio
+        self.time_map = time_map
+        self.stats = stats
+
+
+# ---- Декодирование и кэш ----
+def _cache_path(digest: str) -> str:
+    return os.path.join(AUDIO_CACHE_DIR, f"{digest}.f32")
+
+
+def _evict_cache(keep: str):
+    limit = int(AUDIO_CACHE_MB * 1024 * 1024)
+    entries = []
+    for entry in os.scandir(AUDIO_CACHE_DIR):
+        if entry.is_file() and entry.name.endswith(".f32"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    # Удаляем записи, которые дольше всего не открывали
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def load_audio(path, engine, digest: str = None, use_cache: bool = True) -> np.ndarray:
+    """
+    Декодирует запись в float32 16 кГц моно.
+
+    С use_cache массив сохраняется в AUDIO_CACHE_DIR по SHA-256 файла, и при
+    следующем вызове возвращается только для чтения через memory map.
+
+    :param engine: Движок распознавания, которым декодируется файл
+    :param digest: SHA-256 файла, если уже посчитан
+    """
+    if not use_cache:
+        return engine.load_audio(str(path))
+
+    digest = digest or file_sha256(path)
+    cached = _cache_path(digest)
+    if os.path.exists(cached):
+        try:
+            os.utime(cached)
+        except OSError:
+            pass
+        if os.path.getsize(cached) == 0:
+            return np.zeros(0, dtype=np.float32)
+        return np.memmap(cached, dtype=np.float32, mode="r")
+
+    audio = np.ascontiguousarray(engine.load_audio(str(path)), dtype=np.float32)
+    os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
+    # Пишем во временный файл и переименовываем, чтобы параллельный процесс не прочитал половину
+    tmp_path = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+    audio.tofile(tmp_path)
+    os.replace(tmp_path, cached)
+    with _cache_lock:
+        _evict_cache(keep=cached)
+    return audio
+
+
+# ---- Громкость и тишина ----
+def frame_levels(audio: np.ndarray, frame: int = int(FRAME_SECONDS * SAMPLE_RATE)) -> np.ndarray:
+    """Уровень кадров в dBFS"""
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = np.asarray(audio[:n_frames * frame], dtype=np.float32).reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def energy_speech_mask(levels: np.ndarray) -> np.ndarray:
+    """Кадры речи: громче шумового фона на SPEECH_MARGIN_DB и громче SILENCE_DBFS"""
+    if len(levels) == 0:
+        return np.zeros(0, dtype=bool)
+    noise_floor = np.percentile(levels, 10)
+    mask = levels > max(noise_floor + SPEECH_MARGIN_DB, SILENCE_DBFS)
+    # Сглаживание на ~0.3 с: короткие паузы между словами остаются речью
+    smooth = np.convolve(mask.astype(np.float32), np.ones(10), mode="same")
+    return smooth > 0
+
+
+def silero_speech_mask(audio: np.ndarray, n_frames: int, frame: int = int(FRAME_SECONDS * SAMPLE_RATE)) -> np.ndarray:
+    """Кадры речи по VAD Silero из faster-whisper"""
+    try:
+        from faster_whisper.vad import VadOptions, get_speech_timestamps
+    except ImportError:
+        raise RuntimeError("Для PREPROCESS_VAD=silero установите пакет faster-whisper")
+    mask = np.zeros(n_frames, dtype=bool)
+    for chunk in get_speech_timestamps(np.asarray(audio, dtype=np.float32), VadOptions()):
+        mask[chunk["start"] // frame:chunk["end"] // frame + 1] = True
+    return mask
+
+
+def normalize_loudness(audio: np.ndarray, levels: np.ndarray, speech: np.ndarray,
+                       target_dbfs: float = TARGET_DBFS):
+    """
+    Приводит среднюю громкость речи к target_dbfs без клиппинга.
+
+    :return: (новый массив, примененное усиление в дБ)
+    """
+    if not speech.any():
+        return np.array(audio, dtype=np.float32), 0.0
+    speech_dbfs = 10 * np.log10(np.mean(10 ** (levels[speech] / 10)))
+    gain_db = min(target_dbfs - speech_dbfs, MAX_GAIN_DB)
+    peak = float(np.max(np.abs(audio))) if len(audio) else 0.0
+    if peak > 0:
+        gain_db = min(gain_db, 20 * np.log10(0.99 / peak))
+    return np.asarray(audio, dtype=np.float32) * np.float32(10 ** (gain_db / 20)), float(gain_db)
+
+
+def speech_pieces(speech: np.ndarray, total: int, frame: int = int(FRAME_SECONDS * SAMPLE_RATE)) -> list:
+    """
+    Отрезки записи, которые остаются после обрезки тишины.
+
+    :return: [(start, end), ...] в отсчетах
+    """
+    keep = int(KEEP_SILENCE_SECONDS / FRAME_SECONDS)
+    min_gap = int(MIN_SILENCE_SECONDS / FRAME_SECONDS)
+    voiced = np.flatnonzero(speech)
+    if len(voiced) == 0:
+        return [(0, total)]
+
+    pieces = []
+    start = prev = voiced[0]
+    for i in voiced[1:]:
+        if i - prev > min_gap:
+            pieces.append((start, prev))
+            start = i
+        prev = i
+    pieces.append((start, prev))
+    return [(max(0, int(lo - keep) * frame), min(total, int(hi + 1 + keep) * frame)) for lo, hi in pieces]
+
+
+def prepare(path, engine, digest: str = None, use_cache: bool = True) -> PreparedAudio:
+    """
+    Декодирует запись один раз, нормализует громкость и вырезает тишину.
+
+    :param path: Путь к аудиофайлу
+    :param engine: Движок распознавания (TranscriptionBackend)
+    :param digest: SHA-256 файла, если уже посчитан
+    :param use_cache: Хранить декодированный массив в AUDIO_CACHE_DIR
+    """
+    audio = load_audio(path, engine, digest, use_cache)
+    total = len(audio)
+    duration = total / SAMPLE_RATE
+
+    levels = frame_levels(audio)
+    if VAD == "silero":
+        speech = silero_speech_mask(audio, len(levels))
+    else:
+        speech = energy_speech_mask(levels)
+    audio, gain_db = normalize_loudness(audio, levels, speech)
+
+    pieces = speech_pieces(speech, total)
+    if pieces == [(0, total)]:
+        time_map = TimeMap.identity(duration)
+    else:
+        map_pieces = []
+        position = 0
+        for start, end in pieces:
+            map_pieces.append((position / SAMPLE_RATE, start / SAMPLE_RATE, (end - start) / SAMPLE_RATE))
+            position += end - start
+        time_map = TimeMap(map_pieces)
+        audio = np.concatenate([audio[start:end] for start, end in pieces])
+
+    kept = len(audio) / SAMPLE_RATE
+    stats = {
+        "audio_seconds": round(duration, 1),
+        "kept_seconds": round(kept, 1),
+        "removed_seconds": round(duration - kept, 1),
+        "gain_db": round(gain_db, 1),
+        "pieces": len(pieces),
+    }
+    return PreparedAudio(audio, time_map, stats)
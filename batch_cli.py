@@ -0,0 +1,223 @@
+"""
+Пакетная обработка папки с записями: транскрипция -> ответы -> отчеты.
+
+Транскрипция (CPU), запросы к YandexGPT (сеть) и построение PDF (CPU)
+выполняются в отдельных пулах и идут конвейером: запись уходит в LLM,
+как только распознана, а в отчет - как только получены ответы.
+Прогресс каждой записи сохраняется в таблице batch_items, поэтому
+прерванный запуск с тем же --run продолжается с места остановки:
+распознанные записи (расшифровка уже в transcripts) сразу идут в LLM,
+записи с ответами - в отчет; повторные запросы к модели берутся из кэша.
+
+Пример:
+    python batch_cli.py calls/2025-03 --run march --survey-id 3 --out reports --archive march.zip
+"""
+import os
+import sys
+import time
+import argparse
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import db
+import metrics
+from answer_parser import collect_answers
+from migrations import migrate
+from reports import report_pool, save_report, render_reports_archive
+from search_index import store_transcript
+from survey_catalogue import catalogue
+from dialogue_formatter import local_dialogue
+from whisper_transcription import transcribe, TRANSCRIPTION_MODES
+from ya_gpt import ya_request_1, ya_request_2
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".m4a", ".ogg", ".flac")
+
+# Этапы записи в batch_items
+PENDING = "pending"
+TRANSCRIBED = "transcribed"  # расшифровка сохранена в transcripts
+ANSWERED = "answered"
+DONE = "done"
+FAILED = "failed"
+
+
+def find_audio_files(directory: str) -> list:
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                files.append(os.path.abspath(os.path.join(root, name)))
+    return sorted(files)
+
+
+def load_checkpoints(run_name: str) -> dict:
+    rows = db.get_connection().execute(
+        'SELECT path, stage, inspection_id FROM batch_items WHERE run_name = ?', (run_name,)).fetchall()
+    return {path: (stage, inspection_id) for path, stage, inspection_id in rows}
+
+
+def save_checkpoint(run_name: str, path: str, stage: str, inspection_id: int = None, error: str = None):
+    with db.transaction() as conn:
+        conn.execute('''
+            INSERT INTO batch_items (path, run_name, stage, inspection_id, error, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (run_name, path) DO UPDATE SET
+                stage = excluded.stage,
+                inspection_id = COALESCE(excluded.inspection_id, batch_items.inspection_id),
+                error = excluded.error,
+                updated_at = excluded.updated_at
+        ''', (path, run_name, stage, inspection_id, error, datetime.datetime.now()))
+
+
+def load_transcript(inspection_id: int):
+    """(текст, диалог или None) сохраненной расшифровки или None, если ее нет"""
+    row = db.get_connection().execute(
+        'SELECT raw_text, dialogue FROM transcripts WHERE inspection_id = ?', (inspection_id,)).fetchone()
+    return (row[0], row[1]) if row and row[0] is not None else None
+
+
+def transcribe_file(path: str, model_name: str, mode: str) -> tuple:
+    """
+    Выполняется в процессе пула транскрипции.
+
+    :return: (текст, диалог по ролям или None, если его должен построить YandexGPT)
+    """
+    result = transcribe(path, model_name=model_name, mode=mode)
+    return result["text"], local_dialogue(result, path)
+
+
+def answer_questions(transcript: tuple, inspection_id: int, questions: dict):
+    """Выполняется в потоке пула LLM"""
+    text, dialogue = transcript
+    with metrics.inspection(inspection_id):
+        if dialogue is None:
+            dialogue = ya_request_1(text)
+            store_transcript(inspection_id, dialogue=dialogue)
+        result = ya_request_2(dialogue, str(questions), mode="auto")
+        answers = collect_answers(dialogue, questions, result,
+                                  ask=lambda d, q: ya_request_2(d, q, use_cache=False, mode="auto"))
+        with metrics.span("db.save_answers"):
+            db.add_answers(inspection_id, answers)
+
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+
+    def update(self, ok: bool, path: str):
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+        finished = self.done + self.failed
+        elapsed = time.monotonic() - self.started
+        rate = finished / elapsed if elapsed else 0.0
+        eta = (self.total - finished) / rate if rate else 0.0
+        status = "✅" if ok else "❌"
+        print(f"{status} [{finished}/{self.total}] {os.path.basename(path)} | "
+              f"{rate * 60:.1f} записей/мин | осталось ~{datetime.timedelta(seconds=int(eta))}",
+              flush=True)
+
+
+def run(args) -> int:
+    migrate(db.DB_NAME)
+    db.register_user(args.user_id, "batch")
+    if not catalogue.exists(args.survey_id):
+        print(f"Анкета {args.survey_id} не найдена, укажите существующую: --survey-id")
+        return 1
+    questions = catalogue.question_texts(args.survey_id)
+    if not questions:
+        print(f"В анкете {args.survey_id} нет вопросов")
+        return 1
+    os.makedirs(args.out, exist_ok=True)
+
+    files = find_audio_files(args.directory)
+    checkpoints = load_checkpoints(args.run)
+    todo = [path for path in files if checkpoints.get(path, (PENDING,))[0] != DONE]
+    print(f"Найдено записей: {len(files)}, уже обработано: {len(files) - len(todo)}")
+
+    progress = Progress(len(todo))
+    inspections = {}
+    pending = {}
+    with ProcessPoolExecutor(max_workers=args.whisper_workers,
+                             mp_context=multiprocessing.get_context("spawn")) as whisper_pool, \
+            ThreadPoolExecutor(max_workers=args.llm_workers) as llm_pool, \
+            report_pool(args.report_workers) as pdf_pool:
+
+        for path in todo:
+            stage, inspection_id = checkpoints.get(path, (PENDING, None))
+            if inspection_id is None:
+                inspection_id = db.create_inspection(args.user_id, args.survey_id)
+                save_checkpoint(args.run, path, PENDING, inspection_id)
+            inspections[path] = inspection_id
+
+            transcript = load_transcript(inspection_id) if stage == TRANSCRIBED else None
+            if stage == ANSWERED:
+                # Ответы уже сохранены, остался только отчет
+                pending[pdf_pool.submit(save_report, inspection_id, args.out)] = (path, "report")
+            elif transcript is not None:
+                # Запись уже распознана, осталось получить ответы
+                future = llm_pool.submit(answer_questions, transcript, inspection_id, questions)
+                pending[future] = (path, "answers")
+            else:
+                future = whisper_pool.submit(transcribe_file, path, args.model, args.mode)
+                pending[future] = (path, "transcribe")
+
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path, stage = pending.pop(future)
+                inspection_id = inspections[path]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    save_checkpoint(args.run, path, FAILED, error=f"{stage}: {e}")
+                    progress.update(False, path)
+                    continue
+
+                if stage == "transcribe":
+                    store_transcript(inspection_id, *result)
+                    save_checkpoint(args.run, path, TRANSCRIBED)
+                    pending[llm_pool.submit(answer_questions, result, inspection_id, questions)] = (path, "answers")
+                elif stage == "answers":
+                    save_checkpoint(args.run, path, ANSWERED)
+                    pending[pdf_pool.submit(save_report, inspection_id, args.out)] = (path, "report")
+                else:
+                    save_checkpoint(args.run, path, DONE)
+                    progress.update(True, path)
+
+    if args.archive:
+        done_ids = [inspection_id for path, (stage, inspection_id) in load_checkpoints(args.run).items()
+                    if stage == DONE and inspection_id is not None]
+        with open(args.archive, "wb") as f:
+            f.write(render_reports_archive(done_ids))
+        print(f"Архив отчетов: {args.archive} ({len(done_ids)} шт.)")
+
+    print(f"Готово: {progress.done}, ошибок: {progress.failed}")
+    return 0 if progress.failed == 0 else 2
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Пакетная обработка записей проверок")
+    parser.add_argument("directory", help="Папка с аудиозаписями")
+    parser.add_argument("--run", default=None, help="Имя запуска для продолжения (по умолчанию - имя папки)")
+    parser.add_argument("--survey-id", type=int, required=True, help="ID анкеты")
+    parser.add_argument("--user-id", type=int, default=0, help="ID проверяющего для создаваемых проверок")
+    parser.add_argument("--model", default="medium", help="Модель Whisper")
+    parser.add_argument("--mode", default="full", choices=TRANSCRIPTION_MODES, help="Режим транскрипции")
+    parser.add_argument("--whisper-workers", type=int, default=max(1, (os.cpu_count() or 2) // 4),
+                        help="Процессов транскрипции")
+    parser.add_argument("--llm-workers", type=int, default=8, help="Потоков запросов к YandexGPT")
+    parser.add_argument("--report-workers", type=int, default=2, help="Процессов построения PDF отчетов")
+    parser.add_argument("--out", default="reports", help="Папка для PDF отчетов")
+    parser.add_argument("--archive", default=None, help="Собрать все отчеты запуска в ZIP")
+    args = parser.parse_args(argv)
+    args.run = args.run or os.path.basename(os.path.abspath(args.directory))
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
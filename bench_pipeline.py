@@ -0,0 +1,463 @@
+"""
+Бенчмарк конвейера обработки проверки по этапам и целиком.
+
+Этапы:
+    decode                      - декодирование записи движком распознавания
+    preprocess                  - подготовка аудио (нормализация, обрезка тишины)
+    transcribe:<модель>         - transcribe_audio для каждой модели из --models
+    ya_request_1, ya_request_2  - запросы к локальной детерминированной замене YandexGPT
+    add_answer, add_answers     - запись ответов по одному и пачкой
+    get_null_questions          - поиск неотвеченных вопросов
+    generate_inspection_report  - PDF отчет
+    pipeline                    - вся цепочка от записи до отчета
+
+Записи - синтетические (два "голоса" с паузами, --synthetic длительности в
+секундах) и настоящие из --dir. База и кэши создаются во временной папке,
+рабочие bot.db и cache.db не трогаются. Этап, для которого не установлены
+зависимости (whisper, fpdf, SDK YandexGPT), пропускается с причиной.
+
+Для каждого этапа в JSON: перцентили задержки (мс), пропускная
+способность (операций в секунду), пик памяти Python (tracemalloc) и
+прирост пикового RSS процесса.
+
+Сравнение с сохраненным результатом:
+    python bench_pipeline.py --out bench_baseline.json
+    python bench_pipeline.py --baseline bench_baseline.json --tolerance 0.15
+Этапы, где p50 или p95 выросли больше чем на tolerance, печатаются как
+регрессии, и код возврата - 1. На stdout печатается только отчет JSON,
+ход замеров - в stderr:
+    python bench_pipeline.py --skip-audio 2>/dev/null | jq .stages
+"""
+import os
+import re
+import sys
+import json
+import time
+import wave
+import asyncio
+import argparse
+import contextlib
+import platform
+import resource
+import tempfile
+import datetime
+import tracemalloc
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".m4a", ".ogg", ".flac")
+# Образец записи в репозитории; свои записи передаются через --dir
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "audio")
+
+# Рабочие кэши не должны ни ускорять замеры, ни засоряться ими
+WORK_DIR = tempfile.mkdtemp(prefix="bench_pipeline_")
+os.environ.setdefault("LLM_CACHE_DISABLED", "1")
+os.environ.setdefault("AUDIO_CACHE_DIR", os.path.join(WORK_DIR, "audio_cache"))
+os.environ.setdefault("CACHE_DB", os.path.join(WORK_DIR, "cache.db"))
+
+
+class Skipped(Exception):
+    """Этап нельзя выполнить в этом окружении"""
+
+
+# ---- Замеры ----
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    pos = (len(ordered) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def _peak_rss_mb() -> float:
+    # В Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(name: str, fn, runs: int, warmup: int = 1, items: int = 1) -> dict:
+    """
+    Выполняет fn warmup + runs раз и еще раз под tracemalloc.
+
+    :param items: Сколько операций делает один вызов fn (для пропускной способности)
+    """
+    for _ in range(warmup):
+        fn()
+    rss_before = _peak_rss_mb()
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    rss_after = _peak_rss_mb()
+
+    # tracemalloc замедляет выполнение, поэтому память меряется отдельным прогоном
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    total = sum(latencies)
+    stats = {
+        "runs": runs,
+        "items_per_run": items,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(total / runs * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+        "throughput_per_s": round(runs * items / total, 3) if total else None,
+        "peak_alloc_mb": round(peak / (1024 * 1024), 3),
+        "peak_rss_growth_mb": round(rss_after - rss_before, 1),
+    }
+    print(f"{name}: p50 {stats['p50_ms']} мс, p95 {stats['p95_ms']} мс, "
+          f"{stats['throughput_per_s']} оп/с, пик {stats['peak_alloc_mb']} МБ", file=sys.stderr, flush=True)
+    return stats
+
+
+# ---- Синтетические записи ----
+def _voice(rng, seconds: float, f0: float, formant: float) -> np.ndarray:
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    signal = sum(np.sin(2 * np.pi * f0 * k * t) / k * np.exp(-((f0 * k - formant) / 600) ** 2)
+                 for k in range(1, 30))
+    # Слоговая огибающая ~4 Гц, чтобы энергия менялась как в речи
+    return 0.1 * signal * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t) ** 2)
+
+
+def synthetic_audio(seconds: float, seed: int = 0) -> np.ndarray:
+    """Диалог двух "голосов" с паузами, тишиной в начале и длинной паузой посередине"""
+    rng = np.random.default_rng(seed)
+    parts = [rng.normal(0, 0.001, 3 * SAMPLE_RATE)]
+    total = 3.0
+    speaker = 0
+    while total < seconds - 3:
+        turn = float(rng.uniform(2, 6))
+        f0, formant = ((120, 700), (210, 1500))[speaker]
+        parts.append(_voice(rng, turn, f0, formant))
+        pause = 15.0 if abs(total - seconds / 2) < 3 else float(rng.uniform(0.4, 1.5))
+        parts.append(rng.normal(0, 0.001, int(pause * SAMPLE_RATE)))
+        total += turn + pause
+        speaker = 1 - speaker
+    audio = np.concatenate(parts)[:int(seconds * SAMPLE_RATE)]
+    return audio.astype(np.float32)
+
+
+def write_wav(path: str, audio: np.ndarray):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes((np.clip(audio, -1, 1) * 32767).astype("<i2").tobytes())
+
+
+class WavDecoder:
+    """Чтение WAV без ffmpeg: подготовка аудио меряется отдельно от декодирования"""
+
+    name = "wav"
+
+    def load_audio(self, path: str) -> np.ndarray:
+        with wave.open(str(path), "rb") as f:
+            data = np.frombuffer(f.readframes(f.getnframes()), dtype="<i2")
+        return data.astype(np.float32) / 32768
+
+
+# ---- Замена YandexGPT ----
+class _FakeAlternative:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _FakeResult:
+    def __init__(self, text: str):
+        self.alternatives = [_FakeAlternative(text)]
+
+
+def fake_completion(system: str, text: str) -> str:
+    """Детерминированный ответ в формате, которого ждут ya_request_1 и ya_request_2"""
+    question_ids = re.findall(r"(\d+): '", text)
+    if not question_ids:
+        # Переписывание в диалог: предложения по очереди продавцу и покупателю
+        sentences = [s.strip() for s in re.split(r"(?<=[.?!])\s+", text) if s.strip()]
+        return "\n".join(f"{('Продавец', 'Покупатель')[i % 2]}: {s}" for i, s in enumerate(sentences))
+    # Примерно каждый пятый вопрос остается без ответа, как в настоящих проверках
+    answers = {q_id: None if int(q_id) % 5 == 0 else f"Да, ответ на вопрос {q_id}" for q_id in question_ids}
+    return json.dumps(answers, ensure_ascii=False)
+
+
+class FakeModel:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def run(self, messages: list):
+        await asyncio.sleep(self.latency)
+        return _FakeResult(fake_completion(messages[0]["text"], messages[1]["text"]))
+
+
+def install_fake_llm(latency: float):
+    """Подменяет модель общего клиента: очередь, семафор и повторы клиента работают как обычно"""
+    try:
+        import ya_gpt
+        from ya_client import YandexGPTClient
+    except ImportError as e:
+        raise Skipped(f"клиент YandexGPT недоступен: {e}")
+
+    class FakeYandexGPTClient(YandexGPTClient):
+        def _get_model(self, temperature: float):
+            return FakeModel(latency)
+
+    ya_gpt.client = FakeYandexGPTClient()
+    return ya_gpt
+
+
+# ---- Этапы ----
+def bench_audio(files: list, models: list, mode: str, runs: int) -> dict:
+    from audio_preprocessing import prepare, load_audio
+    from transcription_backends import get_backend
+
+    results = {}
+    wav_files = [path for path in files if path.endswith(".wav")]
+    decoder = WavDecoder()
+    results["preprocess"] = measure(
+        "preprocess", lambda: [prepare(path, decoder, use_cache=False) for path in wav_files],
+        runs, items=len(wav_files))
+
+    engine = get_backend()
+    try:
+        engine.load_audio(files[0])
+    except Exception as e:
+        skipped = {"skipped": f"движок {engine.name} недоступен: {e}"}
+        results["decode"] = skipped
+        for model_name in models:
+            results[f"transcribe:{model_name}"] = skipped
+        return results
+
+    results["decode"] = measure(
+        "decode", lambda: [load_audio(path, engine, use_cache=False) for path in files], runs, items=len(files))
+
+    from whisper_transcription import transcribe_audio
+    for model_name in models:
+        results[f"transcribe:{model_name}"] = measure(
+            f"transcribe:{model_name}",
+            lambda: [transcribe_audio(path, model_name=model_name, save_to_file=False, mode=mode, use_cache=False)
+                     for path in files],
+            runs, warmup=1, items=len(files))
+    return results
+
+
+def seed_database(path: str, questions: int, inspections: int):
+    import db
+    from migrations import migrate
+
+    db.DB_NAME = path
+    migrate(path)
+    db.register_user(1, "bench")
+    with db.transaction() as conn:
+        survey_id = conn.execute("INSERT INTO surveys (client_name) VALUES ('bench')").lastrowid
+        conn.executemany("INSERT INTO questions (survey_id, question_text) VALUES (?, ?)",
+                         [(survey_id, f"Продавец выполнил требование стандарта №{i}?") for i in range(questions)])
+    return survey_id, [db.create_inspection(1, survey_id) for _ in range(inspections)]
+
+
+def bench_database(questions: int, inspections: int, runs: int) -> dict:
+    import db
+    from survey_catalogue import catalogue
+
+    survey_id, inspection_ids = seed_database(os.path.join(WORK_DIR, "bot.db"), questions, inspections)
+    question_ids = [q_id for q_id, _ in catalogue.questions(survey_id)]
+    answers = {q_id: None if q_id % 5 == 0 else "Да" for q_id in question_ids}
+
+    results = {
+        "add_answer": measure(
+            "add_answer",
+            lambda: [db.add_answer(inspection_ids[0], q_id, "Да") for q_id in question_ids],
+            runs, items=len(question_ids)),
+        "add_answers": measure(
+            "add_answers", lambda: [db.add_answers(i, answers) for i in inspection_ids],
+            runs, items=len(inspection_ids)),
+        "get_null_questions": measure(
+            "get_null_questions", lambda: [db.get_null_questions(i) for i in inspection_ids],
+            runs, items=len(inspection_ids)),
+    }
+    try:
+        from reports import render_report
+    except ImportError as e:
+        results["generate_inspection_report"] = {"skipped": f"нет зависимостей отчета: {e}"}
+    else:
+        # generate_inspection_report в боте - обертка над render_report
+        results["generate_inspection_report"] = measure(
+            "generate_inspection_report", lambda: render_report(inspection_ids[0]), runs)
+    return results, survey_id
+
+
+def bench_llm(transcript: str, survey_id: int, latency: float, runs: int) -> dict:
+    from survey_catalogue import catalogue
+
+    try:
+        ya_gpt = install_fake_llm(latency)
+    except Skipped as e:
+        return {"ya_request_1": {"skipped": str(e)}, "ya_request_2": {"skipped": str(e)}}
+    dialogue = ya_gpt.ya_request_1(transcript)
+    prompt = catalogue.questions_prompt(survey_id)
+    return {
+        "ya_request_1": measure("ya_request_1", lambda: ya_gpt.ya_request_1(transcript), runs),
+        "ya_request_2": measure("ya_request_2", lambda: ya_gpt.ya_request_2(dialogue, prompt, mode="auto"), runs),
+    }
+
+
+def bench_pipeline(files: list, survey_id: int, model_name: str, mode: str, latency: float, runs: int) -> dict:
+    """Запись -> транскрипция -> диалог -> ответы -> база -> отчет, как в воркере бота"""
+    try:
+        import db
+        from answer_parser import collect_answers
+        from dialogue_formatter import make_dialogue
+        from reports import render_report
+        from survey_catalogue import catalogue
+        from whisper_transcription import transcribe
+        ya_gpt = install_fake_llm(latency)
+    except (ImportError, Skipped) as e:
+        return {"skipped": str(e)}
+
+    questions = catalogue.question_texts(survey_id)
+    prompt = catalogue.questions_prompt(survey_id)
+
+    def run_one(path: str):
+        inspection_id = db.create_inspection(1, survey_id)
+        result = transcribe(path, model_name=model_name, mode=mode, use_cache=False)
+        dialogue = make_dialogue(result, path)
+        answers = collect_answers(dialogue, questions, ya_gpt.ya_request_2(dialogue, prompt, mode="auto"),
+                                  ask=lambda d, q: ya_gpt.ya_request_2(d, q, use_cache=False))
+        db.add_answers(inspection_id, answers)
+        db.get_null_questions(inspection_id)
+        render_report(inspection_id)
+
+    try:
+        run_one(files[0])
+    except Exception as e:
+        return {"skipped": f"цепочка не выполняется: {e}"}
+    return measure("pipeline", lambda: [run_one(path) for path in files], runs, warmup=0, items=len(files))
+
+
+# ---- Сравнение с базовым результатом ----
+def compare(report: dict, baseline: dict, tolerance: float) -> dict:
+    """
+    Сравнивает p50 и p95 этапов с базовым отчетом.
+
+    :return: {этап: {"p50_ratio", "p95_ratio", "regression"}}
+    """
+    comparison = {}
+    for name, stats in report["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base or "skipped" in stats or "skipped" in base:
+            continue
+        entry = {}
+        regression = False
+        for key in ("p50_ms", "p95_ms"):
+            ratio = stats[key] / base[key] if base[key] else None
+            entry[key.replace("_ms", "_ratio")] = round(ratio, 3) if ratio is not None else None
+            # Разница меньше миллисекунды - шум, а не замедление
+            if ratio is not None and ratio > 1 + tolerance and stats[key] - base[key] > 1.0:
+                regression = True
+        entry["regression"] = regression
+        comparison[name] = entry
+    return comparison
+
+
+def find_audio(directory: str) -> list:
+    if not directory or not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith(AUDIO_EXTENSIONS))
+
+
+def run(args) -> tuple:
+    """
+    Выполняет замеры и сравнение с --baseline.
+
+    :return: (отчет, этапы с регрессией)
+    """
+    files = []
+    for i, seconds in enumerate(args.synthetic):
+        path = os.path.join(WORK_DIR, f"synthetic_{int(seconds)}s.wav")
+        write_wav(path, synthetic_audio(seconds, seed=i))
+        files.append(path)
+    files += find_audio(args.dir)
+
+    stages = {}
+    if not args.skip_audio and files:
+        stages.update(bench_audio(files, args.models, args.mode, args.runs))
+    db_stages, survey_id = bench_database(args.questions, args.inspections, args.runs)
+    stages.update(db_stages)
+
+    transcript_path = os.path.join("files", "transcript1.txt")
+    if os.path.exists(transcript_path):
+        with open(transcript_path, encoding="utf-8") as f:
+            transcript = f.read()
+    else:
+        transcript = "Здравствуйте. Чем могу помочь? Я ищу телевизор. Вот этот со скидкой. " * 40
+    stages.update(bench_llm(transcript, survey_id, args.llm_latency, args.runs))
+    if not args.skip_audio and files:
+        stages["pipeline"] = bench_pipeline(files, survey_id, args.pipeline_model, args.mode,
+                                            args.llm_latency, max(1, args.runs // 2))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "files": [os.path.basename(path) for path in files],
+            "args": vars(args),
+        },
+        "stages": stages,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["comparison"] = compare(report, baseline, args.tolerance)
+        regressions = [name for name, entry in report["comparison"].items() if entry["regression"]]
+        for name, entry in report["comparison"].items():
+            mark = "❌" if entry["regression"] else "✅"
+            print(f"{mark} {name}: p50 x{entry['p50_ratio']}, p95 x{entry['p95_ratio']}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if regressions:
+        print(f"Замедлились этапы: {', '.join(regressions)}")
+    return report, regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера обработки проверки")
+    parser.add_argument("--dir", default=SAMPLES_DIR, help="Папка с настоящими записями")
+    parser.add_argument("--synthetic", nargs="*", type=float, default=[30.0, 120.0],
+                        help="Длительности синтетических записей, в секундах")
+    parser.add_argument("--models", nargs="*", default=["tiny", "base", "small"], help="Модели для transcribe")
+    parser.add_argument("--mode", default="full", help="Режим транскрипции")
+    parser.add_argument("--runs", type=int, default=5, help="Повторов каждого этапа")
+    parser.add_argument("--questions", type=int, default=60, help="Вопросов в анкете")
+    parser.add_argument("--inspections", type=int, default=50, help="Проверок для этапов базы")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Задержка замены YandexGPT, в секундах")
+    parser.add_argument("--pipeline-model", default="base", help="Модель для этапа pipeline")
+    parser.add_argument("--skip-audio", action="store_true", help="Не мерить декодирование и транскрипцию")
+    parser.add_argument("--out", default=None, help="Сохранить отчет в JSON")
+    parser.add_argument("--baseline", default=None, help="Сравнить с отчетом из этого файла")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Допустимый рост p50/p95")
+    args = parser.parse_args(argv)
+
+    # На stdout - только отчет JSON: ход замеров и вывод самого конвейера уходят в stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        report, regressions = run(args)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+Бенчмарк запуска: время до первого ответа бота и до страницы входа приложения.
+
+Каждый замер - новый процесс Python, как при перезапуске или деплое:
+    bot:/start  - от запуска python bot.py до ответа на /start. Бот работает
+                  с поддельным Bot API (fake_bot_api.py), где /start уже ждет
+                  в getUpdates, и с временной базой
+    app:login   - от запуска процесса до готовой страницы входа app.py
+                  (streamlit.testing выполняет скрипт так же, как сервер)
+
+Для каждой цели в JSON: перцентили времени запуска (мс) и самые медленные
+модули при импорте (python -X importtime, отдельный запуск). Цель, для
+которой не установлены зависимости, пропускается с причиной. На stdout
+печатается только отчет JSON, ход замеров - в stderr.
+
+    python bench_startup.py --runs 5 --out startup_baseline.json
+    python bench_startup.py --baseline startup_baseline.json
+    WARMUP=0 python bench_startup.py   # без фонового прогрева
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import datetime
+import subprocess
+
+import fake_bot_api
+from bench_pipeline import percentile, compare
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = tempfile.mkdtemp(prefix="bench_startup_")
+CHAT_ID = 1001
+
+# Выполняется в новом процессе: печатает время, когда страница входа готова
+APP_SCRIPT = '''
+import sys, time, json
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("app.py", default_timeout=float(sys.argv[1])).run()
+labels = [widget.label for widget in at.text_input]
+print(json.dumps({"ready": time.time(), "login": "Логин" in labels,
+                  "errors": [str(e.value) for e in at.exception]}))
+'''
+
+
+class Skipped(Exception):
+    """Цель нельзя запустить в этом окружении"""
+
+
+def _env(**extra) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "BOT_DB": os.path.join(WORK_DIR, "bot.db"),
+        "CACHE_DB": os.path.join(WORK_DIR, "cache.db"),
+        "AUDIO_CACHE_DIR": os.path.join(WORK_DIR, "audio_cache"),
+        "ARTIFACT_DIR": os.path.join(WORK_DIR, "artifacts"),
+        "METRICS_PORT": "0",
+        "PYTHONUNBUFFERED": "1",
+    })
+    env.update(extra)
+    return env
+
+
+def _tail(path: str, lines: int = 5) -> str:
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return " | ".join(f.read().strip().splitlines()[-lines:])
+
+
+def _start_update() -> dict:
+    return {"message": {
+        "message_id": 1, "date": int(time.time()), "text": "/start",
+        "chat": {"id": CHAT_ID, "type": "private"},
+        "from": {"id": CHAT_ID, "is_bot": False, "first_name": "Bench", "username": "bench"},
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    }}
+
+
+def bot_start(timeout: float) -> float:
+    """Секунды от запуска процесса бота до его ответа на /start"""
+    server = fake_bot_api.serve(0)
+    # Бот останавливается посреди long polling, оборванные ответы сервера не интересны
+    server.handle_error = lambda request, client_address: None
+    fake = server.fake
+    fake.push_update(_start_update())
+    log_path = os.path.join(WORK_DIR, "bot.log")
+    env = _env(TELEGRAM_API_URL=f"http://127.0.0.1:{server.server_port}", BOT_TOKEN="123:bench",
+               BOT_MODE="polling")
+    with open(log_path, "w") as log:
+        started = time.time()
+        process = subprocess.Popen([sys.executable, "bot.py"], cwd=BASE_DIR, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        try:
+            while time.time() - started < timeout:
+                replies = [item for item in fake.sent if item["chat_id"] == str(CHAT_ID)]
+                if replies:
+                    return replies[0]["time"] - started
+                if process.poll() is not None:
+                    raise Skipped(f"бот завершился с кодом {process.returncode}: {_tail(log_path)}")
+                time.sleep(0.005)
+            raise Skipped(f"нет ответа на /start за {timeout:.0f} с")
+        finally:
+            process.kill()
+            process.wait()
+            server.shutdown()
+
+
+def app_login(timeout: float) -> float:
+    """Секунды от запуска процесса до готовой страницы входа"""
+    started = time.time()
+    result = subprocess.run([sys.executable, "-c", APP_SCRIPT, str(timeout)], cwd=BASE_DIR,
+                            env=_env(), capture_output=True, text=True, timeout=timeout + 30)
+    if result.returncode != 0:
+        lines = (result.stderr or result.stdout).strip().splitlines()[-3:]
+        raise Skipped(" | ".join(lines) or f"код {result.returncode}")
+    data = json.loads(result.stdout.strip().splitlines()[-1])
+    if not data["login"]:
+        raise Skipped(f"страница входа не отрисована: {data['errors']}")
+    return data["ready"] - started
+
+
+def slowest_imports(args: list, env: dict, timeout: float, top: int = 10) -> list:
+    """
+    Самые медленные модули по суммарному времени импорта (python -X importtime).
+
+    :param args: Аргументы python после -X importtime
+    :return: [[пакет, мс], ...] по убыванию
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=BASE_DIR, env=env,
+                            capture_output=True, text=True, timeout=timeout)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Вложенные модули считаются в своем пакете; берем самый долгий импорт пакета
+        package = name.strip().split(".")[0]
+        times[package] = max(times.get(package, 0.0), int(cumulative) / 1000)
+    slowest = sorted(times.items(), key=lambda item: -item[1])[:top]
+    return [[name, round(ms, 1)] for name, ms in slowest]
+
+
+def measure(target, runs: int, timeout: float) -> dict:
+    """Запускает цель runs раз, каждый раз в новом процессе"""
+    seconds = [target(timeout) for _ in range(runs)]
+    ms = [value * 1000 for value in seconds]
+    return {
+        "runs": runs,
+        "p50_ms": round(percentile(ms, 50), 1),
+        "p95_ms": round(percentile(ms, 95), 1),
+        "min_ms": round(min(ms), 1),
+        "max_ms": round(max(ms), 1),
+    }
+
+
+TARGETS = {
+    "bot:/start": (bot_start, lambda timeout: slowest_imports(["-c", "import bot"],
+                                                              _env(BOT_TOKEN="123:bench"), timeout)),
+    "app:login": (app_login, lambda timeout: slowest_imports(["-c", APP_SCRIPT, str(timeout)], _env(),
+                                                             timeout + 30)),
+}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк запуска бота и приложения")
+    parser.add_argument("--targets", nargs="*", default=list(TARGETS), help="Что мерить")
+    parser.add_argument("--runs", type=int, default=3, help="Запусков каждой цели")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Предельное время запуска, в секундах")
+    parser.add_argument("--out", default=None, help="Сохранить отчет в JSON")
+    parser.add_argument("--baseline", default=None, help="Сравнить с отчетом из этого файла")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Допустимый рост p50/p95")
+    args = parser.parse_args(argv)
+
+    stages = {}
+    for name in args.targets:
+        target, imports = TARGETS[name]
+        try:
+            stages[name] = measure(target, args.runs, args.timeout)
+            stages[name]["slowest_imports"] = imports(args.timeout)
+        except (Skipped, subprocess.TimeoutExpired) as e:
+            stages[name] = {"skipped": str(e)}
+        print(f"{name}: {stages[name]}", file=sys.stderr, flush=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "warmup": os.getenv("WARMUP", "1"),
+            "args": vars(args),
+        },
+        "stages": stages,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["comparison"] = compare(report, baseline, args.tolerance)
+        regressions = [name for name, entry in report["comparison"].items() if entry["regression"]]
+        for name, entry in report["comparison"].items():
+            mark = "❌" if entry["regression"] else "✅"
+            print(f"{mark} {name}: p50 x{entry['p50_ratio']}, p95 x{entry['p95_ratio']}", file=sys.stderr)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if regressions:
+        print(f"Запуск замедлился: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Сравнение движков распознавания: скорость (RTF) и качество (WER).
+
+RTF - время распознавания, деленное на длительность записи (меньше 1 -
+быстрее реального времени). WER считается по эталонной расшифровке
+<имя записи>.txt рядом с аудио; если ее нет, эталоном служит результат
+первой конфигурации в списке, и WER показывает расхождение с ней.
+
+Конфигурация задается как движок:модель[:compute_type], например:
+    python bench_transcription.py --dir calls/2025-03 \\
+        --configs openai-whisper:medium faster-whisper:medium:int8 faster-whisper:medium:float32
+
+Каскад (черновая модель, затем точная для неуверенных отрезков) задается
+как движок:черновая>точная, например openai-whisper:small>medium; для него
+в отчет добавляется доля повторно распознанной записи (escalated_ratio).
+"""
+import os
+import re
+import gc
+import sys
+import json
+import time
+import argparse
+
+from transcription_backends import BACKENDS, FasterWhisperBackend, SAMPLE_RATE
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".m4a", ".ogg", ".flac")
+# Образец записи в репозитории; свои записи передаются через --dir
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "audio")
+
+
+def normalize_words(text: str) -> list:
+    return re.findall(r"\w+", text.lower().replace("ё", "е"))
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Доля замен, вставок и удалений слов относительно эталона"""
+    ref = normalize_words(reference)
+    hyp = normalize_words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    # Расстояние Левенштейна по словам, одна строка таблицы в памяти
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hyp, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def make_backend(config: str):
+    parts = config.split(":")
+    name, model_name = parts[0], parts[1] if len(parts) > 1 else "medium"
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный движок: {name}")
+    if name == FasterWhisperBackend.name and len(parts) > 2:
+        return FasterWhisperBackend(compute_type=parts[2]), model_name
+    return BACKENDS[name](), model_name
+
+
+def find_audio(directory: str) -> list:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith(AUDIO_EXTENSIONS))
+
+
+def read_reference(path: str):
+    reference = os.path.splitext(path)[0] + ".txt"
+    if os.path.exists(reference):
+        with open(reference, encoding="utf-8") as f:
+            return f.read()
+    return None
+
+
+def run_cascade(config: str, files: list, language: str, runs: int) -> dict:
+    from whisper_transcription import transcribe_cascade
+    from model_registry import registry
+
+    name, models = config.split(":", 1)
+    draft_model, model_name = models.split(">")
+    backend = make_backend(name)[0]
+    started = time.perf_counter()
+    registry.preload(draft_model, model_name, language=language, background=False, backend=name)
+    load_seconds = time.perf_counter() - started
+
+    texts = {}
+    audio_seconds = 0.0
+    escalated_seconds = 0.0
+    transcribe_seconds = 0.0
+    for path in files:
+        for _ in range(runs):
+            started = time.perf_counter()
+            audio = backend.load_audio(path)
+            result = transcribe_cascade(audio, model_name, draft_model, language, name)
+            transcribe_seconds += time.perf_counter() - started
+            audio_seconds += result["cascade"]["audio_seconds"]
+            escalated_seconds += result["cascade"]["escalated_seconds"]
+        texts[path] = result["text"]
+
+    registry.evict(draft_model, language, backend=name)
+    registry.evict(model_name, language, backend=name)
+    gc.collect()
+    return {
+        "config": config,
+        "load_seconds": round(load_seconds, 2),
+        "audio_seconds": round(audio_seconds, 1),
+        "transcribe_seconds": round(transcribe_seconds, 2),
+        "rtf": round(transcribe_seconds / audio_seconds, 3) if audio_seconds else None,
+        "escalated_ratio": round(escalated_seconds / audio_seconds, 3) if audio_seconds else None,
+        "texts": texts,
+    }
+
+
+def run_config(config: str, files: list, language: str, runs: int) -> dict:
+    if ">" in config:
+        return run_cascade(config, files, language, runs)
+    backend, model_name = make_backend(config)
+    started = time.perf_counter()
+    model = backend.load(model_name)
+    load_seconds = time.perf_counter() - started
+
+    texts = {}
+    audio_seconds = 0.0
+    transcribe_seconds = 0.0
+    for path in files:
+        audio_seconds += len(backend.load_audio(path)) / SAMPLE_RATE * runs
+        for _ in range(runs):
+            # Декодирование входит в замер, как и при обычной работе
+            started = time.perf_counter()
+            result = backend.transcribe(model, path, language)
+            transcribe_seconds += time.perf_counter() - started
+        texts[path] = result["text"]
+
+    del model
+    gc.collect()
+    return {
+        "config": config,
+        "load_seconds": round(load_seconds, 2),
+        "audio_seconds": round(audio_seconds, 1),
+        "transcribe_seconds": round(transcribe_seconds, 2),
+        "rtf": round(transcribe_seconds / audio_seconds, 3) if audio_seconds else None,
+        "texts": texts,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="RTF и WER движков распознавания")
+    parser.add_argument("--dir", default=SAMPLES_DIR, help="Папка с записями")
+    parser.add_argument("--configs", nargs="+",
+                        default=["openai-whisper:medium", "faster-whisper:medium:int8"],
+                        help="Конфигурации движок:модель[:compute_type] или движок:черновая>точная; "
+                             "первая - эталон, если нет .txt")
+    parser.add_argument("--language", default="ru")
+    parser.add_argument("--runs", type=int, default=1, help="Повторов распознавания каждой записи")
+    parser.add_argument("--out", default=None, help="Сохранить результат в JSON")
+    args = parser.parse_args(argv)
+
+    files = find_audio(args.dir)
+    if not files:
+        print(f"В {args.dir} нет записей ({', '.join(AUDIO_EXTENSIONS)}), укажите папку с записями: --dir",
+              file=sys.stderr)
+        return 1
+
+    results = [run_config(config, files, args.language, args.runs) for config in args.configs]
+
+    baseline = results[0]["texts"]
+    for result in results:
+        errors = []
+        for path, text in result["texts"].items():
+            reference = read_reference(path)
+            errors.append(word_error_rate(reference if reference is not None else baseline[path], text))
+        result["wer"] = round(sum(errors) / len(errors), 4)
+        result["wer_reference"] = "txt" if all(read_reference(p) is not None for p in files) else args.configs[0]
+        del result["texts"]
+
+    report = {"files": [os.path.basename(path) for path in files], "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Замер пикового потребления памяти при обработке загрузки в Streamlit.
+
+Сравнивает прежнюю схему (getvalue() в session_state + копия во временный
+файл) и потоковую запись на диск из uploads.spool_upload. Каждый вариант
+запускается в отдельном процессе, чтобы пики не смешивались.
+
+peak_rss_mb - пиковый RSS процесса, retained_mb - сколько памяти остается
+занято сессиями после того, как Streamlit отпустил сами загрузки.
+
+Запуск: python bench_upload.py [размер в МБ] [число сессий]
+"""
+import gc
+import io
+import os
+import sys
+import json
+import resource
+import subprocess
+import tempfile
+
+
+def _peak_mb() -> float:
+    # В Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _legacy(upload, session):
+    if session.get("audio_data") == upload.getvalue():
+        return
+    session["audio_data"] = upload.getvalue()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
+        tmp.write(upload.read())
+    os.unlink(tmp.name)
+
+
+def _streaming(upload, session):
+    from uploads import spool_upload
+    digest, path = spool_upload(upload)
+    session["audio_digest"] = digest
+    os.unlink(path)
+
+
+def _worker(strategy: str, size_mb: int, sessions: int):
+    run = _legacy if strategy == "legacy" else _streaming
+    states = [{} for _ in range(sessions)]
+    before = _rss_mb()
+    for state in states:
+        # Streamlit держит загрузку как BytesIO над bytes, пока файл выбран в загрузчике
+        upload = io.BytesIO(os.urandom(size_mb * 1024 * 1024))
+        run(upload, state)
+        # Пользователь загрузил другой файл или закрыл вкладку - Streamlit отпускает буфер
+        del upload
+    gc.collect()
+    print(json.dumps({"strategy": strategy, "size_mb": size_mb, "sessions": sessions,
+                      "peak_rss_mb": round(_peak_mb(), 1),
+                      "retained_mb": round(_rss_mb() - before, 1)}))
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    sessions = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    results = []
+    for strategy in ("legacy", "streaming"):
+        out = subprocess.run([sys.executable, __file__, "--worker", strategy, str(size_mb), str(sessions)],
+                             capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        results.append(json.loads(out.stdout))
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        _worker(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main()
@@ -10,291 +10,532 @@ sys.stdout.reconfigure(encoding='utf-8')
 sys.stderr
 
 
+import io
 import os
-import sqlite3
+import re
+import asyncio
+import threading
 import datetime
+import requests
 import telebot
-from telebot import types
-import json
-from fpdf import FPDF
+from telebot import types, apihelper
 
-from whisper_transcription import transcribe_audio
-from ya_gpt import ya_request_1, ya_request_2
+import artifacts
+import db
+import metrics
+import warmup
+from answer_parser import collect_answers
+from db import register_user, add_answer, add_answers, get_null_questions
+from job_queue import JobQueue, WorkerPool
+from migrations import migrate
+from outbox import Outbox, sync_sender, async_sender
+from reports import render_report, report_filename
+from search_index import search, store_transcript, KIND_NAMES
+from session_store import SQLiteSessionStore, InspectionSession, PROCESSING, QUESTIONS, DONE, FAILED
+from survey_catalogue import catalogue
+from uploads import MAX_UPLOAD_MB
+from ya_gpt import ya_request_2
 
 # Конфигурация
-BOT_TOKEN = ''
-DB_NAME = 'bot.db'
-AUDIO_DIR = 'temp_audio'
+BOT_TOKEN = os.getenv('BOT_TOKEN', '')
+BOT_MODE = os.getenv('BOT_MODE', 'polling')  # polling, async, webhook или worker
+# Адрес Bot API; можно указать локальный тестовый сервер (fake_bot_api.py)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL') or None
+# Вебхук: публичный адрес бота и где слушать входящие запросы
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+DB_NAME = db.DB_NAME
+TRANSCRIPTION_WORKERS = int(os.getenv('TRANSCRIPTION_WORKERS', '2'))
+TRANSCRIPTION_MODE = os.getenv('TRANSCRIPTION_MODE', 'auto')  # full, chunked или auto
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'medium')
+ANSWERS_MODE = os.getenv('ANSWERS_MODE', 'auto')  # single, mapreduce или auto
+# Анкета для новых проверок, пока проверяющий не выбрал другую командой /survey
+DEFAULT_SURVEY_ID = int(os.getenv('DEFAULT_SURVEY_ID', '3'))
 
-# Инициализация бота и папки для аудио
+# Inline-клавиатура Telegram вмещает не больше 100 кнопок
+MAX_QUESTION_BUTTONS = 100
+ANSWER_PROMPT = "✏️ Проверка #{inspection_id}, вопрос {num}: {text}\nОтветьте на это сообщение"
+ANSWER_PROMPT_RE = re.compile(r'^✏️ Проверка #(\d+), вопрос (\d+):')
+
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL.rstrip('/') + '/bot{0}/{1}'
+    apihelper.FILE_URL = TELEGRAM_API_URL.rstrip('/') + '/file/bot{0}/{1}'
+
+# Синхронный бот нужен во всех режимах: через него воркеры скачивают файлы
 bot = telebot.TeleBot(BOT_TOKEN)
-os.makedirs(AUDIO_DIR, exist_ok=True)
 
-# Хранение состояния пользователей
-user_states = {}  # {user_id: list_of_question_ids}
+# Все исходящие сообщения идут через общую очередь с ограничением частоты
+outbox = Outbox(sync_sender(bot))
+
+# Приводим схему базы к актуальной версии
+migrate(DB_NAME)
+
+# Очередь задач обработки аудио
+job_queue = JobQueue(DB_NAME)
 
-def get_questions_by_survey_id(survey_id: int) -> list:
+# Состояние диалогов хранится в базе, поэтому бот можно запускать в нескольких процессах
+sessions = SQLiteSessionStore(DB_NAME)
+
+def get_questions_by_survey_id(survey_id: int) -> str:
     """
     Получает список вопросов по ID анкеты.
     
     :param survey_id: ID анкеты
     :return: Список вопросов (текст вопросов)
     """
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-
-    # Выполняем SQL-запрос для получения вопросов
-    cursor.execute('''
-        SELECT question_id, question_text FROM questions WHERE survey_id = ?
-    ''', (survey_id,))
-
-    # Получаем все строки результата
-    questions = str({row[0]: row[1] for row in cursor.fetchall()})
-    conn.close()
-    return questions
-
-def get_question_by_id(question_id: int) -> str:
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('SELECT question_text FROM questions WHERE question_id = ?', (question_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
-
-def register_user(user_id, username):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    try:
-        c.execute("INSERT INTO users (username, user_id, created_at) VALUES (?, ?, ?)",
-                  (username, user_id, datetime.datetime.now()))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        pass
-    finally:
-        conn.close()
+    return catalogue.questions_prompt(survey_id)
 
-def add_answer(inspection_id: int, question_id: int, answer_text: str):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    # Обновляем существующую запись или вставляем новую
-    cursor.execute('''
-        UPDATE answers SET answer_text = ? 
-        WHERE inspection_id = ? AND question_id = ?
-    ''', (answer_text, inspection_id, question_id))
-    
-    if cursor.rowcount == 0:
-        cursor.execute('''
-            INSERT INTO answers (inspection_id, question_id, answer_text)
-            VALUES (?, ?, ?)
-        ''', (inspection_id, question_id, answer_text))
-    
-    conn.commit()
-    conn.close()
-
-def get_null_questions(inspection_id: int) -> list:
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT question_id FROM answers 
-        WHERE inspection_id = ? AND answer_text = "null"
-    ''', (inspection_id,))
-    null_questions = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return null_questions
-
-def send_null_questions_to_bot(user_id, questions):
-    if not questions:
-        bot.send_message(user_id, "🎉 Все вопросы заполнены! Формируем отчет...")
-        send_report_to_user(user_id, inspection_id=2)
+def question_keyboard(session: InspectionSession, remaining: list):
+    """Кнопки с номерами вопросов; нажатие просит ответить на выбранный вопрос"""
+    numbers = [num for num, q_id in enumerate(session.question_ids, 1) if q_id in remaining]
+    if len(numbers) > MAX_QUESTION_BUTTONS:
+        return None
+    markup = types.InlineKeyboardMarkup(row_width=8)
+    markup.add(*[types.InlineKeyboardButton(str(num), callback_data=f"answer:{session.inspection_id}:{num}")
+                 for num in numbers])
+    return markup
+
+def send_null_questions_to_bot(session: InspectionSession):
+    user_id = session.user_id
+    remaining = set(get_null_questions(session.inspection_id))
+    if not remaining:
+        sessions.set_state(session.inspection_id, DONE)
+        outbox.send_message(user_id, f"🎉 Все вопросы проверки #{session.inspection_id} заполнены! Формируем отчет...")
+        send_report_to_user(user_id, inspection_id=session.inspection_id)
         return
 
-    user_states[user_id] = questions  # Сохраняем вопросы для пользователя
-    
-    bot.send_message(user_id, "❓ Вопросы, требующие ответов:")
-    for i, q_id in enumerate(questions, 1):
-        question_text = get_question_by_id(q_id)
-        if question_text:
-            bot.send_message(user_id, f"{i}. {question_text}\n/answer {i} [ваш ответ]")
-            
-class PDF(FPDF):
-    def __init__(self):
-        super().__init__()
-        self.add_font('DejaVu', '', 'DejaVuSans.ttf', uni=True)
-        self.set_font('DejaVu', '', 12)
-def generate_inspection_report(inspection_id: int) -> str:
-    """Генерирует PDF отчет с поддержкой UTF-8"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT q.question_text, a.answer_text 
-        FROM answers a
-        JOIN questions q ON a.question_id = q.question_id
-        WHERE a.inspection_id = ?
-        ORDER BY q.question_id
-    ''', (inspection_id,))
-    
-    report_data = cursor.fetchall()
-    conn.close()
-    
-    if not report_data:
-        return None
-    
-    pdf = PDF()
-    pdf.add_page()
-    
-    # Заголовок
-    pdf.set_font('DejaVu', '', 16)
-    pdf.cell(200, 10, txt="ОТЧЕТ О ПРОВЕРКЕ", ln=True, align='C')
-    pdf.ln(15)
-    
-    # Содержание
-    pdf.set_font('DejaVu', '', 12)
-    for idx, (question, answer) in enumerate(report_data, 1):
-        # Проверка и преобразование текста
-        def safe_text(text):
-            return text if isinstance(text, str) else str(text, 'utf-8')
-        
-        question = safe_text(question)
-        answer = safe_text(answer)
-        
-        pdf.multi_cell(0, 8, f"Вопрос #{idx}:\n{question}", 0, 'L')
-        pdf.multi_cell(0, 8, f"Ответ:\n{answer}", 0, 'L')
-        pdf.ln(10)
-    
-    filename = f"report_{inspection_id}.pdf"
-    filepath = os.path.join(AUDIO_DIR, filename)
-    pdf.output(filepath)
-    
-    return filepath
+    # Весь список уходит одним-двумя сообщениями вместо сообщения на каждый вопрос.
+    # Номера вопросов постоянны в пределах проверки, поэтому старые кнопки остаются верными
+    lines = [f"❓ Проверка #{session.inspection_id}: вопросы, требующие ответов:"]
+    for num, q_id in enumerate(session.question_ids, 1):
+        question_text = catalogue.question_text(q_id)
+        if q_id in remaining and question_text:
+            lines.append(f"{num}. {question_text}")
+    lines.append("Нажмите номер вопроса или отправьте /answer [номер] [ваш ответ]")
+    outbox.send_messages(user_id, lines, reply_markup=question_keyboard(session, remaining))
+
+@metrics.span("report.render")
+def generate_inspection_report(inspection_id: int) -> bytes:
+    """
+    PDF отчет по проверке.
+
+    Отчет зависит только от вопросов и ответов, поэтому, пока они не менялись,
+    берется из хранилища, в том числе готовый отчет с теми же ответами.
+    """
+    fingerprint = artifacts.input_fingerprint(db.get_report_rows(inspection_id))
+    cached = artifacts.store.reuse(inspection_id, artifacts.REPORT, fingerprint)
+    if cached is not None:
+        return cached.read_bytes()
+    report = render_report(inspection_id)
+    if report:
+        artifacts.store.put_bytes(inspection_id, artifacts.REPORT, report, ".pdf", fingerprint)
+    return report
 
 def send_report_to_user(user_id: int, inspection_id: int):
     """Генерирует и отправляет отчет пользователю"""
     try:
-        report_path = generate_inspection_report(inspection_id)
-        if not report_path:
-            bot.send_message(user_id, "❌ Не удалось сформировать отчет")
+        report = generate_inspection_report(inspection_id)
+        if not report:
+            outbox.send_message(user_id, "❌ Не удалось сформировать отчет")
             return
-            
-        with open(report_path, 'rb') as report_file:
-            bot.send_document(
-                chat_id=user_id,
-                document=report_file,
-                caption=f"📄 Отчет по проверке #{inspection_id}",
-                timeout=30
-            )
-        
-        # Удаляем временный файл
-        os.remove(report_path)
-        
+
+        # Отчет отправляется прямо из памяти, без временного файла
+        outbox.send(
+            user_id, 'send_document',
+            document=io.BytesIO(report),
+            visible_file_name=report_filename(inspection_id),
+            caption=f"📄 Отчет по проверке #{inspection_id}",
+            timeout=30
+        ).result()
+
     except Exception as e:
-        bot.send_message(user_id, f"❌ Ошибка при создании отчета: {str(e)}")
+        outbox.send_message(user_id, f"❌ Ошибка при создании отчета: {str(e)}")
+
 
+def reply(message, text, **kwargs):
+    return outbox.send_message(message.chat.id, text,
+                               reply_parameters=types.ReplyParameters(message.message_id), **kwargs)
 
-@bot.message_handler(commands=['start'])
 def handle_start(message):
     register_user(message.from_user.id, message.from_user.username)
-    bot.reply_to(message, "Добро пожаловать! Отправьте аудио /process_audio")
+    reply(message, "Добро пожаловать! Отправьте аудио /process_audio")
 
-@bot.message_handler(commands=['process_audio'])
 def handle_process_audio(message):
-    msg = bot.reply_to(message, "Отправьте аудиофайл в формате MP3")
-    bot.register_next_step_handler(msg, process_audio_step)
+    reply(message, "Отправьте аудиофайл в формате MP3")
+
+def handle_survey(message):
+    """/survey [ID] - анкета для следующих проверок"""
+    user_id = message.from_user.id
+    args = message.text.split()
+    if len(args) < 2:
+        current = sessions.survey_for(user_id, DEFAULT_SURVEY_ID)
+        outbox.send_message(user_id, f"📋 Текущая анкета: {current}\nСменить: /survey [ID анкеты]")
+        return
+    if not args[1].isdigit() or not catalogue.exists(int(args[1])) or not catalogue.questions(int(args[1])):
+        outbox.send_message(user_id, "❌ Анкета не найдена")
+        return
+    register_user(user_id, message.from_user.username)
+    sessions.set_survey(user_id, int(args[1]))
+    outbox.send_message(user_id, f"✅ Новые проверки будут по анкете {args[1]}")
+
+STATE_NAMES = {PROCESSING: "обрабатывается", QUESTIONS: "ждет ответов"}
+
+def handle_inspections(message):
+    """/inspections - незавершенные проверки пользователя"""
+    user_id = message.from_user.id
+    open_sessions = sessions.open_sessions(user_id)
+    if not open_sessions:
+        outbox.send_message(user_id, "Незавершенных проверок нет")
+        return
+    active = sessions.active(user_id)
+    lines = ["📂 Незавершенные проверки:"]
+    for session in open_sessions:
+        mark = " ← ответы /answer идут сюда" if active and active.inspection_id == session.inspection_id else ""
+        lines.append(f"#{session.inspection_id}: {STATE_NAMES[session.state]}{mark}")
+    lines.append("Выбрать проверку для /answer: /inspection [номер]")
+    outbox.send_messages(user_id, lines)
+
+def handle_search(message):
+    """/search [слова] - поиск по расшифровкам и ответам своих проверок"""
+    user_id = message.from_user.id
+    query = message.text.partition(' ')[2].strip()
+    if not query:
+        outbox.send_message(user_id, "Укажите, что искать: /search трейд-ин")
+        return
+    with metrics.span("search"):
+        results = search(query, user_id=user_id, limit=10)
+    if not results:
+        outbox.send_message(user_id, f"🔎 По запросу «{query}» ничего не найдено")
+        return
+    lines = [f"🔎 Найдено по запросу «{query}»:"]
+    for result in results:
+        source = KIND_NAMES[result['kind']]
+        if result['question']:
+            source = f"{source} на «{result['question']}»"
+        lines.append(f"#{result['inspection_id']} ({source}): {result['snippet']}")
+    outbox.send_messages(user_id, lines)
+
+def handle_inspection(message):
+    """/inspection [ID] - выбрать проверку и заново получить ее вопросы"""
+    user_id = message.from_user.id
+    args = message.text.split()
+    if len(args) < 2 or not args[1].isdigit() or not sessions.activate(user_id, int(args[1])):
+        outbox.send_message(user_id, "❌ Укажите номер проверки, ожидающей ответов: /inspection [номер]")
+        return
+    send_null_questions_to_bot(sessions.get(int(args[1])))
+
+def save_user_answer(session: InspectionSession, question_num: int, answer_text: str):
+    """Сохраняет ответ на вопрос с номером из списка проверки и присылает оставшиеся"""
+    user_id = session.user_id
+    question_id = session.question_id(question_num)
+
+    if question_id is None:
+        outbox.send_message(user_id, f"❌ Номер должен быть от 1 до {len(session.question_ids)}")
+        return
+
+    add_answer(session.inspection_id, question_id, answer_text)
+
+    # Обновляем список вопросов; если ответов больше не нужно, придет отчет
+    send_null_questions_to_bot(session)
+
+def user_session(user_id: int, inspection_id: int = None):
+    """Проверка пользователя, ожидающая ответов: указанная или активная"""
+    session = sessions.get(inspection_id) if inspection_id is not None else sessions.active(user_id)
+    if session is None or session.user_id != user_id or session.state != QUESTIONS:
+        return None
+    return session
 
-@bot.message_handler(commands=['answer'])
 def handle_answer(message):
     try:
         user_id = message.from_user.id
         args = message.text.split()
         
         if len(args) < 3:
-            bot.send_message(user_id, "❌ Формат: /answer [номер] [ответ]")
+            outbox.send_message(user_id, "❌ Формат: /answer [номер] [ответ]")
             return
             
         _, num_str, *answer_parts = args
         answer_text = ' '.join(answer_parts)
         
         if not num_str.isdigit():
-            bot.send_message(user_id, "❌ Номер должен быть числом")
+            outbox.send_message(user_id, "❌ Номер должен быть числом")
             return
-            
-        question_num = int(num_str)
-        questions = user_states.get(user_id, [])
-        
-        if not (1 <= question_num <= len(questions)):
-            bot.send_message(user_id, f"❌ Номер должен быть от 1 до {len(questions)}")
+
+        session = user_session(user_id)
+        if session is None:
+            outbox.send_message(user_id, "❌ Нет проверок, ожидающих ответов")
             return
-            
-        question_id = questions[question_num-1]
-        add_answer(2, question_id, answer_text)
-        
-        # Обновляем список вопросов
-        remaining_questions = get_null_questions(2)
-        if remaining_questions:
-            send_null_questions_to_bot(user_id, remaining_questions)
-        else:
-            bot.send_message(user_id, "✅ Все ответы сохранены! Формируем отчет...")
-            send_report_to_user(user_id, inspection_id=2)
-            del user_states[user_id]
-            
+        save_user_answer(session, int(num_str), answer_text)
+
+    except Exception as e:
+        outbox.send_message(user_id, f"❌ Ошибка: {str(e)}")
+
+def is_answer_button(call):
+    return (call.data or '').startswith('answer:')
+
+def handle_answer_button(call):
+    """Нажатие кнопки с номером: присылаем вопрос, ответ на который сохранится"""
+    user_id = call.from_user.id
+    outbox.send(user_id, 'answer_callback_query', callback_query_id=call.id)
+    _, inspection_id, num = call.data.split(':')
+    session = user_session(user_id, int(inspection_id))
+    question_id = session.question_id(int(num)) if session else None
+    if question_id is None:
+        outbox.send_message(user_id, "❌ Эта проверка уже не ждет ответов")
+        return
+    question_text = catalogue.question_text(question_id)
+    outbox.send_message(user_id, ANSWER_PROMPT.format(inspection_id=inspection_id, num=num, text=question_text),
+                        reply_markup=types.ForceReply(selective=True))
+
+def is_answer_reply(message):
+    original = message.reply_to_message
+    return original is not None and ANSWER_PROMPT_RE.match(original.text or '') is not None
+
+def handle_answer_reply(message):
+    user_id = message.from_user.id
+    try:
+        inspection_id, num = ANSWER_PROMPT_RE.match(message.reply_to_message.text).groups()
+        session = user_session(user_id, int(inspection_id))
+        if session is None:
+            outbox.send_message(user_id, "❌ Эта проверка уже не ждет ответов")
+            return
+        save_user_answer(session, int(num), message.text)
     except Exception as e:
-        bot.send_message(user_id, f"❌ Ошибка: {str(e)}")
+        outbox.send_message(user_id, f"❌ Ошибка: {str(e)}")
 
 def process_audio_step(message):
+    """Принимает аудио и ставит его в очередь обработки, не блокируя бота"""
+    user_id = message.from_user.id
     try:
-        user_id = message.from_user.id
-        
-        # Скачивание и сохранение аудио
         if message.document and message.document.mime_type == 'audio/mpeg':
             file_id = message.document.file_id
         elif message.audio and message.audio.mime_type == 'audio/mpeg':
             file_id = message.audio.file_id
         else:
-            bot.send_message(user_id, "❌ Требуется MP3 файл!")
+            outbox.send_message(user_id, "❌ Требуется MP3 файл!")
             return
-            
-        file_info = bot.get_file(file_id)
-        audio_path = os.path.join(AUDIO_DIR, f"{user_id}_{datetime.datetime.now().timestamp()}.mp3")
-        
-        with open(audio_path, 'wb') as f:
-            f.write(bot.download_file(file_info.file_path))
-        
-        # Обработка аудио
-        bot.send_message(user_id, "🔄 Обработка аудио...")
-        text = transcribe_audio(audio_path)
-        
-        # GPT обработка
-        bot.send_message(user_id, "🔄 Анализ содержания...")
-        result1 = ya_request_1(text)
-        with open('files/transcript1.txt', 'w', encoding='utf-8') as f:
-            f.write(result1)
-        bot.send_message(user_id, "🔄 Формирование ответов...")
-        survey_questions = get_questions_by_survey_id(3)
-        result2 = ya_request_2(result1, survey_questions)
-        with open('files/transcript2.txt', 'w', encoding='utf-8') as f:
-            f.write(result2)
-        # Парсинг и сохранение ответов
-        try:
-            result2 = str(result2)
-            result2 = result2.replace("```", "")
-            answers = json.loads(result2)
-            for q_id, answer in answers.items():
-                add_answer(2, int(q_id), str(answer))
-        except Exception as e:
-            bot.send_message(user_id, f"❌ Ошибка парсинга ответов: {str(e)}")
+
+        survey_id = sessions.survey_for(user_id, DEFAULT_SURVEY_ID)
+        if not catalogue.exists(survey_id):
+            outbox.send_message(user_id, f"❌ Анкета {survey_id} не найдена. Выберите анкету: /survey [ID анкеты]")
             return
-        
-        # Отправка неотвеченных вопросов
-        null_questions = get_null_questions(2)
-        send_null_questions_to_bot(user_id, null_questions)
-        
-        os.remove(audio_path)
-        
+
+        # Каждая запись - отдельная проверка, их может быть несколько одновременно
+        with metrics.span("telegram.enqueue"):
+            register_user(user_id, message.from_user.username)
+            session = sessions.start(user_id, survey_id, file_id)
+            job_id = job_queue.enqueue(user_id, file_id, inspection_id=session.inspection_id)
+            ahead = job_queue.position(job_id)
+        outbox.send_message(user_id, f"📥 Аудио принято в обработку (проверка #{session.inspection_id}, "
+                                     f"задача #{job_id}, перед вами в очереди: {ahead})")
+
     except Exception as e:
-        bot.send_message(user_id, f"❌ Ошибка: {str(e)}")
-        if 'audio_path' in locals() and os.path.exists(audio_path):
-            os.remove(audio_path)
+        outbox.send_message(user_id, f"❌ Ошибка: {str(e)}")
+
+def retry_questions(dialogue, questions):
+    # Повторный запрос должен дать новый ответ, а не вернуть прежний из кэша,
+    # и идти тем же путем, что и основной: длинный диалог - по частям (map-reduce)
+    return ya_request_2(dialogue, questions, use_cache=False, mode=ANSWERS_MODE)
+
+def run_audio_job(job):
+    """Выполняет задачу обработки аудио в воркере, сообщая пользователю о каждом этапе"""
+    user_id = job['user_id']
+    if job['inspection_id'] is None:
+        # Задача, поставленная до появления сессий проверок
+        survey_id = sessions.survey_for(user_id, DEFAULT_SURVEY_ID)
+        if not catalogue.exists(survey_id):
+            outbox.send_message(user_id, f"❌ Анкета {survey_id} не найдена. Выберите анкету: /survey [ID анкеты]")
+            return
+        session = sessions.start(user_id, survey_id, job['file_id'])
+    else:
+        session = sessions.get(job['inspection_id'])
+    with metrics.inspection(session.inspection_id), metrics.span("job.total"):
+        process_inspection(job, session)
+
+def telegram_file_chunks(file_path: str):
+    """Файл из Telegram порциями: в памяти одновременно только одна порция"""
+    url = apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}"
+    with requests.get(url.format(BOT_TOKEN, file_path), stream=True, proxies=apihelper.proxy,
+                      timeout=(apihelper.CONNECT_TIMEOUT, apihelper.READ_TIMEOUT)) as response:
+        response.raise_for_status()
+        yield from response.iter_content(artifacts.CHUNK_SIZE)
+
+def download_audio(job, inspection_id: int) -> artifacts.Artifact:
+    """Запись проверки в хранилище; при повторе задачи заново не скачивается"""
+    audio = artifacts.store.get(inspection_id, artifacts.AUDIO)
+    if audio is not None:
+        return audio
+    file_info = bot.get_file(job['file_id'])
+    return artifacts.store.write(inspection_id, artifacts.AUDIO, telegram_file_chunks(file_info.file_path),
+                                 suffix=".mp3", max_bytes=int(MAX_UPLOAD_MB * 1024 * 1024))
+
+def process_inspection(job, session: InspectionSession):
+    # Распознавание тянет numpy и torch; импортируется при первой записи или прогревом,
+    # чтобы бот после перезапуска сразу отвечал на команды
+    from dialogue_formatter import make_dialogue, DIALOGUE_FORMATTER
+    from whisper_transcription import transcribe, print_stats, cache_model_name
+
+    job_id = job['job_id']
+    user_id = job['user_id']
+    inspection_id = session.inspection_id
+    survey_id = session.survey_id
+    sessions.set_state(inspection_id, PROCESSING)
+
+    def stage(name, text):
+        job_queue.set_stage(job_id, name)
+        outbox.send_message(user_id, f"{text} (проверка #{inspection_id})")
+
+    try:
+        # Запись скачивается порциями прямо в хранилище файлов проверок
+        job_queue.set_stage(job_id, 'download')
+        with metrics.span("telegram.download") as details:
+            audio = download_audio(job, inspection_id)
+            details['bytes'] = audio.size
+
+        # Обработка аудио; хэш записи уже посчитан при сохранении
+        stage('transcribe', "🔄 Обработка аудио...")
+        transcription = transcribe(audio.path, model_name=WHISPER_MODEL, mode=TRANSCRIPTION_MODE,
+                                   digest=audio.sha256)
+        print_stats(transcription)
+
+        # Диалог по ролям строится локально, YandexGPT - только если голоса не разделились.
+        # Ту же запись с теми же моделью, движком, подготовкой аудио и режимом диалога уже
+        # разбирали (повтор задачи, повторная отправка) - диалог берется готовым
+        stage('dialogue', "🔄 Анализ содержания...")
+        fingerprint = artifacts.input_fingerprint(
+            artifacts.DIALOGUE, audio.sha256, cache_model_name(WHISPER_MODEL, mode=TRANSCRIPTION_MODE),
+            TRANSCRIPTION_MODE, DIALOGUE_FORMATTER)
+        cached = artifacts.store.reuse(inspection_id, artifacts.DIALOGUE, fingerprint)
+        if cached is not None:
+            result1 = cached.read_text()
+        else:
+            result1 = make_dialogue(transcription, audio.path)
+            artifacts.store.put_text(inspection_id, artifacts.DIALOGUE, result1, fingerprint)
+        with metrics.span("db.store_transcript"):
+            store_transcript(inspection_id, transcription['text'], result1)
+        stage('answers', "🔄 Формирование ответов...")
+        questions = catalogue.question_texts(survey_id)
+        result2 = ya_request_2(result1, catalogue.questions_prompt(survey_id), mode=ANSWERS_MODE)
+        artifacts.store.put_text(inspection_id, artifacts.LLM_ANSWERS, result2)
+        # Парсинг ответов; о пропущенных и пустых вопросах модель переспрашивается отдельно
+        answers = collect_answers(result1, questions, result2, ask=retry_questions)
+        if not any(answer is not None for answer in answers.values()):
+            raise ValueError("ошибка парсинга ответов: модель не вернула ни одного ответа")
+        with metrics.span("db.save_answers") as details:
+            add_answers(inspection_id, answers)
+            details['answers'] = len(answers)
+
+        # Отправка неотвеченных вопросов; их номера фиксируются в сессии
+        job_queue.set_stage(job_id, 'questions')
+        sessions.set_state(inspection_id, QUESTIONS, get_null_questions(inspection_id))
+        send_null_questions_to_bot(sessions.get(inspection_id))
+
+    except Exception as e:
+        sessions.set_state(inspection_id, FAILED)
+        outbox.send_message(user_id, f"❌ Ошибка в проверке #{inspection_id}: {str(e)}")
+        raise
+
+# Обработчики одинаковы для синхронного и асинхронного бота
+HANDLERS = (
+    (handle_start, 'message_handler', {'commands': ['start']}),
+    (handle_process_audio, 'message_handler', {'commands': ['process_audio']}),
+    (handle_answer, 'message_handler', {'commands': ['answer']}),
+    (handle_survey, 'message_handler', {'commands': ['survey']}),
+    (handle_inspections, 'message_handler', {'commands': ['inspections']}),
+    (handle_inspection, 'message_handler', {'commands': ['inspection']}),
+    (handle_search, 'message_handler', {'commands': ['search']}),
+    (handle_answer_button, 'callback_query_handler', {'func': is_answer_button}),
+    (handle_answer_reply, 'message_handler', {'func': is_answer_reply, 'content_types': ['text']}),
+    (process_audio_step, 'message_handler', {'content_types': ['audio', 'document']}),
+)
+
+def register_handlers(target, wrap=None):
+    for handler, kind, filters in HANDLERS:
+        getattr(target, kind)(**filters)(wrap(handler) if wrap else handler)
+
+def in_thread(handler):
+    """Обработчики синхронно работают с SQLite, поэтому выполняются вне event loop"""
+    async def run(update):
+        await asyncio.to_thread(handler, update)
+    return run
+
+async def serve_webhook(async_bot):
+    """Принимает обновления от Telegram по HTTPS-вебхуку"""
+    from aiohttp import web
+
+    background = set()
+
+    async def handle_update(request):
+        if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        update = types.Update.de_json(await request.text())
+        # Telegram ждет быстрого ответа, обновление обрабатывается в фоне
+        task = asyncio.ensure_future(async_bot.process_new_updates([update]))
+        background.add(task)
+        task.add_done_callback(background.discard)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT).start()
+    await async_bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                                secret_token=WEBHOOK_SECRET or None)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+async def run_async(webhook: bool = False, workers: WorkerPool = None):
+    """
+    :param workers: Пул воркеров; запускается, когда очередь сообщений уже
+                    привязана к event loop бота, иначе первая же задача из
+                    очереди запустила бы очередь сообщений в своем потоке
+    """
+    from telebot import asyncio_helper
+    from telebot.async_telebot import AsyncTeleBot
+
+    if TELEGRAM_API_URL:
+        asyncio_helper.API_URL = apihelper.API_URL
+        asyncio_helper.FILE_URL = apihelper.FILE_URL
+    async_bot = AsyncTeleBot(BOT_TOKEN)
+    register_handlers(async_bot, wrap=in_thread)
+    # Сообщения отправляются асинхронно из того же event loop
+    outbox.sender = async_sender(async_bot)
+    outbox.start(asyncio.get_running_loop())
+    if workers is not None:
+        workers.start()
+    if webhook:
+        await serve_webhook(async_bot)
+    else:
+        await async_bot.delete_webhook()
+        await async_bot.infinity_polling()
 
 if __name__ == '__main__':
-    bot.polling(none_stop=True)
\ No newline at end of file
+    # Недописанные и потерянные после падения файлы проверок
+    artifacts.store.recover()
+    metrics.serve()
+    # Воркеры подхватывают и незавершенные до перезапуска задачи, поэтому запускаются
+    # только после очереди сообщений: задача сразу пишет пользователю о своем этапе
+    workers = WorkerPool(job_queue, run_audio_job, workers=TRANSCRIPTION_WORKERS)
+    if BOT_MODE == 'worker':
+        # Дополнительный процесс только обрабатывает записи из общей очереди;
+        # обновления Telegram получает один процесс в режиме polling/async/webhook
+        outbox.start()
+        workers.start()
+        warmup.warm_up(delay=0)
+        threading.Event().wait()
+    elif BOT_MODE in ('async', 'webhook'):
+        # Модули распознавания и модели загружаются в фоне, пока бот уже отвечает на команды
+        warmup.warm_up()
+        asyncio.run(run_async(webhook=BOT_MODE == 'webhook', workers=workers))
+    else:
+        register_handlers(bot)
+        outbox.start()
+        workers.start()
+        warmup.warm_up()
+        bot.polling(none_stop=True)
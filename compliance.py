@@ -0,0 +1,104 @@
+"""
+Сводка выполнения пунктов анкет для панели администратора.
+
+Таблица compliance_stats хранит по каждому вопросу, проверяющему и месяцу
+число ответов "Да", "Нет" и всех ответов. Ее обновляют триггеры на answers
+в той же транзакции, что и сами ответы (add_answer, add_answers), поэтому
+панель читает несколько сотен строк сводки вместо всей таблицы ответов.
+
+Триггеры не отслеживают правку самих проверок (смену анкеты, проверяющего
+или даты) - после таких правок и для заполнения задним числом сводка
+пересобирается целиком: python compliance.py rebuild [путь к базе]
+"""
+import sys
+
+import db
+from migrations import COMPLIANCE_BACKFILL
+
+# Разрезы сводки: колонка группировки и подпись
+DIMENSIONS = {
+    "client": ("s.client_name", "Клиент"),
+    "survey": ("c.survey_id", "Анкета"),
+    "question": ("c.question_id", "Вопрос"),
+    "user": ("c.user_id", "Проверяющий"),
+    "month": ("c.month", "Месяц"),
+}
+
+
+def rebuild(db_name: str = None) -> int:
+    """
+    Пересчитывает compliance_stats по всем ответам.
+
+    :return: Число строк сводки
+    """
+    with db.transaction(db_name) as conn:
+        conn.execute('DELETE FROM compliance_stats')
+        conn.execute(COMPLIANCE_BACKFILL)
+        return conn.execute('SELECT COUNT(*) FROM compliance_stats').fetchone()[0]
+
+
+def months(db_name: str = None) -> list:
+    """Месяцы ('YYYY-MM'), за которые есть ответы, по возрастанию"""
+    rows = db.get_connection(db_name).execute(
+        'SELECT DISTINCT month FROM compliance_stats WHERE total > 0 ORDER BY month').fetchall()
+    return [row[0] for row in rows]
+
+
+def pass_rates(group_by=("question",), survey_id: int = None, client_name: str = None, user_id: int = None,
+               month_from: str = None, month_to: str = None, db_name: str = None) -> list:
+    """
+    Доля выполненных пунктов в разрезах group_by.
+
+    :param group_by: Разрезы из DIMENSIONS, например ("client", "month")
+    :param month_from: Первый месяц 'YYYY-MM' (включительно)
+    :param month_to: Последний месяц 'YYYY-MM' (включительно)
+    :return: [{<разрезы>, "passed", "failed", "total", "pass_rate"}, ...];
+             для вопроса добавляется question_text, pass_rate - доля "Да"
+             среди ответов "Да" и "Нет" или None, если таких ответов нет
+    """
+    unknown = [name for name in group_by if name not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Неизвестный разрез: {', '.join(unknown)}")
+    columns = [DIMENSIONS[name][0] for name in group_by]
+    if "question" in group_by:
+        columns.append("q.question_text")
+
+    conditions = ["c.total > 0"]
+    params = []
+    for condition, value in (("c.survey_id = ?", survey_id), ("s.client_name = ?", client_name),
+                             ("c.user_id = ?", user_id), ("c.month >= ?", month_from),
+                             ("c.month <= ?", month_to)):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+
+    select = ", ".join(columns + ["SUM(c.passed)", "SUM(c.failed)", "SUM(c.total)"])
+    group = f"GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}" if columns else ""
+    rows = db.get_connection(db_name).execute(f'''
+        SELECT {select}
+        FROM compliance_stats c
+        LEFT JOIN surveys s ON s.survey_id = c.survey_id
+        LEFT JOIN questions q ON q.question_id = c.question_id
+        WHERE {' AND '.join(conditions)}
+        {group}
+    ''', params).fetchall()
+
+    keys = list(group_by) + (["question_text"] if "question" in group_by else [])
+    results = []
+    for row in rows:
+        passed, failed, total = row[-3:]
+        if total is None:
+            continue
+        item = dict(zip(keys, row))
+        item.update(passed=passed, failed=failed, total=total,
+                    pass_rate=round(passed / (passed + failed), 4) if passed + failed else None)
+        results.append(item)
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print("Использование: python compliance.py rebuild [путь к базе]")
+        sys.exit(2)
+    db_path = sys.argv[2] if len(sys.argv) > 2 else None
+    print(f"Сводка пересобрана: {rebuild(db_path)} строк")
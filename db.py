@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import datetime
+import threading
+from contextlib import contextmanager
+
+# ---- Настройки БД ----
+DB_NAME = os.getenv('BOT_DB', 'bot.db')
+
+# Применяются к каждому новому соединению
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',      # читатели не блокируют писателя
+    'PRAGMA synchronous = NORMAL',    # в режиме WAL это безопасно и намного быстрее FULL
+    'PRAGMA busy_timeout = 10000',    # ждем блокировку вместо "database is locked"
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',     # ~16 МБ страничного кэша
+)
+# Сколько подготовленных запросов sqlite3 держит в кэше соединения
+CACHED_STATEMENTS = 256
+
+_local = threading.local()
+
+
+def get_connection(db_name: str = None) -> sqlite3.Connection:
+    """
+    Возвращает соединение текущего потока, создавая его при первом обращении.
+
+    Соединение работает в режиме autocommit, транзакции открываются явно
+    через transaction().
+    """
+    db_name = db_name or DB_NAME
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(db_name)
+    if conn is None:
+        conn = sqlite3.connect(db_name, timeout=30, isolation_level=None,
+                               cached_statements=CACHED_STATEMENTS)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        connections[db_name] = conn
+    return conn
+
+
+def close_connection(db_name: str = None):
+    """Закрывает соединение текущего потока."""
+    connections = getattr(_local, 'connections', {})
+    conn = connections.pop(db_name or DB_NAME, None)
+    if conn is not None:
+        conn.close()
+
+
+@contextmanager
+def transaction(db_name: str = None):
+    """Выполняет блок в одной транзакции с блокировкой на запись с самого начала."""
+    conn = get_connection(db_name)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+# ---- Запросы ----
+# Тексты запросов постоянны, поэтому sqlite3 переиспользует подготовленные выражения
+SQL_QUESTIONS_BY_SURVEY = 'SELECT question_id, question_text FROM questions WHERE survey_id = ? ORDER BY question_id'
+SQL_QUESTION_BY_ID = 'SELECT question_text FROM questions WHERE question_id = ?'
+SQL_REGISTER_USER = 'INSERT OR IGNORE INTO users (username, user_id, created_at) VALUES (?, ?, ?)'
+SQL_UPSERT_ANSWER = '''
+    INSERT INTO answers (inspection_id, question_id, answer_text)
+    VALUES (?, ?, ?)
+    ON CONFLICT (inspection_id, question_id) DO UPDATE SET answer_text = excluded.answer_text
+'''
+SQL_NULL_QUESTIONS = '''
+    SELECT question_id FROM answers
+    WHERE inspection_id = ? AND answer_text = 'null'
+    ORDER BY question_id
+'''
+SQL_REPORT_ROWS = '''
+    SELECT q.question_text, a.answer_text
+    FROM answers a
+    JOIN questions q ON a.question_id = q.question_id
+    WHERE a.inspection_id = ?
+    ORDER BY q.question_id
+'''
+
+
+def get_questions(survey_id: int) -> list:
+    """
+    Получает вопросы анкеты.
+
+    :param survey_id: ID анкеты
+    :return: Список пар (question_id, question_text)
+    """
+    return get_connection().execute(SQL_QUESTIONS_BY_SURVEY, (survey_id,)).fetchall()
+
+
+def get_question_by_id(question_id: int) -> str:
+    result = get_connection().execute(SQL_QUESTION_BY_ID, (question_id,)).fetchone()
+    return result[0] if result else None
+
+
+def register_user(user_id, username):
+    with transaction() as conn:
+        conn.execute(SQL_REGISTER_USER, (username, user_id, datetime.datetime.now()))
+
+
+def add_answer(inspection_id: int, question_id: int, answer_text: str):
+    with transaction() as conn:
+        conn.execute(SQL_UPSERT_ANSWER, (inspection_id, question_id, answer_text))
+
+
+def add_answers(inspection_id: int, answers: dict):
+    """
+    Сохраняет сразу все ответы проверки одной транзакцией.
+
+    :param inspection_id: ID проверки
+    :param answers: Словарь {question_id: answer_text}, None сохраняется как "null"
+    """
+    rows = [(inspection_id, int(q_id), 'null' if answer is None else str(answer))
+            for q_id, answer in answers.items()]
+    with transaction() as conn:
+        conn.executemany(SQL_UPSERT_ANSWER, rows)
+
+
+def create_inspection(user_id: int, survey_id: int, file_id=None) -> int:
+    """Создает проверку и возвращает ее ID"""
+    with transaction() as conn:
+        cursor = conn.execute(
+            'INSERT INTO inspections (user_id, survey_id, file_id, created_at) VALUES (?, ?, ?, ?)',
+            (user_id, survey_id, file_id, datetime.datetime.now()))
+        return cursor.lastrowid
+
+
+def get_null_questions(inspection_id: int) -> list:
+    rows = get_connection().execute(SQL_NULL_QUESTIONS, (inspection_id,)).fetchall()
+    return [row[0] for row in rows]
+
+
+def get_report_rows(inspection_id: int) -> list:
+    """Возвращает пары (вопрос, ответ) для отчета по проверке."""
+    return get_connection().execute(SQL_REPORT_ROWS, (inspection_id,)).fetchall()
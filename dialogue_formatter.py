@@ -0,0 +1,265 @@
+"""
+Диалог "Продавец: ... / Покупатель: ..." из сегментов Whisper без запроса к YandexGPT.
+
+Сегменты склеиваются в реплики по паузам, реплики делятся на двух
+говорящих кластеризацией спектральных признаков звука, а роли
+определяются по характерным фразам продавца и покупателя. Если голоса
+разделились плохо, в режиме auto диалог по-старому переписывает
+YandexGPT (ya_request_1).
+"""
+import os
+
+import numpy as np
+
+import metrics
+from audio_preprocessing import load_audio
+from transcription_backends import get_backend, SAMPLE_RATE
+
+# ---- Настройки ----
+# local - только локально, llm - всегда YandexGPT, auto - YandexGPT, если голоса не разделились
+DIALOGUE_FORMATTER = os.getenv("DIALOGUE_FORMATTER", "auto")
+DIALOGUE_MODES = ("local", "llm", "auto")
+# Пауза, после которой начинается новая реплика, в секундах
+TURN_PAUSE_SECONDS = float(os.getenv("DIALOGUE_TURN_PAUSE", "1.0"))
+# После вопроса реплика сменяется и на короткой паузе
+QUESTION_PAUSE_SECONDS = 0.3
+# Минимальное отношение расстояния между голосами к разбросу внутри голоса
+MIN_SEPARATION = float(os.getenv("DIALOGUE_MIN_SEPARATION", "1.2"))
+# Доля реплик второго говорящего, ниже которой разделение считается неудачным
+MIN_SPEAKER_SHARE = 0.1
+# Реплики короче этого не участвуют в поиске центров кластеров, в секундах
+MIN_FIT_SECONDS = 1.0
+# Из длинной реплики для признаков берется не больше стольких секунд
+MAX_FEATURE_SECONDS = 10.0
+
+SELLER = "Продавец"
+BUYER = "Покупатель"
+
+SELLER_PHRASES = ("чем могу помочь", "чем помочь", "что вас интересует", "могу предложить", "рекомендую",
+                  "у нас есть", "у нас сейчас", "акци", "скидк", "оформ", "бонус", "гаранти",
+                  "пройдемте", "давайте я", "вам подойдет", "карта магазина", "пакет нужен")
+BUYER_PHRASES = ("хотел", "хочу", "ищу", "сколько стоит", "а есть", "можно посмотреть", "подскажите",
+                 "посоветуйте", "а какой", "а какая", "я подумаю", "мне нужн")
+
+_FRAME = int(0.025 * SAMPLE_RATE)
+_HOP = int(0.010 * SAMPLE_RATE)
+_N_FFT = 512
+_N_BANDS = 24
+
+
+class Turn:
+    """Реплика одного говорящего"""
+
+    __slots__ = ("start", "end", "text", "speaker")
+
+    def __init__(self, start: float, end: float, text: str, speaker: str = None):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.speaker = speaker
+
+
+def split_turns(segments: list, pause: float = TURN_PAUSE_SECONDS) -> list:
+    """Склеивает сегменты Whisper в реплики по паузам"""
+    turns = []
+    for seg in segments:
+        text = seg["text"].strip()
+        if not text:
+            continue
+        if turns:
+            prev = turns[-1]
+            gap = seg["start"] - prev.end
+            if gap < pause and not (prev.text.endswith("?") and gap >= QUESTION_PAUSE_SECONDS):
+                prev.end = seg["end"]
+                prev.text = f"{prev.text} {text}"
+                continue
+        turns.append(Turn(seg["start"], seg["end"], text))
+    return turns
+
+
+def _band_edges() -> np.ndarray:
+    # Полосы равной ширины в мел-шкале от 80 Гц до 4 кГц
+    mel = np.linspace(2595 * np.log10(1 + 80 / 700), 2595 * np.log10(1 + 4000 / 700), _N_BANDS + 1)
+    hz = 700 * (10 ** (mel / 2595) - 1)
+    return np.unique(np.round(hz / SAMPLE_RATE * _N_FFT).astype(int))
+
+
+def turn_features(audio: np.ndarray, turns: list) -> np.ndarray:
+    """
+    Признаки голоса каждой реплики: среднее и разброс логарифма энергии в мел-полосах.
+
+    :return: Матрица (реплики x признаки)
+    """
+    edges = _band_edges()
+    window = np.hanning(_FRAME).astype(np.float32)
+    max_len = int(MAX_FEATURE_SECONDS * SAMPLE_RATE)
+    features = []
+    for turn in turns:
+        lo = int(turn.start * SAMPLE_RATE)
+        hi = min(len(audio), int(turn.end * SAMPLE_RATE))
+        if hi - lo > max_len:
+            # Середина реплики: начало и конец чаще задевают чужой голос
+            lo += (hi - lo - max_len) // 2
+            hi = lo + max_len
+        chunk = np.asarray(audio[lo:hi], dtype=np.float32)
+        if len(chunk) < _FRAME:
+            features.append(np.zeros(2 * (len(edges) - 1), dtype=np.float32))
+            continue
+        n_frames = 1 + (len(chunk) - _FRAME) // _HOP
+        frames = np.lib.stride_tricks.as_strided(
+            chunk, shape=(n_frames, _FRAME), strides=(chunk.strides[0] * _HOP, chunk.strides[0]))
+        power = np.abs(np.fft.rfft(frames * window, n=_N_FFT)) ** 2
+        bands = np.log(np.stack([power[:, a:b].sum(axis=1) for a, b in zip(edges[:-1], edges[1:])], axis=1) + 1e-10)
+        # Тихие кадры (паузы между словами) не характеризуют голос
+        loud = bands.sum(axis=1) >= np.percentile(bands.sum(axis=1), 30)
+        bands = bands[loud] if loud.any() else bands
+        features.append(np.concatenate([bands.mean(axis=0), bands.std(axis=0)]))
+    return np.array(features, dtype=np.float32)
+
+
+def cluster_speakers(features: np.ndarray, weights: np.ndarray, iterations: int = 20):
+    """
+    Делит реплики на два голоса (k-means по косинусному расстоянию).
+
+    :param weights: Длительность реплик; короткие реплики не влияют на центры
+    :return: (метки 0/1, отношение расстояния между центрами к разбросу внутри)
+    """
+    n = len(features)
+    if n < 2:
+        return np.zeros(n, dtype=int), 0.0
+    # Нормализация признаков по записи: остается различие голосов, а не канала
+    x = features - features.mean(axis=0)
+    x /= x.std(axis=0) + 1e-6
+    x /= np.linalg.norm(x, axis=1, keepdims=True) + 1e-6
+
+    fit = weights >= MIN_FIT_SECONDS
+    if fit.sum() < 2:
+        fit = np.ones(n, dtype=bool)
+    # Начальные центры - две самые непохожие реплики
+    sim = x[fit] @ x[fit].T
+    i, j = np.unravel_index(np.argmin(sim), sim.shape)
+    centers = np.stack([x[fit][i], x[fit][j]])
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = np.argmax(x @ centers.T, axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for k in (0, 1):
+            members = fit & (labels == k)
+            if members.any():
+                center = (x[members] * weights[members, None]).sum(axis=0)
+                centers[k] = center / (np.linalg.norm(center) + 1e-6)
+
+    if len(set(labels[fit])) < 2:
+        return labels, 0.0
+    within = np.mean([1 - x[m] @ centers[labels[m]] for m in np.flatnonzero(fit)])
+    between = 1 - centers[0] @ centers[1]
+    return labels, float(between / (within + 1e-6))
+
+
+def _phrase_score(text: str, phrases: tuple) -> int:
+    text = text.lower().replace("ё", "е")
+    return sum(text.count(phrase) for phrase in phrases)
+
+
+def assign_roles(turns: list, labels) -> dict:
+    """
+    Какой из двух голосов продавец.
+
+    Решают характерные фразы; при равенстве продавцом считается тот,
+    кто говорит дольше (он рассказывает о товаре).
+    """
+    score = {0: 0.0, 1: 0.0}
+    for turn, label in zip(turns, labels):
+        label = int(label)
+        score[label] += _phrase_score(turn.text, SELLER_PHRASES) - _phrase_score(turn.text, BUYER_PHRASES)
+        # Длительность решает только при равном счете фраз
+        score[label] += (turn.end - turn.start) * 1e-4
+    seller = max(score, key=score.get)
+    return {seller: SELLER, 1 - seller: BUYER}
+
+
+def render(turns: list) -> str:
+    """Текст диалога; подряд идущие реплики одного говорящего объединяются"""
+    lines = []
+    speaker = None
+    for turn in turns:
+        if turn.speaker == speaker and lines:
+            lines[-1] = f"{lines[-1]} {turn.text}"
+        else:
+            lines.append(f"{turn.speaker}: {turn.text}")
+            speaker = turn.speaker
+    return "\n".join(lines)
+
+
+def format_dialogue(segments: list, audio: np.ndarray = None):
+    """
+    Строит диалог из сегментов Whisper.
+
+    :param segments: Сегменты с временем в исходной записи
+    :param audio: Запись 16 кГц моно; без нее реплики просто чередуются
+    :return: (текст диалога, оценка разделения голосов; 0 - голоса не различены)
+    """
+    turns = split_turns(segments)
+    if not turns:
+        return "", 0.0
+
+    if audio is None or len(turns) < 2:
+        labels = np.arange(len(turns)) % 2
+        separation = 0.0
+    else:
+        weights = np.array([turn.end - turn.start for turn in turns], dtype=np.float32)
+        labels, separation = cluster_speakers(turn_features(audio, turns), weights)
+        minority = min(np.mean(labels == 0), np.mean(labels == 1))
+        if minority < MIN_SPEAKER_SHARE:
+            separation = 0.0
+
+    roles = assign_roles(turns, labels)
+    for turn, label in zip(turns, labels):
+        turn.speaker = roles[int(label)]
+    return render(turns), separation
+
+
+def local_dialogue(result: dict, audio_path=None, mode: str = None, backend: str = None):
+    """
+    Диалог без YandexGPT или None, если его нужно получить от модели.
+
+    :param result: Результат transcribe() с сегментами
+    :param audio_path: Запись для разделения голосов; декодированный массив
+                       берется из кэша подготовки аудио
+    :param mode: local, llm или auto; по умолчанию DIALOGUE_FORMATTER
+    """
+    mode = mode or DIALOGUE_FORMATTER
+    if mode not in DIALOGUE_MODES:
+        raise ValueError(f"Неизвестный режим диалога: {mode}")
+    if mode == "llm" or not result.get("segments"):
+        return None
+
+    audio = None
+    if audio_path is not None:
+        try:
+            audio = load_audio(audio_path, get_backend(backend))
+        except Exception as e:
+            print(f"Не удалось прочитать запись для разделения голосов: {e}")
+    text, separation = format_dialogue(result["segments"], audio)
+    if mode == "auto" and separation < MIN_SEPARATION:
+        return None
+    return text
+
+
+def make_dialogue(result: dict, audio_path=None, mode: str = None, use_cache: bool = True) -> str:
+    """
+    Диалог "Продавец / Покупатель" по результату transcribe().
+
+    Локально, а если локальный диалог ненадежен (или mode=llm) - запросом ya_request_1.
+    """
+    with metrics.span("dialogue.local") as details:
+        dialogue = local_dialogue(result, audio_path, mode)
+        details["fallback"] = dialogue is None
+    metrics.inc("shopper_dialogue_total", source="llm" if dialogue is None else "local")
+    if dialogue is not None:
+        return dialogue
+    from ya_gpt import ya_request_1
+    return ya_request_1(result["text"], use_cache=use_cache)
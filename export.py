@@ -0,0 +1,125 @@
+import io
+import csv
+
+import db
+from survey_catalogue import catalogue
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_MIME = "text/csv"
+
+HEADER = ["ID проверки", "Дата", "Клиент", "ID анкеты", "ID проверяющего",
+          "ID вопроса", "Вопрос", "Ответ"]
+# Сколько строк читать из SQLite за раз
+FETCH_SIZE = 1000
+
+
+def iter_answer_rows(survey_id: int = None, client_name: str = None, date_from=None, date_to=None):
+    """
+    Построчно читает ответы проверок с фильтрами, не загружая все в память.
+
+    :param survey_id: ID анкеты
+    :param client_name: Название клиента
+    :param date_from: Начальная дата проверки (включительно)
+    :param date_to: Конечная дата проверки (включительно)
+    :return: Генератор строк в порядке HEADER
+    """
+    conditions = []
+    params = []
+    if survey_id is not None:
+        conditions.append("i.survey_id = ?")
+        params.append(survey_id)
+    if client_name:
+        conditions.append("s.client_name = ?")
+        params.append(client_name)
+    if date_from is not None:
+        conditions.append("date(i.created_at) >= date(?)")
+        params.append(str(date_from))
+    if date_to is not None:
+        conditions.append("date(i.created_at) <= date(?)")
+        params.append(str(date_to))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    conn = db.get_connection()
+    cursor = conn.execute(f'''
+        SELECT i.inspection_id, i.created_at, s.client_name, i.survey_id, i.user_id,
+               a.question_id, q.question_text, a.answer_text
+        FROM inspections i
+        JOIN answers a ON a.inspection_id = i.inspection_id
+        JOIN questions q ON q.question_id = a.question_id
+        LEFT JOIN surveys s ON s.survey_id = i.survey_id
+        {where}
+        ORDER BY i.inspection_id, a.question_id
+    ''', params)
+    try:
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def rows_to_xlsx(rows, header=HEADER, sheet_title="Ответы") -> bytes:
+    """Пишет строки в XLSX в режиме write_only: строки не копятся в памяти"""
+    # openpyxl импортируется только при выгрузке, чтобы не замедлять запуск приложения
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_title)
+    sheet.append(header)
+    for row in rows:
+        sheet.append(list(row))
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def rows_to_csv(rows, header=HEADER) -> bytes:
+    buffer = io.BytesIO()
+    # utf-8-sig, чтобы Excel правильно открыл кириллицу
+    text = io.TextIOWrapper(buffer, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text, delimiter=";")
+    writer.writerow(header)
+    writer.writerows(rows)
+    text.flush()
+    data = buffer.getvalue()
+    text.detach()
+    return data
+
+
+def export_answers(fmt: str = "xlsx", **filters) -> bytes:
+    """
+    Выгружает ответы многих проверок в XLSX или CSV в памяти.
+
+    :param fmt: xlsx или csv
+    :param filters: Фильтры iter_answer_rows
+    """
+    rows = iter_answer_rows(**filters)
+    if fmt == "csv":
+        return rows_to_csv(rows)
+    if fmt == "xlsx":
+        return rows_to_xlsx(rows)
+    raise ValueError(f"Неизвестный формат: {fmt}")
+
+
+def save_to_excel(analysis: dict, target=None, survey_id: int = None):
+    """
+    Сохраняет результат одного анализа в XLSX.
+
+    :param analysis: Словарь {question_id: ответ}
+    :param target: Путь или файловый объект; если не указан, возвращаются байты
+    :param survey_id: ID анкеты для подстановки текстов вопросов
+    """
+    questions = catalogue.question_texts(survey_id) if survey_id is not None else {}
+    rows = ((q_id, questions.get(int(q_id)) if str(q_id).isdigit() else None,
+             "" if answer is None else str(answer))
+            for q_id, answer in analysis.items())
+    data = rows_to_xlsx(rows, header=["ID вопроса", "Вопрос", "Ответ"], sheet_title="Анализ")
+    if target is None:
+        return data
+    if hasattr(target, "write"):
+        target.write(data)
+    else:
+        with open(target, "wb") as f:
+            f.write(data)
@@ -0,0 +1,222 @@
+"""
+Локальный поддельный Bot API Telegram для проверки бота без сети.
+
+Сервер отвечает на вызовы бота, запоминает отправленные сообщения и,
+как настоящий Telegram, возвращает 429 с retry_after при превышении
+лимитов частоты. Обновления для бота кладутся через POST /_fake/updates
+и отдаются в getUpdates либо пересылаются на вебхук после setWebhook.
+
+Запуск сервера:
+    python fake_bot_api.py --port 8081
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=test python bot.py
+
+Проверка очереди исходящих сообщений (нужен pyTelegramBotAPI):
+    python fake_bot_api.py --check 200 --chats 5
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.request
+from collections import deque, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Лимиты Telegram, которые изображает сервер
+GLOBAL_LIMIT = 30  # сообщений в секунду на бота
+CHAT_LIMIT = 5  # сообщений в секунду в один чат
+
+SEND_METHODS = {"sendMessage", "sendDocument", "sendAudio", "sendPhoto", "editMessageText"}
+
+
+class FakeTelegram:
+    def __init__(self, global_limit: int = GLOBAL_LIMIT, chat_limit: int = CHAT_LIMIT):
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.lock = threading.Lock()
+        self.sent = []
+        self.rejected = 0
+        self.updates = deque()
+        self.update_id = 0
+        self.message_id = 0
+        self.webhook = None
+        self.secret_token = None
+        self._global_window = deque()
+        self._chat_windows = defaultdict(deque)
+
+    def _over_limit(self, window: deque, limit: int, now: float) -> bool:
+        while window and now - window[0] >= 1.0:
+            window.popleft()
+        return len(window) >= limit
+
+    def call(self, method: str, params: dict):
+        with self.lock:
+            if method in SEND_METHODS:
+                chat_id = str(params.get("chat_id"))
+                now = time.monotonic()
+                chat_window = self._chat_windows[chat_id]
+                if self._over_limit(self._global_window, self.global_limit, now) or \
+                        self._over_limit(chat_window, self.chat_limit, now):
+                    self.rejected += 1
+                    return 429, {"ok": False, "error_code": 429,
+                                 "description": "Too Many Requests: retry after 1",
+                                 "parameters": {"retry_after": 1}}
+                self._global_window.append(now)
+                chat_window.append(now)
+                self.message_id += 1
+                self.sent.append({"method": method, "chat_id": chat_id, "time": time.time(),
+                                  "text": params.get("text") or params.get("caption")})
+                return 200, {"ok": True, "result": self._message(chat_id, params.get("text"))}
+
+            if method == "getMe":
+                return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Fake",
+                                                    "username": "fake_bot"}}
+            if method == "getUpdates":
+                offset = int(params.get("offset") or 0)
+                while self.updates and self.updates[0]["update_id"] < offset:
+                    self.updates.popleft()
+                return 200, {"ok": True, "result": list(self.updates)}
+            if method == "setWebhook":
+                self.webhook = params.get("url") or None
+                self.secret_token = params.get("secret_token")
+                return 200, {"ok": True, "result": True}
+            if method == "deleteWebhook":
+                self.webhook = None
+                return 200, {"ok": True, "result": True}
+            if method == "getFile":
+                return 200, {"ok": True, "result": {"file_id": params.get("file_id"),
+                                                    "file_unique_id": "fake", "file_path": "audio/fake.mp3"}}
+            return 200, {"ok": True, "result": True}
+
+    def _message(self, chat_id: str, text: str) -> dict:
+        return {"message_id": self.message_id, "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"}, "text": text}
+
+    def push_update(self, update: dict):
+        with self.lock:
+            self.update_id += 1
+            update = {"update_id": self.update_id, **update}
+            webhook = self.webhook
+            headers = {"Content-Type": "application/json"}
+            if self.secret_token:
+                headers["X-Telegram-Bot-Api-Secret-Token"] = self.secret_token
+            if webhook is None:
+                self.updates.append(update)
+        if webhook is not None:
+            request = urllib.request.Request(webhook, data=json.dumps(update).encode(), headers=headers)
+            urllib.request.urlopen(request, timeout=10).close()
+
+    def stats(self) -> dict:
+        with self.lock:
+            per_chat = defaultdict(int)
+            for item in self.sent:
+                per_chat[item["chat_id"]] += 1
+            return {"sent": len(self.sent), "rejected_429": self.rejected, "per_chat": dict(per_chat)}
+
+
+def _params(handler) -> dict:
+    length = int(handler.headers.get("Content-Length") or 0)
+    body = handler.rfile.read(length) if length else b""
+    content_type = handler.headers.get("Content-Type", "")
+    if "json" in content_type:
+        return json.loads(body or b"{}")
+    if "multipart" in content_type:
+        # Файлы не разбираем, достаточно полей формы
+        params = {}
+        for part in body.split(b"--"):
+            head, _, value = part.partition(b"\r\n\r\n")
+            if b'name="' in head and b"filename=" not in head:
+                name = head.split(b'name="', 1)[1].split(b'"', 1)[0].decode()
+                params[name] = value.rstrip(b"\r\n").decode(errors="replace")
+        return params
+    from urllib.parse import parse_qsl, urlsplit
+    params = dict(parse_qsl(urlsplit(handler.path).query))
+    params.update(parse_qsl(body.decode()))
+    return params
+
+
+def make_handler(fake: FakeTelegram):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload):
+            data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+            self.send_response(status)
+            if not isinstance(payload, bytes):
+                self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.startswith("/file/"):
+                return self._reply(200, b"")
+            if self.path.startswith("/_fake/stats"):
+                return self._reply(200, fake.stats())
+            self.do_POST()
+
+        def do_POST(self):
+            if self.path.startswith("/_fake/updates"):
+                fake.push_update(_params(self))
+                return self._reply(200, {"ok": True})
+            parts = self.path.split("?", 1)[0].strip("/").split("/")
+            if len(parts) != 2 or not parts[0].startswith("bot"):
+                return self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            status, payload = fake.call(parts[1], _params(self))
+            if parts[1] == "getUpdates" and not payload["result"]:
+                # Вместо long polling просто не даем боту крутиться в пустом цикле
+                time.sleep(0.5)
+            self._reply(status, payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int, fake: FakeTelegram = None) -> ThreadingHTTPServer:
+    fake = fake or FakeTelegram()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fake))
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, name="fake-bot-api", daemon=True).start()
+    return server
+
+
+def check_outbox(messages: int, chats: int, port: int) -> dict:
+    """Отправляет messages сообщений в chats чатов через Outbox и считает ответы 429"""
+    import telebot
+    from telebot import apihelper
+    from outbox import Outbox, sync_sender
+
+    server = serve(port)
+    apihelper.API_URL = f"http://127.0.0.1:{server.server_port}/bot{{0}}/{{1}}"
+    outbox = Outbox(sync_sender(telebot.TeleBot("123:fake"))).start()
+    started = time.monotonic()
+    futures = [outbox.send_message(1000 + i % chats, f"Сообщение {i}") for i in range(messages)]
+    for future in futures:
+        future.result()
+    elapsed = time.monotonic() - started
+    server.shutdown()
+    return {"messages": messages, "chats": chats, "seconds": round(elapsed, 2), **server.fake.stats()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Поддельный Bot API Telegram")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--check", type=int, default=0, help="Проверить Outbox на N сообщениях и выйти")
+    parser.add_argument("--chats", type=int, default=5, help="Число чатов для --check")
+    args = parser.parse_args(argv)
+    if args.check:
+        result = check_outbox(args.check, args.chats, 0)
+        del result["per_chat"]
+        print(json.dumps(result, ensure_ascii=False))
+        return 0 if result["rejected_429"] == 0 else 1
+    serve(args.port)
+    print(f"Bot API на http://127.0.0.1:{args.port}, статистика: /_fake/stats")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Локальный поддельный gRPC API YandexGPT для проверки клиента без облака.
+
+Сервер отвечает на поиск адресов сервисов (ApiEndpointService.List) адресом
+самого себя и на TextGenerationService.Completion - ответом, в котором
+повторяется текст пользователя. Заданные ошибки (gRPC-статусы) отдаются
+перед ответами по очереди, задержка и число одновременных запросов
+запоминаются - так проверяются повторы и ограничение параллельности
+ya_client.YandexGPTClient через настоящий SDK.
+
+Нужны yandex-cloud-ml-sdk и grpcio (ставятся вместе с SDK).
+
+Запуск сервера:
+    python fake_yandexgpt.py --port 50051
+    YC_ENDPOINT=127.0.0.1:50051 YC_INSECURE=1 YC_API_KEY=test python bot.py
+"""
+import sys
+import time
+import argparse
+import threading
+from concurrent import futures
+
+import grpc
+from yandex.cloud.endpoint.api_endpoint_pb2 import ApiEndpoint
+from yandex.cloud.endpoint.api_endpoint_service_pb2 import ListApiEndpointsResponse
+from yandex.cloud.endpoint.api_endpoint_service_pb2_grpc import (
+    ApiEndpointServiceServicer, add_ApiEndpointServiceServicer_to_server)
+from yandex.cloud.ai.foundation_models.v1.text_common_pb2 import Alternative, ContentUsage, Message
+from yandex.cloud.ai.foundation_models.v1.text_generation.text_generation_service_pb2 import CompletionResponse
+from yandex.cloud.ai.foundation_models.v1.text_generation.text_generation_service_pb2_grpc import (
+    TextGenerationServiceServicer, add_TextGenerationServiceServicer_to_server)
+
+# Сервис, под которым SDK ищет адрес TextGenerationService
+SERVICE_ID = "ai-foundation-models"
+
+
+class FakeYandexGPT:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.errors = []
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self.requests = []
+
+    def fail(self, *codes: str):
+        """Следующие запросы завершатся этими gRPC-статусами, например "UNAVAILABLE" """
+        with self.lock:
+            self.errors.extend(codes)
+
+    def complete(self, request, context):
+        with self.lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            error = self.errors.pop(0) if self.errors else None
+            self.requests.append({"model_uri": request.model_uri,
+                                  "messages": [(m.role, m.text) for m in request.messages]})
+        try:
+            time.sleep(self.latency)
+        finally:
+            with self.lock:
+                self.active -= 1
+        if error is not None:
+            context.abort(grpc.StatusCode[error], f"fake {error}")
+        text = f"ответ на: {request.messages[-1].text}"
+        return CompletionResponse(
+            alternatives=[Alternative(message=Message(role="assistant", text=text),
+                                      status=Alternative.ALTERNATIVE_STATUS_FINAL)],
+            usage=ContentUsage(input_text_tokens=len(request.messages[-1].text.split()),
+                               completion_tokens=len(text.split()), total_tokens=0),
+            model_version="fake")
+
+
+class _Endpoints(ApiEndpointServiceServicer):
+    def __init__(self, address: str):
+        self.address = address
+
+    def List(self, request, context):
+        return ListApiEndpointsResponse(endpoints=[ApiEndpoint(id=SERVICE_ID, address=self.address)])
+
+
+class _TextGeneration(TextGenerationServiceServicer):
+    def __init__(self, fake: FakeYandexGPT):
+        self.fake = fake
+
+    def Completion(self, request, context):
+        yield self.fake.complete(request, context)
+
+
+def serve(port: int, fake: FakeYandexGPT = None, workers: int = 16) -> grpc.Server:
+    """Запускает сервер; адрес - server.address, счетчики - server.fake"""
+    fake = fake or FakeYandexGPT()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fake-yandexgpt"))
+    port = server.add_insecure_port(f"127.0.0.1:{port}")
+    address = f"127.0.0.1:{port}"
+    add_ApiEndpointServiceServicer_to_server(_Endpoints(address), server)
+    add_TextGenerationServiceServicer_to_server(_TextGeneration(fake), server)
+    server.start()
+    server.fake = fake
+    server.address = address
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Поддельный gRPC API YandexGPT")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа, в секундах")
+    args = parser.parse_args(argv)
+    server = serve(args.port, FakeYandexGPT(args.latency))
+    print(f"YandexGPT на {server.address}: YC_ENDPOINT={server.address} YC_INSECURE=1")
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        server.stop(0)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+import os
+import socket
+import sqlite3
+import threading
+import datetime
+import traceback
+
+import db
+
+# Состояния задачи
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Сколько секунд задача считается занятой воркером без продления аренды
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+
+
+class JobQueue:
+    """
+    Персистентная очередь задач обработки аудио в SQLite.
+
+    Задачи хранятся в таблице jobs той же базы, что и остальные данные бота
+    (схема - в migrations.py), поэтому переживают перезапуск: незавершенные
+    задачи возвращаются в очередь.
+
+    Очередь могут разбирать несколько процессов. Взятая задача арендуется
+    на lease_seconds, и воркер продлевает аренду, пока работает; задачи с
+    истекшей арендой (процесс упал) возвращаются в очередь.
+    """
+
+    def __init__(self, db_name: str, lease_seconds: int = LEASE_SECONDS):
+        self.db_name = db_name
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = threading.Event()
+
+    def _fetchone(self, sql: str, params: tuple = ()):
+        cursor = db.get_connection(self.db_name).execute(sql, params)
+        # Строки задач читаются по именам колонок, остальным запросам соединения это не нужно
+        cursor.row_factory = sqlite3.Row
+        return cursor.fetchone()
+
+    def enqueue(self, user_id: int, file_id: str, inspection_id: int = None) -> int:
+        """
+        Ставит задачу в очередь.
+
+        :param user_id: ID пользователя Telegram
+        :param file_id: ID файла Telegram
+        :param inspection_id: ID проверки, к которой относится запись
+        :return: ID задачи
+        """
+        with db.transaction(self.db_name) as conn:
+            job_id = conn.execute(
+                'INSERT INTO jobs (user_id, file_id, state, inspection_id) VALUES (?, ?, ?, ?)',
+                (user_id, file_id, QUEUED, inspection_id)).lastrowid
+        self.notify()
+        return job_id
+
+    def claim_next(self):
+        """Атомарно забирает первую задачу из очереди. Возвращает строку задачи или None."""
+        with db.transaction(self.db_name) as conn:
+            row = self._fetchone('SELECT * FROM jobs WHERE state = ? ORDER BY job_id LIMIT 1', (QUEUED,))
+            if row is None:
+                return None
+            now = datetime.datetime.now()
+            conn.execute('''
+                UPDATE jobs SET state = ?, attempts = attempts + 1, worker_id = ?, lease_until = ?, updated_at = ?
+                WHERE job_id = ?
+            ''', (RUNNING, self.worker_id, self._lease_end(now), now, row['job_id']))
+            return row
+
+    def _lease_end(self, now: datetime.datetime) -> datetime.datetime:
+        return now + datetime.timedelta(seconds=self.lease_seconds)
+
+    def extend_lease(self, job_ids) -> int:
+        """Продлевает аренду задач, которые еще выполняет этот процесс"""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return 0
+        now = datetime.datetime.now()
+        with db.transaction(self.db_name) as conn:
+            cursor = conn.execute(f'''
+                UPDATE jobs SET lease_until = ?
+                WHERE state = ? AND worker_id = ? AND job_id IN ({', '.join('?' * len(job_ids))})
+            ''', (self._lease_end(now), RUNNING, self.worker_id, *job_ids))
+        return cursor.rowcount
+
+    def _update(self, job_id: int, **fields):
+        fields['updated_at'] = datetime.datetime.now()
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        with db.transaction(self.db_name) as conn:
+            conn.execute(f'UPDATE jobs SET {columns} WHERE job_id = ?', (*fields.values(), job_id))
+
+    def set_stage(self, job_id: int, stage: str):
+        self._update(job_id, stage=stage)
+
+    def mark_done(self, job_id: int):
+        self._update(job_id, state=DONE, error=None)
+
+    def mark_failed(self, job_id: int, error: str):
+        self._update(job_id, state=FAILED, error=error)
+
+    def requeue(self, job_id: int, error: str = None):
+        """Возвращает задачу в очередь для повторной попытки."""
+        self._update(job_id, state=QUEUED, error=error)
+        self.notify()
+
+    def requeue_interrupted(self) -> int:
+        """
+        Возвращает в очередь задачи, прерванные остановкой процесса.
+
+        Задачи, которые сейчас выполняют живые процессы, не трогаются:
+        в очередь возвращаются только задачи с истекшей арендой.
+        """
+        now = datetime.datetime.now()
+        with db.transaction(self.db_name) as conn:
+            cursor = conn.execute('''
+                UPDATE jobs SET state = ?, worker_id = NULL, lease_until = NULL, updated_at = ?
+                WHERE state = ? AND (lease_until IS NULL OR lease_until < ?)
+            ''', (QUEUED, now, RUNNING, now))
+        if cursor.rowcount:
+            self.notify()
+        return cursor.rowcount
+
+    def get(self, job_id: int):
+        return self._fetchone('SELECT * FROM jobs WHERE job_id = ?', (job_id,))
+
+    def position(self, job_id: int) -> int:
+        """Количество задач в очереди перед указанной."""
+        return db.get_connection(self.db_name).execute(
+            'SELECT COUNT(*) FROM jobs WHERE state = ? AND job_id < ?', (QUEUED, job_id)).fetchone()[0]
+
+    def notify(self):
+        """Будит воркеры, ожидающие новых задач."""
+        self._wakeup.set()
+
+    def wait(self, timeout: float):
+        """Ждет появления новых задач не дольше timeout секунд."""
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+
+class WorkerPool:
+    """
+    Пул потоков, обрабатывающих задачи из очереди.
+
+    handler(job) вызывается для каждой задачи; исключение переводит задачу
+    в состояние failed, а при max_attempts > 1 возвращает ее в очередь.
+    """
+
+    def __init__(self, queue: JobQueue, handler, workers: int = 2,
+                 max_attempts: int = 1, poll_interval: float = 5.0):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._threads = []
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        self.queue.requeue_interrupted()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"audio-worker-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="audio-worker-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _heartbeat(self):
+        """Продлевает аренду своих задач и подбирает задачи упавших процессов"""
+        interval = max(1.0, self.queue.lease_seconds / 3)
+        while not self._stop.wait(interval):
+            try:
+                with self._running_lock:
+                    running = list(self._running)
+                self.queue.extend_lease(running)
+                self.queue.requeue_interrupted()
+            except Exception:
+                traceback.print_exc()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self.queue.notify()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            job = self.queue.claim_next()
+            if job is None:
+                self.queue.wait(self.poll_interval)
+                continue
+            with self._running_lock:
+                self._running.add(job['job_id'])
+            try:
+                self.handler(job)
+                self.queue.mark_done(job['job_id'])
+            except Exception as e:
+                traceback.print_exc()
+                if job['attempts'] + 1 < self.max_attempts:
+                    self.queue.requeue(job['job_id'], str(e))
+                else:
+                    self.queue.mark_failed(job['job_id'], str(e))
+            finally:
+                with self._running_lock:
+                    self._running.discard(job['job_id'])
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from transcription_cache import CACHE_DB
+
+# ---- Настройки кэша ответов LLM ----
+# Время жизни ответа, в секундах (по умолчанию 30 дней)
+TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+# Максимальное число сохраненных ответов
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+# Кэшируются только вызовы с температурой не выше этой - их ответы практически детерминированы
+MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.3"))
+# Полное отключение кэша
+DISABLED = os.getenv("LLM_CACHE_DISABLED", "") == "1"
+
+
+def prompt_key(model_name: str, model_version: str, temperature: float, system: str, text: str) -> str:
+    """SHA-256 от всех параметров, влияющих на ответ модели"""
+    payload = json.dumps([model_name, model_version, round(float(temperature), 4), system, text],
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Персистентный кэш ответов YandexGPT в SQLite.
+
+    Ключ - хэш (модель, версия, температура, системный промпт, текст).
+    Устаревшие по TTL ответы не возвращаются и удаляются, при превышении
+    лимита записей вытесняются давно не использованные.
+    """
+
+    def __init__(self, db_name: str = CACHE_DB, ttl: float = TTL_SECONDS, max_entries: int = MAX_ENTRIES,
+                 max_temperature: float = MAX_TEMPERATURE):
+        self.db_name = db_name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_temperature = max_temperature
+        self._lock = threading.Lock()
+        self._create_tables()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_name, timeout=30)
+
+    def _create_tables(self):
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_responses_last_access ON llm_responses (last_access)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                name TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def eligible(self, temperature: float) -> bool:
+        return not DISABLED and temperature <= self.max_temperature
+
+    def _count(self, conn, hit: bool):
+        column = "hits" if hit else "misses"
+        conn.execute(f'''
+            INSERT INTO cache_stats (name, {column}) VALUES ('llm', 1)
+            ON CONFLICT(name) DO UPDATE SET {column} = {column} + 1
+        ''')
+
+    def get(self, key: str):
+        """Возвращает сохраненный ответ или None"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute('SELECT response, created_at FROM llm_responses WHERE key = ?',
+                                   (key,)).fetchone()
+                if row and now - row[1] > self.ttl:
+                    conn.execute('DELETE FROM llm_responses WHERE key = ?', (key,))
+                    row = None
+                if row:
+                    conn.execute('UPDATE llm_responses SET last_access = ? WHERE key = ?', (now, key))
+                self._count(conn, hit=row is not None)
+                conn.commit()
+            finally:
+                conn.close()
+        return row[0] if row else None
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute('''
+                    INSERT OR REPLACE INTO llm_responses (key, response, created_at, last_access)
+                    VALUES (?, ?, ?, ?)
+                ''', (key, response, now, now))
+                # Сначала удаляем устаревшие, затем лишние по давности использования
+                conn.execute('DELETE FROM llm_responses WHERE created_at < ?', (now - self.ttl,))
+                conn.execute('''
+                    DELETE FROM llm_responses WHERE key IN (
+                        SELECT key FROM llm_responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                    )
+                ''', (self.max_entries,))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        try:
+            entries = conn.execute('SELECT COUNT(*) FROM llm_responses').fetchone()[0]
+            row = conn.execute("SELECT hits, misses FROM cache_stats WHERE name = 'llm'").fetchone()
+        finally:
+            conn.close()
+        hits, misses = row if row else (0, 0)
+        return {"hits": hits, "misses": misses, "entries": entries}
+
+
+# Общий кэш процесса
+llm_cache = LLMCache()
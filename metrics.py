@@ -0,0 +1,270 @@
+"""
+Замеры этапов обработки: длительности, объем аудио, токены, попадания в кэши.
+
+Этап оборачивается в span() - как контекстный менеджер или декоратор:
+
+    with metrics.inspection(inspection_id):
+        with metrics.span("telegram.download"):
+            ...
+
+Длительности попадают в гистограмму shopper_stage_duration_seconds,
+счетчики - через inc(). Все метрики отдаются в текстовом формате
+Prometheus по http://METRICS_HOST:METRICS_PORT/metrics (serve()).
+С METRICS_SINK=sqlite каждый этап, выполненный внутри inspection(),
+записывается в таблицу stage_timings, и по ней восстанавливается
+хронология проверки: timeline(inspection_id) или /timeline/<id>.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import datetime
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import db
+
+# ---- Настройки ----
+# Порт HTTP для Prometheus; 0 - не запускать
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# sqlite - сохранять этапы проверок в stage_timings, пусто - только счетчики в памяти
+METRICS_SINK = os.getenv("METRICS_SINK", "sqlite")
+# Печатать длительность этапов проверок
+METRICS_LOG = os.getenv("METRICS_LOG", "1") == "1"
+# Как часто сбрасывать накопленные этапы в базу, в секундах
+FLUSH_INTERVAL = 1.0
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+STAGE_DURATION = "shopper_stage_duration_seconds"
+STAGE_ERRORS = "shopper_stage_errors_total"
+INF_BUCKET = 'le="+Inf"'
+
+_inspection = contextvars.ContextVar("inspection_id", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Registry:
+    """Счетчики и гистограммы процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple = DURATION_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets),
+                                                     "sum": 0.0, "count": 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def value(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0.0)
+
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, dict(h, counts=list(h["counts"]))) for key, h in self._histograms.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                le = 'le="%g"' % bound
+                lines.append(f"{name}_bucket{_labels(labels, le)} {count}")
+            lines.append(f"{name}_bucket{_labels(labels, INF_BUCKET)} {histogram['count']}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']:g}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    registry.observe(name, value, **labels)
+
+
+# ---- Этапы ----
+@contextmanager
+def inspection(inspection_id: int):
+    """Этапы внутри блока относятся к проверке inspection_id (в том же потоке)"""
+    token = _inspection.set(inspection_id)
+    try:
+        yield
+    finally:
+        _inspection.reset(token)
+
+
+def current_inspection():
+    return _inspection.get()
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """
+    Замер этапа. Можно использовать и как декоратор: @span("llm.answers").
+
+    В блоке доступен словарь details: что в него записать (длительность
+    аудио, число вопросов), сохранится вместе с этапом в stage_timings.
+    """
+    details = {}
+    started_at = time.time()
+    started = time.perf_counter()
+    ok = True
+    try:
+        yield details
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        registry.observe(STAGE_DURATION, duration, stage=stage, **labels)
+        if not ok:
+            registry.inc(STAGE_ERRORS, stage=stage, **labels)
+        inspection_id = _inspection.get()
+        if inspection_id is not None:
+            if METRICS_LOG:
+                status = "" if ok else " (ошибка)"
+                print(f"⏱ Проверка #{inspection_id}: {stage} {duration:.2f} с{status}")
+            if METRICS_SINK == "sqlite":
+                _sink.put((inspection_id, stage, started_at, duration, ok, dict(labels, **details)))
+
+
+# ---- Запись этапов в SQLite ----
+class SQLiteSink:
+    """Пишет этапы в stage_timings пачками из фонового потока, не задерживая сами этапы"""
+
+    def __init__(self, db_name: str = None):
+        self.db_name = db_name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, record: tuple):
+        self._queue.put(record)
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="metrics-sink", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        records = []
+        while True:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not records:
+            return
+        rows = [(inspection_id, stage, datetime.datetime.fromtimestamp(started_at), round(duration, 4), int(ok),
+                 json.dumps(details, ensure_ascii=False, default=str))
+                for inspection_id, stage, started_at, duration, ok, details in records]
+        try:
+            with db.transaction(self.db_name) as conn:
+                conn.executemany('''
+                    INSERT INTO stage_timings (inspection_id, stage, started_at, duration, ok, details)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', rows)
+        except Exception as e:
+            print(f"Не удалось сохранить замеры этапов: {e}")
+
+
+_sink = SQLiteSink()
+atexit.register(_sink.flush)
+
+
+def timeline(inspection_id: int, db_name: str = None) -> list:
+    """Этапы проверки в порядке начала: [{"stage", "started_at", "duration", "ok", "details"}, ...]"""
+    _sink.flush()
+    rows = db.get_connection(db_name).execute('''
+        SELECT stage, started_at, duration, ok, details FROM stage_timings
+        WHERE inspection_id = ? ORDER BY started_at, id
+    ''', (inspection_id,)).fetchall()
+    return [{"stage": stage, "started_at": str(started_at), "duration": duration, "ok": bool(ok),
+             "details": json.loads(details) if details else {}}
+            for stage, started_at, duration, ok, details in rows]
+
+
+# ---- HTTP ----
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._reply(200, registry.render(), "text/plain; version=0.0.4; charset=utf-8")
+        elif self.path.startswith("/timeline/") and self.path[len("/timeline/"):].isdigit():
+            data = timeline(int(self.path[len("/timeline/"):]))
+            self._reply(200, json.dumps(data, ensure_ascii=False), "application/json")
+        else:
+            self._reply(404, "not found\n", "text/plain")
+
+    def _reply(self, status: int, body: str, content_type: str):
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    """Запускает HTTP-сервер метрик в фоновом потоке (один на процесс)"""
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _Handler)
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"Метрики: http://{host}:{port}/metrics")
+        return _server
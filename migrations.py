@@ -0,0 +1,460 @@
+"""
+Версионные миграции схемы bot.db.
+
+Текущая версия схемы хранится в PRAGMA user_version. Каждая миграция
+выполняется в своей транзакции и повышает версию, поэтому запуск
+идемпотентен и применяет к существующей базе только недостающие шаги.
+
+Запуск: python migrations.py [путь к базе]
+"""
+import sys
+import sqlite3
+
+
+def _columns(conn, table: str) -> list:
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def _m1_base_schema(conn):
+    """Базовые таблицы (как их создавал test.py)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS surveys (
+            survey_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS questions (
+            question_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            survey_id INTEGER NOT NULL,
+            question_text TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (survey_id) REFERENCES surveys (survey_id) ON DELETE CASCADE,
+            UNIQUE(question_id, survey_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS inspections (
+            inspection_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            survey_id INTEGER NOT NULL,
+            file_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
+            FOREIGN KEY (survey_id) REFERENCES surveys (survey_id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS answers (
+            answer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            inspection_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            answer_text TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (inspection_id) REFERENCES inspections (inspection_id) ON DELETE CASCADE,
+            FOREIGN KEY (question_id) REFERENCES questions (question_id) ON DELETE CASCADE,
+            UNIQUE (inspection_id, question_id)
+        )
+    ''')
+
+
+def _m2_answers_by_inspection(conn):
+    """Ответы привязаны к проверке: inspection_id и UNIQUE(inspection_id, question_id)"""
+    if 'inspection_id' in _columns(conn, 'answers'):
+        return
+
+    # Старая таблица answers была ключом (user_id, question_id).
+    # Ответы переносятся в последнюю проверку пользователя, ответы без проверки отбрасываются.
+    conn.execute('ALTER TABLE answers RENAME TO answers_old')
+    conn.execute('''
+        CREATE TABLE answers (
+            answer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            inspection_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            answer_text TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (inspection_id) REFERENCES inspections (inspection_id) ON DELETE CASCADE,
+            FOREIGN KEY (question_id) REFERENCES questions (question_id) ON DELETE CASCADE,
+            UNIQUE (inspection_id, question_id)
+        )
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO answers (answer_id, inspection_id, question_id, answer_text, created_at)
+        SELECT a.answer_id, i.inspection_id, a.question_id, a.answer_text, a.created_at
+        FROM answers_old a
+        JOIN (SELECT user_id, MAX(inspection_id) AS inspection_id
+              FROM inspections GROUP BY user_id) i ON i.user_id = a.user_id
+    ''')
+    conn.execute('DROP TABLE answers_old')
+
+
+def _m3_indexes(conn):
+    """Рабочие индексы вместо дублирующих первичные ключи"""
+    for name in ('idx_users_user_id', 'idx_surveys_survey_id', 'idx_questions_question_id',
+                 'idx_inspections_inspection_id', 'idx_answers_answer_id'):
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
+
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_questions_survey_id ON questions (survey_id, question_id)')
+    # Частичный индекс: только неотвеченные вопросы, поиск по inspection_id без скана таблицы
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_answers_unanswered
+        ON answers (inspection_id, question_id) WHERE answer_text = 'null'
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_inspections_user_id ON inspections (user_id, inspection_id)')
+
+
+def _m4_batch_items(conn):
+    """Контрольные точки пакетной обработки записей, отдельно для каждого запуска"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS batch_items (
+            path TEXT NOT NULL,
+            run_name TEXT NOT NULL,
+            stage TEXT NOT NULL DEFAULT 'pending',
+            inspection_id INTEGER,
+            error TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (run_name, path),
+            FOREIGN KEY (inspection_id) REFERENCES inspections (inspection_id) ON DELETE SET NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_batch_items_run ON batch_items (run_name, stage)')
+
+
+def _m5_catalogue_version(conn):
+    """Счетчик версий каталога анкет, который увеличивают триггеры"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalogue_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO catalogue_version (id, version) VALUES (1, 0)')
+    # Любое изменение анкет и вопросов, в том числе напрямую через sqlite3, меняет версию
+    for table in ('surveys', 'questions'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE catalogue_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+
+def _m6_inspection_sessions(conn):
+    """Сессии проверок и настройки проверяющих вместо состояния в памяти бота"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS inspection_sessions (
+            inspection_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            state TEXT NOT NULL DEFAULT 'processing',
+            question_ids TEXT NOT NULL DEFAULT '[]',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (inspection_id) REFERENCES inspections (inspection_id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_inspection_sessions_user ON inspection_sessions (user_id, state)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY,
+            survey_id INTEGER,
+            active_inspection_id INTEGER
+        )
+    ''')
+
+
+def _m7_stage_timings(conn):
+    """Длительности этапов обработки проверок (metrics.py)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stage_timings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            inspection_id INTEGER NOT NULL,
+            stage TEXT NOT NULL,
+            started_at TIMESTAMP NOT NULL,
+            duration REAL NOT NULL,
+            ok INTEGER NOT NULL DEFAULT 1,
+            details TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stage_timings_inspection ON stage_timings (inspection_id, started_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stage_timings_stage ON stage_timings (stage, started_at)')
+
+
+def _m8_search_index(conn):
+    """Расшифровки проверок и полнотекстовый индекс FTS5 по ним и по ответам (search_index.py)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS transcripts (
+            inspection_id INTEGER PRIMARY KEY,
+            raw_text TEXT,
+            dialogue TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (inspection_id) REFERENCES inspections (inspection_id) ON DELETE CASCADE
+        )
+    ''')
+    # В индексе основы слов; исходные тексты остаются в transcripts и answers
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            stems,
+            kind UNINDEXED,
+            inspection_id UNINDEXED,
+            ref_id UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+    # Что нужно переиндексировать; заполняется триггерами
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS search_queue (
+            kind TEXT NOT NULL,
+            ref_id INTEGER NOT NULL,
+            PRIMARY KEY (kind, ref_id)
+        )
+    ''')
+    # ON CONFLICT DO NOTHING, а не INSERT OR IGNORE: политику OR IGNORE переопределяет
+    # конфликтная политика внешнего запроса (upsert ответов в add_answer)
+    sources = {'answers': ('answer', 'answer_id', 'UPDATE OF answer_text'),
+               'transcripts': ('transcript', 'inspection_id', 'UPDATE')}
+    for table, (kind, key, update) in sources.items():
+        for event, row in (('INSERT', 'NEW'), (update, 'NEW'), ('DELETE', 'OLD')):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.split()[0].lower()}_search
+                AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO search_queue (kind, ref_id) VALUES ('{kind}', {row}.{key})
+                    ON CONFLICT DO NOTHING;
+                END
+            ''')
+    # Уже сохраненные ответы проиндексируются при первом поиске
+    conn.execute("INSERT OR IGNORE INTO search_queue (kind, ref_id) SELECT 'answer', answer_id FROM answers")
+
+
+# Ответ засчитывается как выполненный пункт, если начинается со слова "Да", и как невыполненный - со слова "Нет"
+COMPLIANCE_PASSED = "(ltrim({0}) GLOB '[Дд][Аа]*' AND NOT ltrim({0}) GLOB '[Дд][Аа][а-яёА-ЯЁ]*')"
+COMPLIANCE_FAILED = "(ltrim({0}) GLOB '[Нн][Ее][Тт]*' AND NOT ltrim({0}) GLOB '[Нн][Ее][Тт][а-яёА-ЯЁ]*')"
+# Все ответы, сгруппированные как в compliance_stats; им же пересобирается таблица (compliance.rebuild)
+COMPLIANCE_BACKFILL = f'''
+    INSERT INTO compliance_stats (survey_id, question_id, user_id, month, passed, failed, total)
+    SELECT i.survey_id, a.question_id, i.user_id, strftime('%Y-%m', i.created_at),
+           SUM({COMPLIANCE_PASSED.format('a.answer_text')}),
+           SUM({COMPLIANCE_FAILED.format('a.answer_text')}),
+           COUNT(*)
+    FROM answers a
+    JOIN inspections i ON i.inspection_id = a.inspection_id
+    GROUP BY 1, 2, 3, 4
+'''
+
+
+def _compliance_delta(row: str, sign: str) -> str:
+    """Добавляет (sign='+') или вычитает (sign='-') ответ row из compliance_stats"""
+    return f'''
+        INSERT INTO compliance_stats (survey_id, question_id, user_id, month, passed, failed, total)
+        SELECT i.survey_id, {row}.question_id, i.user_id, strftime('%Y-%m', i.created_at),
+               {sign}{COMPLIANCE_PASSED.format(row + '.answer_text')},
+               {sign}{COMPLIANCE_FAILED.format(row + '.answer_text')},
+               {sign}1
+        FROM inspections i WHERE i.inspection_id = {row}.inspection_id
+        ON CONFLICT (survey_id, question_id, user_id, month) DO UPDATE SET
+            passed = passed + excluded.passed,
+            failed = failed + excluded.failed,
+            total = total + excluded.total;
+    '''
+
+
+def _m9_compliance_stats(conn):
+    """Сводка выполнения пунктов анкет по вопросу, проверяющему и месяцу (compliance.py)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS compliance_stats (
+            survey_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            passed INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (survey_id, question_id, user_id, month)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_compliance_stats_month ON compliance_stats (month, survey_id)')
+    # Сводка меняется в той же транзакции, что и ответы: add_answer, add_answers, прямой sqlite3
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_answers_insert_compliance
+        AFTER INSERT ON answers
+        BEGIN {_compliance_delta('NEW', '+')} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_answers_update_compliance
+        AFTER UPDATE OF inspection_id, question_id, answer_text ON answers
+        BEGIN {_compliance_delta('OLD', '-')} {_compliance_delta('NEW', '+')} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_answers_delete_compliance
+        AFTER DELETE ON answers
+        BEGIN {_compliance_delta('OLD', '-')} END
+    ''')
+    # При каскадном удалении ответов проверки ее строки уже нет, поэтому ответы вычитаются заранее
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_inspections_delete_compliance
+        BEFORE DELETE ON inspections
+        BEGIN
+            INSERT INTO compliance_stats (survey_id, question_id, user_id, month, passed, failed, total)
+            SELECT OLD.survey_id, a.question_id, OLD.user_id, strftime('%Y-%m', OLD.created_at),
+                   -SUM({COMPLIANCE_PASSED.format('a.answer_text')}),
+                   -SUM({COMPLIANCE_FAILED.format('a.answer_text')}),
+                   -COUNT(*)
+            FROM answers a WHERE a.inspection_id = OLD.inspection_id
+            GROUP BY a.question_id
+            ON CONFLICT (survey_id, question_id, user_id, month) DO UPDATE SET
+                passed = passed + excluded.passed,
+                failed = failed + excluded.failed,
+                total = total + excluded.total;
+        END
+    ''')
+    conn.execute('DELETE FROM compliance_stats')
+    conn.execute(COMPLIANCE_BACKFILL)
+
+
+def _m10_artifacts(conn):
+    """Хранилище файлов проверок: записи, диалоги, ответы модели, отчеты (artifacts.py)"""
+    # Файл хранится один раз по SHA-256 содержимого; refcount - число ссылок из artifacts
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS artifact_blobs (
+            sha256 TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_artifact_blobs_lru ON artifact_blobs (refcount > 0, last_access)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS artifacts (
+            inspection_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            fingerprint TEXT,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (inspection_id, kind),
+            FOREIGN KEY (inspection_id) REFERENCES inspections (inspection_id) ON DELETE CASCADE,
+            FOREIGN KEY (sha256) REFERENCES artifact_blobs (sha256) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_artifacts_fingerprint ON artifacts (kind, fingerprint)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_artifacts_sha256 ON artifacts (sha256)')
+    # Счетчик ссылок меняется в той же транзакции, в том числе при каскадном удалении проверки
+    changes = {'insert': ('INSERT', (('NEW', '+'),)),
+               'update': ('UPDATE OF sha256', (('OLD', '-'), ('NEW', '+'))),
+               'delete': ('DELETE', (('OLD', '-'),))}
+    for name, (event, rows) in changes.items():
+        body = ' '.join(f'UPDATE artifact_blobs SET refcount = refcount {sign} 1 WHERE sha256 = {row}.sha256;'
+                        for row, sign in rows)
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_artifacts_{name}_refcount
+            AFTER {event} ON artifacts
+            BEGIN {body} END
+        ''')
+
+
+def _m11_missing_surveys(conn):
+    """Анкеты, на которые ссылаются вопросы, но которых нет в surveys (test.py заполнял только вопросы)"""
+    conn.execute('''
+        INSERT INTO surveys (survey_id, client_name)
+        SELECT DISTINCT q.survey_id, 'Анкета ' || q.survey_id
+        FROM questions q
+        WHERE NOT EXISTS (SELECT 1 FROM surveys s WHERE s.survey_id = q.survey_id)
+    ''')
+
+
+def _m12_jobs(conn):
+    """Очередь задач обработки аудио (job_queue.py) с проверкой и арендой воркером"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'queued',
+            stage TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            inspection_id INTEGER,
+            worker_id TEXT,
+            lease_until TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Таблица, которую job_queue.py создавал сам до миграций, - без проверки и аренды
+    columns = _columns(conn, 'jobs')
+    for column, column_type in (('inspection_id', 'INTEGER'), ('worker_id', 'TEXT'),
+                                ('lease_until', 'TIMESTAMP')):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, job_id)')
+
+
+# Порядок важен: номер миграции = версия схемы после ее применения
+MIGRATIONS = [
+    _m1_base_schema,
+    _m2_answers_by_inspection,
+    _m3_indexes,
+    _m4_batch_items,
+    _m5_catalogue_version,
+    _m6_inspection_sessions,
+    _m7_stage_timings,
+    _m8_search_index,
+    _m9_compliance_stats,
+    _m10_artifacts,
+    _m11_missing_surveys,
+    _m12_jobs,
+]
+
+
+def schema_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db_name: str = 'bot.db', verbose: bool = False) -> int:
+    """
+    Применяет к базе недостающие миграции.
+
+    :param db_name: Путь к базе
+    :param verbose: Печатать примененные миграции
+    :return: Версия схемы после миграции
+    """
+    conn = sqlite3.connect(db_name, timeout=30, isolation_level=None)
+    try:
+        # Пересборка таблиц невозможна с включенными внешними ключами
+        conn.execute('PRAGMA foreign_keys = OFF')
+        version = schema_version(conn)
+        for number, migration in enumerate(MIGRATIONS, 1):
+            if number <= version:
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {number}')
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            version = number
+            if verbose:
+                print(f"Миграция {number}: {migration.__doc__}")
+        return version
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'bot.db'
+    print(f"Версия схемы {db_path}: {migrate(db_path, verbose=True)}")
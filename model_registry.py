@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+
+from transcription_backends import get_backend
+
+# ---- Настройки реестра ----
+# Через сколько секунд простоя модель выгружается из памяти
+IDLE_TTL = float(os.getenv("WHISPER_IDLE_TTL", "1800"))
+# Сколько мегабайт весов моделей можно держать в памяти одновременно
+MAX_MEMORY_MB = float(os.getenv("WHISPER_MAX_MEMORY_MB", "4096"))
+
+
+class ModelRegistry:
+    """
+    Общий для процесса реестр моделей Whisper.
+
+    Каждая модель загружается один раз по ключу (движок, имя модели, язык) и
+    переиспользуется всеми вызовами. Давно не использованные модели
+    выгружаются, а при превышении лимита памяти выгружаются самые старые.
+    """
+
+    def __init__(self, idle_ttl: float = IDLE_TTL, max_memory_mb: float = MAX_MEMORY_MB):
+        self.idle_ttl = idle_ttl
+        self.max_memory_mb = max_memory_mb
+        self._lock = threading.Lock()
+        self._entries = {}  # {(backend, model_name, language): {"model", "size_mb", "last_used"}}
+        self._loading = {}  # {(backend, model_name, language): threading.Event}
+        self._stats = {
+            "loads": 0,
+            "hits": 0,
+            "evictions": 0,
+            "load_seconds": 0.0,
+        }
+
+    def get(self, model_name: str = "medium", language: str = "ru", backend: str = None):
+        """
+        Возвращает загруженную модель, при необходимости загружая её.
+
+        :param model_name: Имя модели (tiny, base, small, medium, large)
+        :param language: Язык, для которого используется модель
+        :param backend: Движок распознавания, по умолчанию TRANSCRIPTION_BACKEND
+        :return: Модель Whisper
+        """
+        engine = get_backend(backend)
+        key = (engine.name, model_name, language)
+        while True:
+            with self._lock:
+                self._evict_idle_locked()
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry["last_used"] = time.monotonic()
+                    self._stats["hits"] += 1
+                    return entry["model"]
+
+                event = self._loading.get(key)
+                if event is None:
+                    # Загружаем сами, остальные потоки подождут
+                    event = threading.Event()
+                    self._loading[key] = event
+                    break
+
+            # Модель уже грузится в другом потоке
+            event.wait()
+
+        try:
+            started = time.monotonic()
+            model = engine.load(model_name)
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._entries[key] = {
+                    "model": model,
+                    "size_mb": engine.model_size_mb(model),
+                    "last_used": time.monotonic(),
+                }
+                self._stats["loads"] += 1
+                self._stats["load_seconds"] += elapsed
+                self._enforce_memory_locked(keep=key)
+            return model
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            event.set()
+
+    def preload(self, *model_names: str, language: str = "ru", background: bool = True, backend: str = None):
+        """
+        Заранее загружает модели, чтобы первый запрос не ждал загрузки.
+
+        :param model_names: Имена моделей для загрузки
+        :param language: Язык моделей
+        :param background: Загружать в фоновом потоке
+        :param backend: Движок распознавания
+        :return: Поток загрузки или None
+        """
+        def _load():
+            for name in model_names:
+                try:
+                    self.get(name, language, backend)
+                except Exception as e:
+                    print(f"Не удалось загрузить модель {name}: {e}")
+
+        if not background:
+            _load()
+            return None
+
+        thread = threading.Thread(target=_load, name="whisper-preload", daemon=True)
+        thread.start()
+        return thread
+
+    def evict(self, model_name: str, language: str = "ru", backend: str = None) -> bool:
+        """Выгружает модель из реестра. Возвращает True, если модель была загружена."""
+        with self._lock:
+            if self._entries.pop((get_backend(backend).name, model_name, language), None) is None:
+                return False
+            self._stats["evictions"] += 1
+            return True
+
+    def evict_idle(self) -> int:
+        """Выгружает модели, которые не использовались дольше idle_ttl."""
+        with self._lock:
+            return self._evict_idle_locked()
+
+    def stats(self) -> dict:
+        """Возвращает статистику загрузок и попаданий."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["loaded"] = sorted(f"{engine}/{name}:{lang}" for engine, name, lang in self._entries)
+            stats["memory_mb"] = round(sum(e["size_mb"] for e in self._entries.values()), 1)
+        return stats
+
+    def _evict_idle_locked(self) -> int:
+        if self.idle_ttl <= 0:
+            return 0
+        now = time.monotonic()
+        stale = [k for k, e in self._entries.items() if now - e["last_used"] > self.idle_ttl]
+        for key in stale:
+            del self._entries[key]
+        self._stats["evictions"] += len(stale)
+        return len(stale)
+
+    def _enforce_memory_locked(self, keep):
+        # Выгружаем самые давно использованные модели, пока не уложимся в лимит
+        while sum(e["size_mb"] for e in self._entries.values()) > self.max_memory_mb:
+            candidates = [k for k in self._entries if k != keep]
+            if not candidates:
+                break
+            oldest = min(candidates, key=lambda k: self._entries[k]["last_used"])
+            del self._entries[oldest]
+            self._stats["evictions"] += 1
+
+
+# Общий реестр процесса
+registry = ModelRegistry()
+
+
+def get_model(model_name: str = "medium", language: str = "ru", backend: str = None):
+    """Возвращает модель из общего реестра."""
+    return registry.get(model_name, language, backend)
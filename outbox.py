@@ -0,0 +1,260 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+
+# Лимиты Telegram: около 30 сообщений в секунду на бота и 1 в секунду на чат.
+# Берем с запасом, чтобы не получать 429.
+GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))
+CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+# Сколько сообщений в чат можно отправить подряд без паузы
+CHAT_BURST = int(os.getenv("TG_CHAT_BURST", "3"))
+# Повторы при сетевых ошибках
+MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))
+# Максимальная длина текста одного сообщения Telegram
+MESSAGE_LIMIT = 4096
+# Методы Bot API без параметра chat_id
+NO_CHAT_ID_METHODS = {"answer_callback_query"}
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate событий в секунду, не больше burst подряд"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # Вызывается только из потока event loop, блокировка не нужна
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds: float):
+        """Запрещает отправку на seconds секунд (ответ 429 с retry_after)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+def retry_after(error: Exception):
+    """Сколько секунд ждать, если Telegram ответил 429 Too Many Requests"""
+    if getattr(error, "error_code", None) != 429:
+        return None
+    result = getattr(error, "result_json", None) or {}
+    return float((result.get("parameters") or {}).get("retry_after", 1))
+
+
+def is_network_error(error: Exception) -> bool:
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    # requests и aiohttp не наследуют свои ошибки от ConnectionError
+    return type(error).__module__.split(".")[0] in ("requests", "aiohttp", "urllib3")
+
+
+def sync_sender(bot):
+    """Отправка через синхронный telebot.TeleBot в пуле потоков"""
+    async def send(method: str, kwargs: dict):
+        return await asyncio.to_thread(getattr(bot, method), **kwargs)
+    return send
+
+
+def async_sender(bot):
+    """Отправка через telebot.async_telebot.AsyncTeleBot"""
+    async def send(method: str, kwargs: dict):
+        return await getattr(bot, method)(**kwargs)
+    return send
+
+
+def split_message(lines, limit: int = MESSAGE_LIMIT) -> list:
+    """
+    Собирает строки в как можно меньшее число сообщений не длиннее limit.
+
+    :param lines: Строки текста, каждая целиком попадает в одно сообщение
+    :return: Список текстов сообщений
+    """
+    messages = []
+    current = ""
+    for line in lines:
+        while len(line) > limit:
+            if current:
+                messages.append(current)
+                current = ""
+            messages.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            messages.append(current)
+            candidate = line
+        current = candidate
+    if current:
+        messages.append(current)
+    return messages
+
+
+class Outbox:
+    """
+    Общая очередь исходящих сообщений бота.
+
+    Все вызовы Bot API (send_message, send_document, ...) проходят через нее.
+    Сообщения в один чат отправляются по порядку, частота ограничивается
+    отдельно для каждого чата и для бота в целом. При ответе 429 чат
+    ставится на паузу на retry_after, сетевые ошибки повторяются.
+
+    Очередь работает в event loop: в асинхронном режиме бота - в его loop,
+    иначе в собственном потоке. send() можно вызывать из любого потока,
+    он не ждет отправки и возвращает concurrent.futures.Future.
+    """
+
+    def __init__(self, sender, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: int = CHAT_BURST, max_retries: int = MAX_RETRIES):
+        self.sender = sender
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, max(1, int(global_rate)))
+        self._queues = {}
+        self._buckets = {}
+        self._tasks = set()
+        self._loop = None
+        self._start_lock = threading.Lock()
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """
+        Запускает очередь.
+
+        :param loop: Работающий event loop; если не указан, создается свой поток
+        """
+        with self._start_lock:
+            if self._loop is not None:
+                return self
+            if loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def _run():
+                    asyncio.set_event_loop(loop)
+                    ready.set()
+                    loop.run_forever()
+
+                threading.Thread(target=_run, name="telegram-outbox", daemon=True).start()
+                ready.wait()
+            self._loop = loop
+            return self
+
+    def send(self, chat_id: int, method: str = "send_message", **kwargs):
+        """
+        Ставит вызов Bot API в очередь.
+
+        :param chat_id: ID чата, по нему считается лимит
+        :param method: Метод бота, например send_message или send_document
+        :param kwargs: Аргументы метода, chat_id подставляется сам
+        :return: concurrent.futures.Future с результатом вызова
+        """
+        if self._loop is None:
+            self.start()
+        return asyncio.run_coroutine_threadsafe(self.send_async(chat_id, method, **kwargs), self._loop)
+
+    def send_message(self, chat_id: int, text: str, **kwargs):
+        return self.send(chat_id, "send_message", text=text, **kwargs)
+
+    def send_messages(self, chat_id: int, lines, reply_markup=None, **kwargs) -> list:
+        """
+        Отправляет строки минимальным числом сообщений.
+
+        :param reply_markup: Клавиатура, прикрепляется к последнему сообщению
+        :return: Список Future
+        """
+        texts = split_message(lines)
+        futures = []
+        for i, text in enumerate(texts):
+            extra = {"reply_markup": reply_markup} if reply_markup is not None and i == len(texts) - 1 else {}
+            futures.append(self.send_message(chat_id, text, **kwargs, **extra))
+        return futures
+
+    async def send_async(self, chat_id: int, method: str = "send_message", **kwargs):
+        """Асинхронный send(): ждет, пока сообщение будет отправлено"""
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(chat_id, deque()).append((method, kwargs, future))
+        if len(self._queues[chat_id]) == 1:
+            task = asyncio.ensure_future(self._drain(chat_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return await future
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                now = time.monotonic()
+                for key in [k for k, b in self._buckets.items() if b.idle(now) and k not in self._queues]:
+                    del self._buckets[key]
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _drain(self, chat_id: int):
+        queue = self._queues[chat_id]
+        bucket = self._bucket(chat_id)
+        while queue:
+            method, kwargs, future = queue[0]
+            try:
+                result = await self._call(bucket, chat_id, method, kwargs)
+            except Exception as e:
+                # Большинство отправок никто не ждет, поэтому ошибка печатается здесь
+                print(f"Не удалось выполнить {method} для чата {chat_id}: {e}")
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+            queue.popleft()
+        del self._queues[chat_id]
+
+    async def _call(self, bucket: TokenBucket, chat_id: int, method: str, kwargs: dict):
+        if method not in NO_CHAT_ID_METHODS:
+            kwargs = {"chat_id": chat_id, **kwargs}
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                return await self.sender(method, kwargs)
+            except Exception as e:
+                wait = retry_after(e)
+                if wait is not None:
+                    bucket.block(wait)
+                    continue
+                if attempt >= self.max_retries or not is_network_error(e):
+                    raise
+                await asyncio.sleep(random.uniform(0, 2 ** attempt))
+                attempt += 1
+
+    async def join(self):
+        """Ждет, пока все поставленные сообщения будут отправлены"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def flush(self, timeout: float = None):
+        """Синхронный join() для остановки бота"""
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.join(), self._loop).result(timeout)
+
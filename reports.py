@@ -0,0 +1,131 @@
+import os
+import io
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from fpdf import FPDF, set_global
+
+import db
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FONT_FILE = os.path.join(BASE_DIR, 'DejaVuSans.ttf')
+# Метрики шрифта fpdf сохраняет в pickle при первом add_font и дальше читает оттуда,
+# не разбирая TTF. В режиме 2 кэш лежит в отдельной папке и хранит абсолютный путь
+# к шрифту, поэтому отчеты строятся при любой текущей папке процесса
+FONT_CACHE_DIR = os.getenv('FONT_CACHE_DIR', os.path.join(BASE_DIR, 'font_cache'))
+
+_font_cache_ready = False
+
+
+def _init_font_cache():
+    """Настраивает кэш метрик шрифта fpdf при первом отчете, а не при импорте модуля"""
+    global _font_cache_ready
+    if _font_cache_ready:
+        return
+    os.makedirs(FONT_CACHE_DIR, exist_ok=True)
+    set_global('FPDF_CACHE_MODE', 2)
+    set_global('FPDF_CACHE_DIR', FONT_CACHE_DIR)
+    _font_cache_ready = True
+
+
+class PDF(FPDF):
+    def __init__(self):
+        _init_font_cache()
+        super().__init__()
+        self.add_font('DejaVu', '', FONT_FILE, uni=True)
+        self.set_font('DejaVu', '', 12)
+
+
+def render_report(inspection_id: int) -> bytes:
+    """
+    Генерирует PDF отчет с поддержкой UTF-8 в памяти.
+
+    :param inspection_id: ID проверки
+    :return: Содержимое PDF или None, если ответов нет
+    """
+    report_data = db.get_report_rows(inspection_id)
+
+    if not report_data:
+        return None
+
+    pdf = PDF()
+    pdf.add_page()
+
+    # Заголовок
+    pdf.set_font('DejaVu', '', 16)
+    pdf.cell(200, 10, txt="ОТЧЕТ О ПРОВЕРКЕ", ln=True, align='C')
+    pdf.ln(15)
+
+    # Содержание
+    pdf.set_font('DejaVu', '', 12)
+    for idx, (question, answer) in enumerate(report_data, 1):
+        question = question if isinstance(question, str) else str(question, 'utf-8')
+        answer = answer if isinstance(answer, str) else str(answer, 'utf-8')
+
+        pdf.multi_cell(0, 8, f"Вопрос #{idx}:\n{question}", 0, 'L')
+        pdf.multi_cell(0, 8, f"Ответ:\n{answer}", 0, 'L')
+        pdf.ln(10)
+
+    # fpdf хранит документ строкой latin-1
+    return pdf.output(dest='S').encode('latin-1')
+
+
+def report_filename(inspection_id: int) -> str:
+    return f"report_{inspection_id}.pdf"
+
+
+def save_report(inspection_id: int, out_dir: str) -> str:
+    """
+    Сохраняет PDF отчет проверки в папку.
+
+    :return: Путь к файлу или None, если ответов нет
+    """
+    pdf = render_report(inspection_id)
+    if pdf is None:
+        return None
+    path = os.path.join(out_dir, report_filename(inspection_id))
+    with open(path, 'wb') as f:
+        f.write(pdf)
+    return path
+
+
+def _init_report_worker(db_name: str):
+    # Процесс запускается через spawn и видит только DB_NAME из окружения,
+    # а не измененный в родителе (например, тестовую базу)
+    db.DB_NAME = db_name
+
+
+def _render_for_archive(inspection_id: int):
+    return inspection_id, render_report(inspection_id)
+
+
+def report_pool(workers: int = None, db_name: str = None) -> ProcessPoolExecutor:
+    """
+    Пул процессов для построения отчетов: fpdf держит GIL, поэтому отчеты
+    параллельно строятся только в отдельных процессах.
+
+    :param workers: Число процессов, по умолчанию по числу ядер
+    :param db_name: База с проверками, по умолчанию db.DB_NAME этого процесса
+    """
+    # Кэш метрик шрифта создается до запуска процессов, чтобы они не писали его одновременно
+    PDF()
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_report_worker, initargs=(db_name or db.DB_NAME,))
+
+
+def render_reports_archive(inspection_ids, workers: int = None, db_name: str = None) -> bytes:
+    """
+    Генерирует отчеты по многим проверкам параллельно и упаковывает в один ZIP.
+
+    :param inspection_ids: ID проверок
+    :param workers: Число процессов, по умолчанию по числу ядер
+    :param db_name: База с проверками, по умолчанию db.DB_NAME этого процесса
+    :return: Содержимое ZIP-архива
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive, report_pool(workers, db_name) as pool:
+        for inspection_id, pdf in pool.map(_render_for_archive, inspection_ids, chunksize=8):
+            if pdf is not None:
+                archive.writestr(report_filename(inspection_id), pdf)
+    return buffer.getvalue()
@@ -0,0 +1,339 @@
+"""
+Полнотекстовый поиск по расшифровкам, диалогам и ответам проверок.
+
+Тексты хранятся в таблице transcripts (по проверке), ответы - в answers.
+Индекс search_index - таблица SQLite FTS5 над основами слов: встроенные
+токенизаторы FTS5 не знают русской морфологии, поэтому слова заранее
+приводятся к основе стеммером Snowball (stem()), и "трейдин", "акции",
+"акцию" находят друг друга. Изменения transcripts и answers триггеры
+складывают в search_queue, а index_pending() переиндексирует только их.
+
+Поиск: search("трейд-ин акция", user_id=None) - результаты по убыванию
+релевантности (bm25) с фрагментом текста, где найденные слова выделены.
+"""
+import re
+import datetime
+
+import db
+
+SNIPPET_WORDS = 24
+
+# Виды документов в индексе; rowid документа = ref_id * KIND_COUNT + код вида
+KIND_ANSWER = "answer"
+KIND_TRANSCRIPT = "transcript"
+KIND_DIALOGUE = "dialogue"
+KIND_CODES = {KIND_ANSWER: 0, KIND_TRANSCRIPT: 1, KIND_DIALOGUE: 2}
+KIND_COUNT = 4
+KIND_NAMES = {KIND_ANSWER: "ответ", KIND_TRANSCRIPT: "расшифровка", KIND_DIALOGUE: "диалог"}
+
+WORD_RE = re.compile(r"\w+(?:-\w+)*", re.UNICODE)
+
+
+# ---- Стеммер Snowball для русского языка ----
+_VOWELS = "аеиоуыэюя"
+
+_PERFECTIVE_GERUND_1 = ("вшись", "вши", "в")
+_PERFECTIVE_GERUND_2 = ("ывшись", "ившись", "ывши", "ивши", "ыв", "ив")
+_ADJECTIVE = ("ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий", "ый", "ой",
+              "ем", "им", "ым", "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею")
+_PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")
+_PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+_REFLEXIVE = ("ся", "сь")
+_VERB_1 = ("ете", "йте", "ешь", "нно", "ла", "на", "ли", "ем", "ло", "но", "ет", "ют", "ны", "ть", "й", "л", "н")
+_VERB_2 = ("ейте", "уйте", "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено", "ует", "уют",
+           "ены", "ить", "ыть", "ишь", "ей", "уй", "ил", "ыл", "им", "ым", "ен", "ят", "ит", "ыт", "ую", "ю")
+_NOUN = ("иями", "ями", "ами", "ией", "иям", "ием", "иях", "ев", "ов", "ие", "ье", "еи", "ии", "ей", "ой",
+         "ий", "ям", "ем", "ам", "ом", "ах", "ях", "ию", "ью", "ия", "ья", "а", "е", "и", "й", "о", "у",
+         "ы", "ь", "ю", "я")
+_DERIVATIONAL = ("ость", "ост")
+_SUPERLATIVE = ("ейше", "ейш")
+
+
+def _longest(word: str, suffixes: tuple, start: int):
+    """Самое длинное окончание из списка, целиком лежащее в word[start:]"""
+    best = None
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= start:
+            if best is None or len(suffix) > len(best):
+                best = suffix
+    return best
+
+
+def _strip_group(word: str, group_1: tuple, group_2: tuple, start: int):
+    """Окончания первой группы удаляются только после "а" или "я", второй - всегда"""
+    best = None
+    for suffix in group_1:
+        if (word.endswith(suffix) and len(word) - len(suffix) > start
+                and word[-len(suffix) - 1] in "ая" and (best is None or len(suffix) > len(best))):
+            best = suffix
+    suffix = _longest(word, group_2, start)
+    if suffix is not None and (best is None or len(suffix) > len(best)):
+        best = suffix
+    return word[:-len(best)] if best else None
+
+
+def _regions(word: str):
+    rv = r1 = r2 = len(word)
+    for i, ch in enumerate(word):
+        if ch in _VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def stem(word: str) -> str:
+    """Основа русского слова по алгоритму Snowball; прочие слова - в нижнем регистре"""
+    word = word.lower().replace("ё", "е")
+    if not re.fullmatch(r"[а-я]+", word):
+        return word
+    rv, r2 = _regions(word)
+
+    # Шаг 1
+    stripped = _strip_group(word, _PERFECTIVE_GERUND_1, _PERFECTIVE_GERUND_2, rv)
+    if stripped is not None:
+        word = stripped
+    else:
+        suffix = _longest(word, _REFLEXIVE, rv)
+        if suffix:
+            word = word[:-len(suffix)]
+        adjective = _longest(word, _ADJECTIVE, rv)
+        if adjective:
+            word = word[:-len(adjective)]
+            participle = _strip_group(word, _PARTICIPLE_1, _PARTICIPLE_2, rv)
+            if participle is not None:
+                word = participle
+        else:
+            verb = _strip_group(word, _VERB_1, _VERB_2, rv)
+            if verb is not None:
+                word = verb
+            else:
+                suffix = _longest(word, _NOUN, rv)
+                if suffix:
+                    word = word[:-len(suffix)]
+
+    # Шаг 2
+    if word.endswith("и") and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Шаг 3
+    suffix = _longest(word, _DERIVATIONAL, r2)
+    if suffix:
+        word = word[:-len(suffix)]
+
+    # Шаг 4
+    if word.endswith("нн") and len(word) - 2 >= rv:
+        word = word[:-1]
+    else:
+        suffix = _longest(word, _SUPERLATIVE, rv)
+        if suffix:
+            word = word[:-len(suffix)]
+            if word.endswith("нн"):
+                word = word[:-1]
+        elif word.endswith("ь") and len(word) - 1 >= rv:
+            word = word[:-1]
+    return word
+
+
+def tokens(text: str) -> list:
+    """Слова текста; слова через дефис ("трейд-ин") дают и части, и слитное написание"""
+    result = []
+    for match in WORD_RE.finditer(text or ""):
+        word = match.group()
+        if "-" in word:
+            result.extend(word.split("-"))
+            word = word.replace("-", "")
+        result.append(word)
+    return result
+
+
+def stems_text(text: str) -> str:
+    return " ".join(stem(word) for word in tokens(text))
+
+
+# ---- Индексация ----
+def store_transcript(inspection_id: int, raw_text: str = None, dialogue: str = None, db_name: str = None):
+    """Сохраняет расшифровку и диалог проверки и сразу обновляет индекс"""
+    with db.transaction(db_name) as conn:
+        conn.execute('''
+            INSERT INTO transcripts (inspection_id, raw_text, dialogue, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (inspection_id) DO UPDATE SET
+                raw_text = COALESCE(excluded.raw_text, transcripts.raw_text),
+                dialogue = COALESCE(excluded.dialogue, transcripts.dialogue),
+                updated_at = excluded.updated_at
+        ''', (inspection_id, raw_text, dialogue, datetime.datetime.now()))
+    index_pending(db_name)
+
+
+def _documents(conn, kind: str, ref_id: int) -> list:
+    """[(rowid, kind, inspection_id, текст)] для элемента очереди; пусто, если источник удален"""
+    if kind == KIND_ANSWER:
+        row = conn.execute('SELECT inspection_id, answer_text FROM answers WHERE answer_id = ?', (ref_id,)).fetchone()
+        if row is None or row[1] == 'null':
+            return []
+        return [(ref_id * KIND_COUNT + KIND_CODES[KIND_ANSWER], KIND_ANSWER, row[0], row[1])]
+    row = conn.execute('SELECT raw_text, dialogue FROM transcripts WHERE inspection_id = ?', (ref_id,)).fetchone()
+    if row is None:
+        return []
+    return [(ref_id * KIND_COUNT + KIND_CODES[doc_kind], doc_kind, ref_id, text)
+            for doc_kind, text in ((KIND_TRANSCRIPT, row[0]), (KIND_DIALOGUE, row[1])) if text]
+
+
+def index_pending(db_name: str = None, batch: int = 500) -> int:
+    """
+    Переиндексирует изменившиеся ответы и расшифровки из search_queue.
+
+    :return: Сколько элементов очереди обработано
+    """
+    done = 0
+    while True:
+        with db.transaction(db_name) as conn:
+            queued = conn.execute('SELECT kind, ref_id FROM search_queue LIMIT ?', (batch,)).fetchall()
+            for kind, ref_id in queued:
+                codes = ([KIND_CODES[KIND_ANSWER]] if kind == KIND_ANSWER
+                         else [KIND_CODES[KIND_TRANSCRIPT], KIND_CODES[KIND_DIALOGUE]])
+                for code in codes:
+                    conn.execute('DELETE FROM search_index WHERE rowid = ?', (ref_id * KIND_COUNT + code,))
+                for rowid, doc_kind, inspection_id, text in _documents(conn, kind, ref_id):
+                    conn.execute('INSERT INTO search_index (rowid, stems, kind, inspection_id, ref_id) '
+                                 'VALUES (?, ?, ?, ?, ?)', (rowid, stems_text(text), doc_kind, inspection_id, ref_id))
+                conn.execute('DELETE FROM search_queue WHERE kind = ? AND ref_id = ?', (kind, ref_id))
+        done += len(queued)
+        if len(queued) < batch:
+            return done
+
+
+def rebuild(db_name: str = None) -> int:
+    """Полная переиндексация всех ответов и расшифровок"""
+    with db.transaction(db_name) as conn:
+        conn.execute('DELETE FROM search_index')
+        conn.execute(f"INSERT OR IGNORE INTO search_queue (kind, ref_id) "
+                     f"SELECT '{KIND_ANSWER}', answer_id FROM answers")
+        conn.execute(f"INSERT OR IGNORE INTO search_queue (kind, ref_id) "
+                     f"SELECT '{KIND_TRANSCRIPT}', inspection_id FROM transcripts")
+    return index_pending(db_name)
+
+
+# ---- Поиск ----
+def _term(word_stem: str) -> str:
+    # Основа в кавычках, поэтому операторы FTS5 в тексте запроса не действуют;
+    # короткие основы ищутся целиком, иначе "ин" совпадет с половиной словаря
+    return f'"{word_stem}"*' if len(word_stem) >= 3 else f'"{word_stem}"'
+
+
+def _match_query(query: str) -> tuple:
+    """
+    Запрос FTS5: все слова обязательны, слово через дефис - как части или слитно.
+
+    :return: (выражение MATCH, основы слов запроса для выделения во фрагменте)
+    """
+    groups = []
+    query_stems = []
+    for match in WORD_RE.finditer(query):
+        word = match.group()
+        if "-" in word:
+            parts = [stem(part) for part in word.split("-") if part]
+            joined = stem(word.replace("-", ""))
+            groups.append(f'(({" AND ".join(_term(p) for p in parts)}) OR {_term(joined)})')
+            query_stems.extend(parts + [joined])
+        else:
+            word_stem = stem(word)
+            groups.append(_term(word_stem))
+            query_stems.append(word_stem)
+    return " AND ".join(groups), list(dict.fromkeys(s for s in query_stems if s))
+
+
+def snippet(text: str, query_stems: list, words: int = SNIPPET_WORDS, before: str = "«", after: str = "»") -> str:
+    """Фрагмент текста с наибольшим числом найденных слов; найденные слова выделены"""
+    matches = list(WORD_RE.finditer(text))
+    if not matches:
+        return ""
+    hits = [any(word.startswith(s) for word in stems_text(m.group()).split() for s in query_stems)
+            for m in matches]
+    best_start, best_hits = 0, -1
+    for start in range(0, max(1, len(matches) - words + 1)):
+        count = sum(hits[start:start + words])
+        if count > best_hits:
+            best_start, best_hits = start, count
+    window = range(best_start, min(len(matches), best_start + words))
+
+    parts = []
+    position = matches[window[0]].start()
+    for i in window:
+        m = matches[i]
+        parts.append(text[position:m.start()])
+        parts.append(f"{before}{m.group()}{after}" if hits[i] else m.group())
+        position = m.end()
+    if window[-1] == len(matches) - 1:
+        parts.append(text[position:])
+    fragment = "".join(parts).replace("\n", " ").strip()
+    prefix = "…" if window[0] > 0 else ""
+    suffix = "…" if window[-1] < len(matches) - 1 else ""
+    return f"{prefix}{fragment}{suffix}"
+
+
+def search(query: str, user_id: int = None, survey_id: int = None, kinds: tuple = None, limit: int = 10,
+           before: str = "«", after: str = "»", db_name: str = None) -> list:
+    """
+    Ищет проверки по расшифровкам, диалогам и ответам.
+
+    :param user_id: Только проверки этого проверяющего
+    :param kinds: Виды документов (answer, transcript, dialogue); по умолчанию все
+    :param before: Разметка перед найденным словом во фрагменте
+    :param after: Разметка после найденного слова
+    :return: [{"inspection_id", "kind", "ref_id", "score", "snippet", "question"}, ...]
+    """
+    match, query_stems = _match_query(query)
+    if not match:
+        return []
+    index_pending(db_name)
+
+    sql = '''
+        SELECT s.kind, s.inspection_id, s.ref_id, bm25(search_index) AS score
+        FROM search_index s
+        JOIN inspections i ON i.inspection_id = s.inspection_id
+        WHERE search_index MATCH ?
+    '''
+    params = [f"stems : ({match})"]
+    if user_id is not None:
+        sql += ' AND i.user_id = ?'
+        params.append(user_id)
+    if survey_id is not None:
+        sql += ' AND i.survey_id = ?'
+        params.append(survey_id)
+    if kinds:
+        sql += f' AND s.kind IN ({", ".join("?" * len(kinds))})'
+        params.extend(kinds)
+    sql += ' ORDER BY score LIMIT ?'
+    params.append(limit)
+
+    conn = db.get_connection(db_name)
+    results = []
+    for kind, inspection_id, ref_id, score in conn.execute(sql, params).fetchall():
+        question = None
+        if kind == KIND_ANSWER:
+            row = conn.execute('''
+                SELECT a.answer_text, q.question_text FROM answers a
+                JOIN questions q ON q.question_id = a.question_id WHERE a.answer_id = ?
+            ''', (ref_id,)).fetchone()
+            text, question = row if row else ("", None)
+        else:
+            column = "raw_text" if kind == KIND_TRANSCRIPT else "dialogue"
+            row = conn.execute(f'SELECT {column} FROM transcripts WHERE inspection_id = ?', (ref_id,)).fetchone()
+            text = row[0] if row else ""
+        results.append({
+            "inspection_id": inspection_id,
+            "kind": kind,
+            "ref_id": ref_id,
+            "score": round(-score, 4),
+            "snippet": snippet(text or "", query_stems, before=before, after=after),
+            "question": question,
+        })
+    return results
@@ -0,0 +1,177 @@
+import json
+import datetime
+from abc import ABC, abstractmethod
+
+import db
+
+# Состояния сессии проверки
+PROCESSING = "processing"  # запись в очереди или обрабатывается
+QUESTIONS = "questions"    # ждем ответов проверяющего на оставшиеся вопросы
+DONE = "done"
+FAILED = "failed"
+
+OPEN_STATES = (PROCESSING, QUESTIONS)
+
+
+class InspectionSession:
+    """Состояние диалога проверяющего с ботом по одной проверке"""
+
+    __slots__ = ("inspection_id", "user_id", "survey_id", "state", "question_ids", "updated_at")
+
+    def __init__(self, inspection_id: int, user_id: int, survey_id: int, state: str,
+                 question_ids: list, updated_at=None):
+        self.inspection_id = inspection_id
+        self.user_id = user_id
+        self.survey_id = survey_id
+        self.state = state
+        # Вопросы без ответа в том порядке, в котором их пронумеровали для проверяющего
+        self.question_ids = question_ids
+        self.updated_at = updated_at
+
+    def question_id(self, num: int):
+        """ID вопроса по его номеру в списке (с 1) или None"""
+        if 1 <= num <= len(self.question_ids):
+            return self.question_ids[num - 1]
+        return None
+
+
+class SessionStore(ABC):
+    """
+    Хранилище сессий проверок.
+
+    Бот не держит состояние в памяти процесса: все, что нужно для ответа
+    пользователю, берется отсюда, поэтому запросы одного проверяющего
+    может обслуживать любой процесс бота. Реализация по умолчанию -
+    SQLiteSessionStore.
+    """
+
+    @abstractmethod
+    def start(self, user_id: int, survey_id: int, file_id: str = None) -> InspectionSession:
+        """Создает проверку и ее сессию в состоянии processing"""
+
+    @abstractmethod
+    def get(self, inspection_id: int) -> InspectionSession:
+        """Сессия проверки или None"""
+
+    @abstractmethod
+    def open_sessions(self, user_id: int) -> list:
+        """Незавершенные проверки пользователя, новые первыми"""
+
+    @abstractmethod
+    def set_state(self, inspection_id: int, state: str, question_ids: list = None):
+        """Меняет состояние; переход в questions делает проверку активной для пользователя"""
+
+    @abstractmethod
+    def active(self, user_id: int) -> InspectionSession:
+        """Проверка, к которой относятся ответы пользователя без явного номера проверки"""
+
+    @abstractmethod
+    def activate(self, user_id: int, inspection_id: int) -> bool:
+        """Делает открытую проверку пользователя активной; False, если такой нет"""
+
+    @abstractmethod
+    def survey_for(self, user_id: int, default: int) -> int:
+        """Анкета для новых проверок пользователя"""
+
+    @abstractmethod
+    def set_survey(self, user_id: int, survey_id: int):
+        """Запоминает анкету для новых проверок пользователя"""
+
+
+SQL_SESSION = '''
+    SELECT s.inspection_id, s.user_id, i.survey_id, s.state, s.question_ids, s.updated_at
+    FROM inspection_sessions s
+    JOIN inspections i ON i.inspection_id = s.inspection_id
+'''
+
+
+class SQLiteSessionStore(SessionStore):
+    """Сессии в таблицах inspection_sessions и user_settings базы бота"""
+
+    def __init__(self, db_name: str = None):
+        self.db_name = db_name
+
+    def _row_to_session(self, row):
+        if row is None:
+            return None
+        inspection_id, user_id, survey_id, state, question_ids, updated_at = row
+        return InspectionSession(inspection_id, user_id, survey_id, state,
+                                 json.loads(question_ids), updated_at)
+
+    def start(self, user_id: int, survey_id: int, file_id: str = None) -> InspectionSession:
+        now = datetime.datetime.now()
+        with db.transaction(self.db_name) as conn:
+            cursor = conn.execute(
+                'INSERT INTO inspections (user_id, survey_id, file_id, created_at) VALUES (?, ?, ?, ?)',
+                (user_id, survey_id, file_id, now))
+            inspection_id = cursor.lastrowid
+            conn.execute('''
+                INSERT INTO inspection_sessions (inspection_id, user_id, state, question_ids, updated_at)
+                VALUES (?, ?, ?, '[]', ?)
+            ''', (inspection_id, user_id, PROCESSING, now))
+        return InspectionSession(inspection_id, user_id, survey_id, PROCESSING, [], now)
+
+    def get(self, inspection_id: int) -> InspectionSession:
+        conn = db.get_connection(self.db_name)
+        row = conn.execute(SQL_SESSION + ' WHERE s.inspection_id = ?', (inspection_id,)).fetchone()
+        return self._row_to_session(row)
+
+    def open_sessions(self, user_id: int) -> list:
+        conn = db.get_connection(self.db_name)
+        rows = conn.execute(
+            SQL_SESSION + ' WHERE s.user_id = ? AND s.state IN (?, ?) ORDER BY s.inspection_id DESC',
+            (user_id, *OPEN_STATES)).fetchall()
+        return [self._row_to_session(row) for row in rows]
+
+    def set_state(self, inspection_id: int, state: str, question_ids: list = None):
+        now = datetime.datetime.now()
+        with db.transaction(self.db_name) as conn:
+            if question_ids is None:
+                cursor = conn.execute(
+                    'UPDATE inspection_sessions SET state = ?, updated_at = ? WHERE inspection_id = ?',
+                    (state, now, inspection_id))
+            else:
+                cursor = conn.execute('''
+                    UPDATE inspection_sessions SET state = ?, question_ids = ?, updated_at = ?
+                    WHERE inspection_id = ?
+                ''', (state, json.dumps(list(question_ids)), now, inspection_id))
+            if cursor.rowcount and state == QUESTIONS:
+                conn.execute('''
+                    INSERT INTO user_settings (user_id, active_inspection_id)
+                    SELECT user_id, inspection_id FROM inspection_sessions WHERE inspection_id = ?
+                    ON CONFLICT (user_id) DO UPDATE SET active_inspection_id = excluded.active_inspection_id
+                ''', (inspection_id,))
+
+    def active(self, user_id: int) -> InspectionSession:
+        conn = db.get_connection(self.db_name)
+        # Выбранная проверка, а если она уже закрыта - последняя из ожидающих ответов
+        row = conn.execute(SQL_SESSION + '''
+            LEFT JOIN user_settings u ON u.user_id = s.user_id
+            WHERE s.user_id = ? AND s.state = ?
+            ORDER BY s.inspection_id = u.active_inspection_id DESC, s.inspection_id DESC
+            LIMIT 1
+        ''', (user_id, QUESTIONS)).fetchone()
+        return self._row_to_session(row)
+
+    def activate(self, user_id: int, inspection_id: int) -> bool:
+        session = self.get(inspection_id)
+        if session is None or session.user_id != user_id or session.state != QUESTIONS:
+            return False
+        with db.transaction(self.db_name) as conn:
+            conn.execute('''
+                INSERT INTO user_settings (user_id, active_inspection_id) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET active_inspection_id = excluded.active_inspection_id
+            ''', (user_id, inspection_id))
+        return True
+
+    def survey_for(self, user_id: int, default: int) -> int:
+        row = db.get_connection(self.db_name).execute(
+            'SELECT survey_id FROM user_settings WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row and row[0] is not None else default
+
+    def set_survey(self, user_id: int, survey_id: int):
+        with db.transaction(self.db_name) as conn:
+            conn.execute('''
+                INSERT INTO user_settings (user_id, survey_id) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET survey_id = excluded.survey_id
+            ''', (user_id, survey_id))
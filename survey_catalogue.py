@@ -0,0 +1,121 @@
+import os
+import time
+import threading
+
+import db
+
+# Как часто сверять версию каталога с базой, в секундах
+CHECK_INTERVAL = float(os.getenv("CATALOGUE_CHECK_INTERVAL", "5"))
+
+SQL_CATALOGUE_VERSION = 'SELECT version FROM catalogue_version WHERE id = 1'
+SQL_ALL_SURVEYS = 'SELECT survey_id, client_name FROM surveys'
+SQL_ALL_QUESTIONS = 'SELECT question_id, survey_id, question_text FROM questions ORDER BY survey_id, question_id'
+
+
+class Survey:
+    """Анкета с вопросами в порядке question_id"""
+
+    __slots__ = ("survey_id", "client_name", "questions", "texts", "prompt")
+
+    def __init__(self, survey_id: int, client_name: str, questions: list):
+        self.survey_id = survey_id
+        self.client_name = client_name
+        self.questions = tuple(questions)
+        self.texts = dict(questions)
+        # Строка вопросов в том виде, в котором ее получает YandexGPT
+        self.prompt = str(self.texts)
+
+
+class SurveyCatalogue:
+    """
+    Каталог анкет и вопросов процесса.
+
+    Все анкеты загружаются из базы одним запросом и дальше отдаются из
+    словарей. Изменения вопросов и анкет отслеживаются по счетчику в
+    таблице catalogue_version, который увеличивают триггеры базы (в том
+    числе при заполнении вопросов из test.py). Счетчик проверяется не чаще
+    раза в check_interval секунд; после правок из этого же процесса можно
+    вызвать invalidate().
+    """
+
+    def __init__(self, db_name: str = None, check_interval: float = CHECK_INTERVAL):
+        self.db_name = db_name
+        self.check_interval = check_interval
+        self._surveys = {}
+        self._question_texts = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _current_version(self, conn) -> int:
+        row = conn.execute(SQL_CATALOGUE_VERSION).fetchone()
+        return row[0] if row else 0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if self._version is not None and now - self._checked_at < self.check_interval:
+                return
+            conn = db.get_connection(self.db_name)
+            version = self._current_version(conn)
+            if version != self._version:
+                self._load(conn, version)
+            self._checked_at = now
+
+    def _load(self, conn, version: int):
+        clients = dict(conn.execute(SQL_ALL_SURVEYS).fetchall())
+        grouped = {}
+        texts = {}
+        for question_id, survey_id, text in conn.execute(SQL_ALL_QUESTIONS):
+            grouped.setdefault(survey_id, []).append((question_id, text))
+            texts[question_id] = text
+        surveys = {survey_id: Survey(survey_id, clients.get(survey_id), grouped.get(survey_id, []))
+                   for survey_id in set(clients) | set(grouped)}
+        # Словари подменяются целиком, читатели без блокировки видят либо старый, либо новый каталог
+        self._surveys = surveys
+        self._question_texts = texts
+        self._version = version
+
+    def invalidate(self):
+        """Перечитать каталог при следующем обращении"""
+        with self._lock:
+            self._version = None
+
+    def survey(self, survey_id: int) -> Survey:
+        """Анкета по ID; для неизвестной анкеты - пустая"""
+        self._refresh()
+        survey = self._surveys.get(survey_id)
+        return survey if survey is not None else Survey(survey_id, None, [])
+
+    def exists(self, survey_id: int) -> bool:
+        """Есть ли анкета в таблице surveys: только на такую могут ссылаться проверки"""
+        self._refresh()
+        survey = self._surveys.get(survey_id)
+        return survey is not None and survey.client_name is not None
+
+    def questions(self, survey_id: int) -> tuple:
+        """Пары (question_id, question_text) анкеты в порядке question_id"""
+        return self.survey(survey_id).questions
+
+    def question_texts(self, survey_id: int) -> dict:
+        """Словарь {question_id: question_text} анкеты (копия, ее можно менять)"""
+        return dict(self.survey(survey_id).texts)
+
+    def questions_prompt(self, survey_id: int) -> str:
+        """Вопросы анкеты строкой для запроса к YandexGPT"""
+        return self.survey(survey_id).prompt
+
+    def question_text(self, question_id: int) -> str:
+        self._refresh()
+        return self._question_texts.get(question_id)
+
+    @property
+    def version(self) -> int:
+        self._refresh()
+        return self._version
+
+
+# Общий каталог процесса
+catalogue = SurveyCatalogue()
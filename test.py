@@ -1,82 +1,12 @@
 import json
 import sqlite3
 
+from migrations import migrate
+
   
 def create_tables():
-    # Подключаемся к базе данных (или создаём её, если она не существует)
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-
-    # Таблица "users"
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,  
-            username TEXT,                
-            first_name TEXT,              
-            last_name TEXT,               
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  
-            UNIQUE(user_id)    
-        )           
-    ''')
-
-    # Таблица "surveys"
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS surveys (
-            survey_id INTEGER PRIMARY KEY AUTOINCREMENT,  
-            client_name TEXT NOT NULL,                   
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP  
-        )
-    ''')
-
-    # Таблица "questions"
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS questions (
-            question_id INTEGER PRIMARY KEY AUTOINCREMENT,  
-            survey_id INTEGER NOT NULL,                   
-            question_text TEXT NOT NULL,                  
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  
-            FOREIGN KEY (survey_id) REFERENCES surveys (survey_id) ON DELETE CASCADE,
-            UNIQUE(question_id, survey_id)  
-        )
-    ''')
-
-    # Таблица "inspections"
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS inspections (
-            inspection_id INTEGER PRIMARY KEY AUTOINCREMENT,  
-            user_id INTEGER NOT NULL,
-            survey_id INTEGER NOT NULL,                       
-            file_id INTEGER,                               
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, 
-            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
-            FOREIGN KEY (survey_id) REFERENCES surveys (survey_id) ON DELETE CASCADE
-        )
-    ''')
-
-    # Таблица "answers"
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS answers (
-            answer_id INTEGER PRIMARY KEY AUTOINCREMENT,  
-            user_id INTEGER NOT NULL,                     
-            question_id INTEGER NOT NULL,                 
-            answer_text TEXT NOT NULL,                   
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  
-            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
-            FOREIGN KEY (question_id) REFERENCES questions (question_id) ON DELETE CASCADE,
-            UNIQUE(user_id, question_id)  
-        )
-    ''')
-
-    # Создаём индексы для ускорения поиска
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_user_id ON users (user_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_surveys_survey_id ON surveys (survey_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_question_id ON questions (question_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_inspections_inspection_id ON inspections (inspection_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_answers_answer_id ON answers (answer_id)')
-
-    # Сохраняем изменения и закрываем соединение
-    conn.commit()
-    conn.close()
+    # Схема создается и обновляется версионными миграциями
+    migrate('bot.db', verbose=True)
 
 # Вызываем функцию для создания таблиц
 create_tables()
@@ -139,8 +69,23 @@ def add_question(survey_id: int, question_text: str):
     conn.commit()
     conn.close()
 
+# Функция для добавления анкеты, на которую ссылаются вопросы и проверки
+def add_survey(survey_id: int, client_name: str):
+    conn = sqlite3.connect('bot.db')
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        INSERT INTO surveys (survey_id, client_name)
+        VALUES (?, ?)
+        ON CONFLICT (survey_id) DO NOTHING
+    ''', (survey_id, client_name))
+
+    conn.commit()
+    conn.close()
+
 # Пример использования
 survey_id = 3  # ID анкеты, к которой относятся вопросы
+add_survey(survey_id, f"Анкета {survey_id}")
 
 # Добавляем каждый вопрос из словаря в базу данных
 for question_id, question_text in questions_dict.items():
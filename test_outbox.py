@@ -0,0 +1,97 @@
+"""
+Тесты очереди исходящих сообщений (outbox.py) против поддельного Bot API
+(fake_bot_api.py): лимиты частоты, пауза по 429 с retry_after и сборка
+строк в минимальное число сообщений.
+
+Нужен pyTelegramBotAPI; без него тесты пропускаются.
+
+Запуск: python -m unittest test_outbox  (или python -m pytest test_outbox.py)
+"""
+import time
+import importlib.util
+import unittest
+
+import fake_bot_api
+from outbox import Outbox, sync_sender, MESSAGE_LIMIT
+
+HAS_TELEBOT = importlib.util.find_spec("telebot") is not None
+
+
+@unittest.skipUnless(HAS_TELEBOT, "нет pyTelegramBotAPI")
+class OutboxTest(unittest.TestCase):
+    def start(self, fake: fake_bot_api.FakeTelegram = None, **limits) -> Outbox:
+        import telebot
+        from telebot import apihelper
+
+        server = fake_bot_api.serve(0, fake)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.fake = server.fake
+        api_url = apihelper.API_URL
+        apihelper.API_URL = f"http://127.0.0.1:{server.server_port}/bot{{0}}/{{1}}"
+        self.addCleanup(setattr, apihelper, "API_URL", api_url)
+        outbox = Outbox(sync_sender(telebot.TeleBot("123:fake")), **limits).start()
+        self.addCleanup(lambda: outbox._loop.call_soon_threadsafe(outbox._loop.stop))
+        return outbox
+
+    def send_all(self, outbox: Outbox, messages) -> float:
+        """Отправляет (chat_id, text) и ждет ответов; возвращает время в секундах"""
+        started = time.monotonic()
+        for future in [outbox.send_message(chat_id, text) for chat_id, text in messages]:
+            future.result(timeout=30)
+        return time.monotonic() - started
+
+    def texts(self, chat_id: int) -> list:
+        return [item["text"] for item in self.fake.sent if item["chat_id"] == str(chat_id)]
+
+    def test_chat_rate_is_limited(self):
+        outbox = self.start(fake_bot_api.FakeTelegram(chat_limit=20), chat_rate=10, chat_burst=2)
+        elapsed = self.send_all(outbox, [(1, f"Сообщение {i}") for i in range(8)])
+        stats = self.fake.stats()
+        self.assertEqual(stats["sent"], 8)
+        self.assertEqual(stats["rejected_429"], 0)
+        self.assertEqual(self.texts(1), [f"Сообщение {i}" for i in range(8)])
+        # 2 сообщения сразу, остальные 6 - по 10 в секунду
+        self.assertGreaterEqual(elapsed, 6 / 10 * 0.9)
+
+    def test_global_rate_is_limited(self):
+        outbox = self.start(global_rate=15, chat_rate=100, chat_burst=100)
+        elapsed = self.send_all(outbox, [(1000 + i % 5, f"Сообщение {i}") for i in range(25)])
+        stats = self.fake.stats()
+        self.assertEqual(stats["sent"], 25)
+        self.assertEqual(stats["rejected_429"], 0)
+        self.assertEqual(stats["per_chat"], {str(1000 + i): 5 for i in range(5)})
+        # 15 сообщений сразу, остальные 10 - по 15 в секунду
+        self.assertGreaterEqual(elapsed, 10 / 15 * 0.9)
+
+    def test_retry_after_pauses_the_chat(self):
+        # Сервер пропускает 2 сообщения в секунду в чат, очередь лимит не соблюдает
+        outbox = self.start(fake_bot_api.FakeTelegram(chat_limit=2), chat_rate=100, chat_burst=100)
+        elapsed = self.send_all(outbox, [(1, f"Сообщение {i}") for i in range(4)])
+        stats = self.fake.stats()
+        self.assertEqual(stats["rejected_429"], 1)
+        self.assertEqual(self.texts(1), [f"Сообщение {i}" for i in range(4)])
+        # После 429 чат ждал retry_after = 1 с
+        self.assertGreaterEqual(elapsed, 0.9)
+        self.assertGreaterEqual(self.fake.sent[2]["time"] - self.fake.sent[1]["time"], 0.9)
+
+    def test_lines_are_coalesced_into_few_messages(self):
+        outbox = self.start(chat_rate=100, chat_burst=100)
+        short = [f"{i}. Вопрос без ответа" for i in range(50)]
+        for future in outbox.send_messages(1, short):
+            future.result(timeout=30)
+        self.assertEqual(self.texts(1), ["\n".join(short)])
+
+        long = [f"{i}. " + "x" * 1000 for i in range(10)]
+        futures = outbox.send_messages(2, long)
+        for future in futures:
+            future.result(timeout=30)
+        texts = self.texts(2)
+        self.assertEqual(len(futures), 3)
+        self.assertEqual(len(texts), 3)
+        self.assertTrue(all(len(text) <= MESSAGE_LIMIT for text in texts))
+        self.assertEqual("\n".join(texts), "\n".join(long))
+
+
+if __name__ == "__main__":
+    unittest.main()
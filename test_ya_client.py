@@ -0,0 +1,209 @@
+"""
+Тесты клиента YandexGPT (ya_client.py).
+
+ServerTest - через настоящий SDK и gRPC против локального поддельного сервера
+(fake_yandexgpt.py, YC_ENDPOINT + YC_INSECURE); пропускается, если SDK не
+установлен. Остальные тесты подменяют только модель клиента, как
+bench_pipeline.py, и работают без SDK: event loop клиента, семафор и повторы
+с задержкой в обоих случаях настоящие.
+
+Запуск: python -m unittest test_ya_client  (или python -m pytest test_ya_client.py)
+"""
+import time
+import types
+import asyncio
+import threading
+import importlib.util
+import unittest
+from unittest import mock
+
+import ya_client
+from ya_client import YandexGPTClient
+
+HAS_SDK = all(importlib.util.find_spec(name) is not None for name in ("yandex_cloud_ml_sdk", "grpc"))
+
+
+class FakeRpcError(Exception):
+    """Ошибка gRPC со статусом, как у SDK: error.code().name"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.name = name
+
+    def code(self):
+        return types.SimpleNamespace(name=self.name)
+
+
+class FakeModel:
+    """
+    Модель, которая сначала выбрасывает ошибки из errors, потом отвечает.
+
+    Считает вызовы и наибольшее число одновременно выполняемых запросов.
+    """
+
+    def __init__(self, errors=(), latency: float = 0.0):
+        self.errors = list(errors)
+        self.latency = latency
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    async def run(self, messages: list):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            error = self.errors.pop(0) if self.errors else None
+        try:
+            await asyncio.sleep(self.latency)
+            if error is not None:
+                raise error
+            return types.SimpleNamespace(text=f"ответ на: {messages[1]['text']}")
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+class FakeClient(YandexGPTClient):
+    def __init__(self, model: FakeModel, **kwargs):
+        super().__init__(**kwargs)
+        self.model = model
+
+    def _get_model(self, temperature: float):
+        return self.model
+
+    def _cache_key(self, system: str, text: str, temperature: float):
+        # Тесты не должны читать и заполнять общий кэш ответов
+        return None
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        # Задержки повторов записываются, но не выполняются
+        self.delays = []
+        patcher = mock.patch.object(ya_client, "backoff_delay",
+                                    side_effect=lambda attempt: self.delays.append(attempt) or 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retryable_errors_are_retried_with_backoff(self):
+        model = FakeModel(errors=[FakeRpcError("UNAVAILABLE"), FakeRpcError("RESOURCE_EXHAUSTED")])
+        client = FakeClient(model, max_retries=4)
+        self.assertEqual(client.complete_sync("system", "текст", 0.1), "ответ на: текст")
+        self.assertEqual(model.calls, 3)
+        self.assertEqual(self.delays, [0, 1])
+
+    def test_connection_errors_are_retried(self):
+        model = FakeModel(errors=[ConnectionError("reset"), asyncio.TimeoutError()])
+        client = FakeClient(model, max_retries=4)
+        self.assertEqual(client.complete_sync("system", "текст", 0.1), "ответ на: текст")
+        self.assertEqual(model.calls, 3)
+
+    def test_non_retryable_error_is_raised_at_once(self):
+        model = FakeModel(errors=[FakeRpcError("INVALID_ARGUMENT")])
+        client = FakeClient(model, max_retries=4)
+        with self.assertRaises(FakeRpcError):
+            client.complete_sync("system", "текст", 0.1)
+        self.assertEqual(model.calls, 1)
+        self.assertEqual(self.delays, [])
+
+    def test_retries_are_limited(self):
+        model = FakeModel(errors=[FakeRpcError("UNAVAILABLE")] * 10)
+        client = FakeClient(model, max_retries=2)
+        with self.assertRaises(FakeRpcError):
+            client.complete_sync("system", "текст", 0.1)
+        self.assertEqual(model.calls, 3)
+        self.assertEqual(self.delays, [0, 1])
+
+
+class BackoffTest(unittest.TestCase):
+    def test_delay_is_bounded(self):
+        for attempt in range(10):
+            delay = ya_client.backoff_delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(ya_client.BACKOFF_MAX, ya_client.BACKOFF_BASE * 2 ** attempt))
+
+
+class ConcurrencyTest(unittest.TestCase):
+    def test_semaphore_limits_parallel_requests(self):
+        model = FakeModel(latency=0.05)
+        client = FakeClient(model, max_concurrency=2)
+
+        async def run_all():
+            return await asyncio.gather(*(client.complete("system", str(i), 0.1) for i in range(8)))
+
+        started = time.monotonic()
+        answers = asyncio.run(run_all())
+        self.assertEqual(answers, [f"ответ на: {i}" for i in range(8)])
+        self.assertEqual(model.max_active, 2)
+        # 8 запросов по 2 одновременно - не меньше 4 волн задержки
+        self.assertGreaterEqual(time.monotonic() - started, 4 * 0.05 * 0.9)
+
+    def test_sync_calls_from_threads_share_the_limit(self):
+        model = FakeModel(latency=0.05)
+        client = FakeClient(model, max_concurrency=3)
+        threads = [threading.Thread(target=client.complete_sync, args=("system", str(i), 0.1)) for i in range(9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(model.calls, 9)
+        self.assertEqual(model.max_active, 3)
+
+
+@unittest.skipUnless(HAS_SDK, "нет yandex-cloud-ml-sdk")
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        import fake_yandexgpt
+        self.server = fake_yandexgpt.serve(0, fake_yandexgpt.FakeYandexGPT(latency=0.05))
+        self.addCleanup(self.server.stop, None)
+        self.fake = self.server.fake
+        patcher = mock.patch.object(ya_client, "backoff_delay", return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def client(self, **kwargs) -> YandexGPTClient:
+        client = YandexGPTClient(folder_id="test-folder", auth="test-key", endpoint=self.server.address,
+                                 insecure=True, **kwargs)
+        # Тесты не должны читать и заполнять общий кэш ответов
+        client._cache_key = lambda system, text, temperature: None
+        return client
+
+    def test_request_and_answer(self):
+        self.assertEqual(self.client().complete_sync("system", "текст", 0.1), "ответ на: текст")
+        self.assertEqual(self.fake.requests, [{"model_uri": "gpt://test-folder/yandexgpt/rc",
+                                               "messages": [("system", "system"), ("user", "текст")]}])
+
+    def test_retryable_status_is_retried(self):
+        self.fake.fail("UNAVAILABLE", "RESOURCE_EXHAUSTED")
+        self.assertEqual(self.client().complete_sync("system", "текст", 0.1), "ответ на: текст")
+        self.assertEqual(self.fake.calls, 3)
+
+    def test_non_retryable_status_is_raised_at_once(self):
+        self.fake.fail("INVALID_ARGUMENT")
+        with self.assertRaises(Exception) as raised:
+            self.client().complete_sync("system", "текст", 0.1)
+        self.assertEqual(raised.exception.code().name, "INVALID_ARGUMENT")
+        self.assertEqual(self.fake.calls, 1)
+
+    def test_retries_are_limited(self):
+        self.fake.fail(*["UNAVAILABLE"] * 10)
+        with self.assertRaises(Exception):
+            self.client(max_retries=2).complete_sync("system", "текст", 0.1)
+        self.assertEqual(self.fake.calls, 3)
+
+    def test_semaphore_limits_parallel_requests(self):
+        client = self.client(max_concurrency=2)
+
+        async def run_all():
+            return await asyncio.gather(*(client.complete("system", str(i), 0.1) for i in range(8)))
+
+        answers = asyncio.run(run_all())
+        self.assertEqual(answers, [f"ответ на: {i}" for i in range(8)])
+        self.assertEqual(self.fake.calls, 8)
+        self.assertEqual(self.fake.max_active, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import sys
+import json
+import threading
+
+MODEL_NAME = "ru_core_news_sm"
+# Синтаксический разбор для анализа не нужен, а это самый медленный компонент
+DISABLED_COMPONENTS = ["parser"]
+
+# Ключевые слова по умолчанию; сравниваются по леммам, поэтому "акции" и "скидку" тоже находятся
+DEFAULT_KEYWORDS = {
+    "promo_mentioned": ["акция", "скидка", "промо"],
+    "was_polite": ["спасибо", "пожалуйста"],
+}
+# Наборы ключевых слов для конкретных анкет {survey_id: {флаг: [слова и фразы]}}
+SURVEY_KEYWORDS = {}
+
+
+class AnalysisEngine:
+    """
+    Пакетный анализ транскрипций с помощью spaCy.
+
+    Модель загружается один раз без ненужных компонентов, ключевые слова
+    ищутся PhraseMatcher по леммам, а много текстов обрабатывается за один
+    проход nlp.pipe. Сам spaCy импортируется только при создании движка,
+    поэтому импорт модуля не замедляет запуск приложения.
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, disable=DISABLED_COMPONENTS):
+        import spacy
+
+        try:
+            self.nlp = spacy.load(model_name, disable=disable)
+        except OSError:
+            raise Exception(f"Модель {model_name} не установлена. Выполните: python -m spacy download {model_name}")
+        self._matchers = {}
+        self._lock = threading.Lock()
+
+    def keywords(self, survey_id=None) -> dict:
+        return SURVEY_KEYWORDS.get(survey_id, DEFAULT_KEYWORDS)
+
+    def _matcher(self, survey_id=None):
+        from spacy.matcher import PhraseMatcher
+
+        with self._lock:
+            matcher = self._matchers.get(survey_id)
+            if matcher is None:
+                matcher = PhraseMatcher(self.nlp.vocab, attr="LEMMA")
+                for flag, phrases in self.keywords(survey_id).items():
+                    # Леммы шаблонов получаем тем же конвейером, что и у текстов
+                    matcher.add(flag, list(self.nlp.pipe(phrases)))
+                self._matchers[survey_id] = matcher
+            return matcher
+
+    def _result(self, doc, matcher, flags) -> dict:
+        found = {self.nlp.vocab.strings[match_id] for match_id, _, _ in matcher(doc)}
+        result = {flag: flag in found for flag in flags}
+        result["entities"] = [(ent.text, ent.label_) for ent in doc.ents]
+        return result
+
+    def analyze(self, text: str, survey_id=None) -> dict:
+        """
+        Анализирует одну транскрипцию.
+
+        :return: {"promo_mentioned": bool, "was_polite": bool, "entities": [(текст, метка)]}
+        """
+        return self.analyze_many([text], survey_id=survey_id)[0]
+
+    def analyze_many(self, texts, survey_id=None, batch_size: int = 64, n_process: int = 1) -> list:
+        """
+        Анализирует много транскрипций за один проход.
+
+        :param texts: Итерируемое со строками
+        :param batch_size: Размер пакета nlp.pipe
+        :param n_process: Число процессов nlp.pipe
+        :return: Список результатов в порядке текстов
+        """
+        matcher = self._matcher(survey_id)
+        flags = list(self.keywords(survey_id))
+        docs = self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+        return [self._result(doc, matcher, flags) for doc in docs]
+
+    def rescore(self, items, survey_id=None, batch_size: int = 64, n_process: int = 1):
+        """
+        Пересчитывает архив проверок.
+
+        :param items: Итерируемое пар (ключ, текст), например (inspection_id, транскрипция)
+        :return: Генератор пар (ключ, результат)
+        """
+        matcher = self._matcher(survey_id)
+        flags = list(self.keywords(survey_id))
+        docs = self.nlp.pipe(items, as_tuples=True, batch_size=batch_size, n_process=n_process)
+        for doc, key in docs:
+            yield key, self._result(doc, matcher, flags)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> AnalysisEngine:
+    """Возвращает общий для процесса движок анализа"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AnalysisEngine()
+        return _engine
+
+
+if __name__ == "__main__":
+    # Пересчет архива транскрипций: python text_analysis.py files/*.txt
+    def _read(paths):
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                yield f.read(), path
+
+    for path, result in get_engine().rescore(_read(sys.argv[1:]), n_process=2):
+        print(json.dumps({"file": path, **result}, ensure_ascii=False))
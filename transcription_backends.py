@@ -0,0 +1,180 @@
+import os
+from abc import ABC, abstractmethod
+
+SAMPLE_RATE = 16000
+
+# ---- Настройки движков распознавания ----
+# openai-whisper (PyTorch) или faster-whisper (CTranslate2, квантованные веса)
+TRANSCRIPTION_BACKEND = os.getenv("TRANSCRIPTION_BACKEND", "openai-whisper")
+# Тип вычислений faster-whisper: int8 быстрее всего на CPU, float32 - эталон точности
+FASTER_WHISPER_COMPUTE_TYPE = os.getenv("FASTER_WHISPER_COMPUTE_TYPE", "int8")
+FASTER_WHISPER_DEVICE = os.getenv("FASTER_WHISPER_DEVICE", "cpu")
+FASTER_WHISPER_BEAM_SIZE = int(os.getenv("FASTER_WHISPER_BEAM_SIZE", "5"))
+# Потоков на одну модель; 0 - по числу ядер
+CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", "0"))
+
+
+class TranscriptionBackend(ABC):
+    """
+    Движок распознавания речи.
+
+    Модель загружает load(), хранит ее реестр моделей; transcribe()
+    возвращает результат в формате openai-whisper:
+    {"text": str, "segments": [{"id", "start", "end", "text", "avg_logprob",
+    "no_speech_prob", "compression_ratio"}, ...], "language": str}.
+    """
+
+    name = None
+
+    @abstractmethod
+    def load(self, model_name: str, threads: int = None):
+        """
+        Загружает модель для transcribe().
+
+        :param threads: Потоков вычислений; по умолчанию заданные set_threads() или CPU_THREADS
+        """
+
+    @abstractmethod
+    def transcribe(self, model, audio, language: str, condition_on_previous_text: bool = True) -> dict:
+        """
+        :param model: Модель, загруженная load()
+        :param audio: Путь к файлу или массив float32 16 кГц моно
+        """
+
+    @abstractmethod
+    def load_audio(self, path: str):
+        """Декодирует файл в массив float32 16 кГц моно"""
+
+    def set_threads(self, threads: int):
+        """Число потоков вычислений в процессе (для процессов пула chunked)"""
+
+    def model_size_mb(self, model) -> float:
+        return 0.0
+
+    def cache_name(self, model_name: str) -> str:
+        """Имя модели в ключе кэша транскрипций"""
+        return f"{self.name}/{model_name}"
+
+
+class OpenAIWhisperBackend(TranscriptionBackend):
+    """Исходная реализация openai-whisper на PyTorch"""
+
+    name = "openai-whisper"
+
+    def load(self, model_name: str, threads: int = None):
+        import whisper
+        if threads is not None:
+            self.set_threads(threads)
+        return whisper.load_model(model_name)
+
+    def transcribe(self, model, audio, language: str, condition_on_previous_text: bool = True) -> dict:
+        if not isinstance(audio, str) and hasattr(audio, "__fspath__"):
+            audio = os.fspath(audio)
+        return model.transcribe(audio, language=language,
+                                condition_on_previous_text=condition_on_previous_text)
+
+    def load_audio(self, path: str):
+        import whisper
+        return whisper.load_audio(str(path))
+
+    def set_threads(self, threads: int):
+        import torch
+        torch.set_num_threads(threads)
+
+    def model_size_mb(self, model) -> float:
+        try:
+            total = sum(p.numel() * p.element_size() for p in model.parameters())
+        except Exception:
+            return 0.0
+        return total / (1024 * 1024)
+
+    def cache_name(self, model_name: str) -> str:
+        # Как раньше, чтобы не терять уже накопленный кэш
+        return model_name
+
+
+class FasterWhisperBackend(TranscriptionBackend):
+    """
+    faster-whisper: те же модели Whisper на CTranslate2.
+
+    С compute_type=int8 веса квантуются, на CPU распознавание в несколько
+    раз быстрее openai-whisper при близком качестве.
+    """
+
+    name = "faster-whisper"
+
+    def __init__(self, compute_type: str = FASTER_WHISPER_COMPUTE_TYPE, device: str = FASTER_WHISPER_DEVICE,
+                 beam_size: int = FASTER_WHISPER_BEAM_SIZE, cpu_threads: int = CPU_THREADS):
+        self.compute_type = compute_type
+        self.device = device
+        self.beam_size = beam_size
+        self.cpu_threads = cpu_threads
+
+    def _module(self):
+        try:
+            import faster_whisper
+        except ImportError:
+            raise RuntimeError("Для TRANSCRIPTION_BACKEND=faster-whisper установите пакет faster-whisper")
+        return faster_whisper
+
+    def load(self, model_name: str, threads: int = None):
+        faster_whisper = self._module()
+        return faster_whisper.WhisperModel(model_name, device=self.device, compute_type=self.compute_type,
+                                           cpu_threads=self.cpu_threads if threads is None else threads)
+
+    def transcribe(self, model, audio, language: str, condition_on_previous_text: bool = True) -> dict:
+        if not isinstance(audio, str) and hasattr(audio, "__fspath__"):
+            audio = os.fspath(audio)
+        segments, info = model.transcribe(audio, language=language, beam_size=self.beam_size,
+                                          condition_on_previous_text=condition_on_previous_text)
+        # segments - генератор, распознавание идет по мере чтения
+        result = [{"id": i, "start": seg.start, "end": seg.end, "text": seg.text,
+                   "avg_logprob": seg.avg_logprob, "no_speech_prob": seg.no_speech_prob,
+                   "compression_ratio": seg.compression_ratio}
+                  for i, seg in enumerate(segments)]
+        return {
+            "text": "".join(seg["text"] for seg in result),
+            "segments": result,
+            "language": info.language or language,
+        }
+
+    def set_threads(self, threads: int):
+        # CTranslate2 получает число потоков при создании модели: процесс пула
+        # chunked вызывает set_threads до загрузки модели
+        self.cpu_threads = threads
+
+    def load_audio(self, path: str):
+        return self._module().decode_audio(str(path), sampling_rate=SAMPLE_RATE)
+
+    def model_size_mb(self, model) -> float:
+        # Веса живут в CTranslate2, оцениваем по файлам модели на диске
+        path = getattr(getattr(model, "model", None), "model_path", None)
+        if not path or not os.path.isdir(path):
+            return 0.0
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file()) / (1024 * 1024)
+
+    def cache_name(self, model_name: str) -> str:
+        return f"{self.name}/{model_name}-{self.compute_type}"
+
+
+BACKENDS = {
+    OpenAIWhisperBackend.name: OpenAIWhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+_instances = {}
+
+
+def get_backend(name: str = None) -> TranscriptionBackend:
+    """
+    Возвращает движок распознавания по имени.
+
+    :param name: openai-whisper или faster-whisper; по умолчанию TRANSCRIPTION_BACKEND
+    """
+    name = name or TRANSCRIPTION_BACKEND
+    backend = _instances.get(name)
+    if backend is None:
+        if name not in BACKENDS:
+            raise ValueError(f"Неизвестный движок распознавания: {name}")
+        backend = _instances[name] = BACKENDS[name]()
+    return backend
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# ---- Настройки кэша ----
+CACHE_DB = os.getenv("CACHE_DB", "cache.db")
+# Максимальный суммарный размер сохраненных транскрипций, в мегабайтах
+MAX_CACHE_MB = float(os.getenv("TRANSCRIPTION_CACHE_MB", "200"))
+
+
+def file_sha256(path, chunk_size: int = 1024 * 1024) -> str:
+    """Считает SHA-256 файла, читая его по частям."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bytes_sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class TranscriptionCache:
+    """
+    Кэш транскрипций в SQLite с ключом (SHA-256 аудио, модель, язык).
+
+    Общий для бота и Streamlit-приложения. При превышении лимита размера
+    удаляются записи, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, db_name: str = CACHE_DB, max_mb: float = MAX_CACHE_MB):
+        self.db_name = db_name
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._create_tables()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_name, timeout=30)
+
+    def _create_tables(self):
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS transcriptions (
+                audio_sha256 TEXT NOT NULL,
+                model_name TEXT NOT NULL,
+                language TEXT NOT NULL,
+                result TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (audio_sha256, model_name, language)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_transcriptions_last_access ON transcriptions (last_access)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                name TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def _count(self, conn, hit: bool):
+        column = "hits" if hit else "misses"
+        conn.execute(f'''
+            INSERT INTO cache_stats (name, {column}) VALUES ('transcriptions', 1)
+            ON CONFLICT(name) DO UPDATE SET {column} = {column} + 1
+        ''')
+
+    def get(self, audio_sha256: str, model_name: str, language: str):
+        """
+        Возвращает сохраненный результат транскрипции или None.
+
+        :param audio_sha256: SHA-256 аудиофайла
+        :param model_name: Имя модели Whisper
+        :param language: Язык распознавания
+        :return: {"text": str, "segments": list} или None
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute('''
+                    SELECT result FROM transcriptions
+                    WHERE audio_sha256 = ? AND model_name = ? AND language = ?
+                ''', (audio_sha256, model_name, language)).fetchone()
+                if row:
+                    conn.execute('''
+                        UPDATE transcriptions SET last_access = ?
+                        WHERE audio_sha256 = ? AND model_name = ? AND language = ?
+                    ''', (time.time(), audio_sha256, model_name, language))
+                self._count(conn, hit=row is not None)
+                conn.commit()
+            finally:
+                conn.close()
+        return json.loads(row[0]) if row else None
+
+    def put(self, audio_sha256: str, model_name: str, language: str, result: dict):
+        """Сохраняет результат транскрипции и вытесняет старые записи сверх лимита."""
+        payload = json.dumps(
+            {"text": result["text"], "segments": result.get("segments", []),
+             "language": result.get("language", language)},
+            ensure_ascii=False, default=float)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute('''
+                    INSERT OR REPLACE INTO transcriptions
+                    (audio_sha256, model_name, language, result, size_bytes, created_at, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (audio_sha256, model_name, language, payload, len(payload.encode("utf-8")), now, now))
+                self._evict(conn, keep=(audio_sha256, model_name, language))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _evict(self, conn, keep):
+        total = conn.execute('SELECT COALESCE(SUM(size_bytes), 0) FROM transcriptions').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute('''
+            SELECT audio_sha256, model_name, language, size_bytes FROM transcriptions
+            ORDER BY last_access
+        ''').fetchall()
+        for audio_sha256, model_name, language, size in rows:
+            if total <= self.max_bytes:
+                break
+            if (audio_sha256, model_name, language) == keep:
+                continue
+            conn.execute('''
+                DELETE FROM transcriptions
+                WHERE audio_sha256 = ? AND model_name = ? AND language = ?
+            ''', (audio_sha256, model_name, language))
+            total -= size
+
+    def stats(self) -> dict:
+        """Возвращает счетчики попаданий и промахов, число и размер записей."""
+        conn = self._connect()
+        try:
+            entries, size = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM transcriptions').fetchone()
+            row = conn.execute(
+                "SELECT hits, misses FROM cache_stats WHERE name = 'transcriptions'").fetchone()
+        finally:
+            conn.close()
+        hits, misses = row if row else (0, 0)
+        return {"hits": hits, "misses": misses, "entries": entries, "size_bytes": size}
+
+
+# Общий кэш процесса
+cache = TranscriptionCache()
@@ -0,0 +1,92 @@
+import os
+import sys
+import hashlib
+import tempfile
+
+# Размер порции при копировании загрузки на диск
+CHUNK_SIZE = 1024 * 1024
+# Максимальный размер одной загрузки
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "200"))
+# Сколько памяти может занимать состояние одной сессии Streamlit
+SESSION_MEMORY_BUDGET_MB = float(os.getenv("SESSION_MEMORY_BUDGET_MB", "16"))
+# Папка для временных копий загрузок
+SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", tempfile.gettempdir())
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def upload_key(audio_file) -> tuple:
+    """Идентификатор загрузки без чтения ее содержимого"""
+    return getattr(audio_file, "file_id", None) or audio_file.name, audio_file.size
+
+
+def spool_upload(audio_file, suffix: str = ".mp3", max_mb: float = MAX_UPLOAD_MB):
+    """
+    Копирует загрузку на диск порциями, одновременно считая SHA-256.
+
+    В памяти одновременно находится только одна порция, копия всего файла
+    не создается.
+
+    :param audio_file: Файловый объект (UploadedFile Streamlit)
+    :return: (sha256, путь к временному файлу)
+    """
+    limit = int(max_mb * 1024 * 1024)
+    digest = hashlib.sha256()
+    written = 0
+    audio_file.seek(0)
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=SPOOL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = audio_file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > limit:
+                    raise UploadTooLarge(f"Файл больше {max_mb:.0f} МБ")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return digest.hexdigest(), path
+
+
+def _size_of(value) -> int:
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_size_of(k) + _size_of(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_size_of(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def session_footprint(state) -> int:
+    """Примерный объем данных в состоянии сессии, в байтах"""
+    return sum(_size_of(state[key]) for key in list(state.keys()))
+
+
+def enforce_session_budget(state, budget_mb: float = SESSION_MEMORY_BUDGET_MB, keep=()) -> list:
+    """
+    Удаляет из состояния сессии самые крупные значения, пока оно не уложится в бюджет.
+
+    :param state: st.session_state или словарь
+    :param keep: Ключи, которые удалять нельзя
+    :return: Список удаленных ключей
+    """
+    budget = int(budget_mb * 1024 * 1024)
+    removed = []
+    sizes = {key: _size_of(state[key]) for key in list(state.keys())}
+    total = sum(sizes.values())
+    for key in sorted(sizes, key=sizes.get, reverse=True):
+        if total <= budget:
+            break
+        if key in keep:
+            continue
+        del state[key]
+        total -= sizes[key]
+        removed.append(key)
+    return removed
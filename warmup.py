@@ -0,0 +1,112 @@
+"""
+Фоновый прогрев бота и приложения после запуска.
+
+Тяжелые зависимости (numpy и torch в распознавании, spaCy в анализе, SDK
+YandexGPT с gRPC) не импортируются при старте: бот сразу отвечает на
+/start, а страница входа открывается без ожидания моделей. warm_up()
+в фоновом потоке заранее импортирует конвейер и загружает модели, чтобы
+первая запись не ждала их загрузки. Если запись пришла раньше, модули
+загрузятся при первом использовании - импорт безопасен из нескольких потоков.
+"""
+import os
+import time
+import threading
+import importlib
+
+import metrics
+
+# ---- Настройки прогрева ----
+WARMUP = os.getenv("WARMUP", "1") == "1"
+# Пауза перед прогревом, чтобы он не конкурировал с первыми ответами, в секундах
+WARMUP_DELAY = float(os.getenv("WARMUP_DELAY", "1.0"))
+# Модели Whisper, которые загружаются заранее
+WARMUP_MODELS = tuple(name for name in os.getenv("WARMUP_MODELS", "medium").split(",") if name)
+
+# Модули конвейера обработки записи, которые импортируются лениво
+PIPELINE_MODULES = ("whisper_transcription", "dialogue_formatter", "reports")
+
+_thread = None
+_started = False
+_lock = threading.Lock()
+
+
+def _load_llm_sdk():
+    from ya_client import load_sdk
+    load_sdk()
+
+
+def _load_whisper(model_name: str):
+    from model_registry import registry
+    registry.get(model_name)
+
+
+def _load_analysis():
+    from text_analysis import get_engine
+    get_engine()
+
+
+def steps(models=WARMUP_MODELS, modules=PIPELINE_MODULES, llm: bool = True, analysis: bool = False) -> list:
+    """Шаги прогрева в порядке выполнения: [(название, функция), ...]"""
+    result = [(f"import.{name}", lambda name=name: importlib.import_module(name)) for name in modules]
+    if llm:
+        result.append(("llm.sdk", _load_llm_sdk))
+    result += [(f"whisper.{name}", lambda name=name: _load_whisper(name)) for name in models]
+    if analysis:
+        result.append(("analysis.spacy", _load_analysis))
+    return result
+
+
+def run(plan: list) -> dict:
+    """
+    Выполняет шаги прогрева; ошибка одного шага не останавливает остальные.
+
+    :return: {шаг: секунды или None, если шаг не удался}
+    """
+    timings = {}
+    for name, step in plan:
+        started = time.perf_counter()
+        try:
+            with metrics.span("warmup", step=name):
+                step()
+            timings[name] = round(time.perf_counter() - started, 3)
+        except Exception as e:
+            timings[name] = None
+            print(f"Прогрев: не удалось выполнить {name}: {e}")
+    done = [seconds for seconds in timings.values() if seconds is not None]
+    print(f"Прогрев завершен за {sum(done):.1f} с: {timings}")
+    return timings
+
+
+def warm_up(models=WARMUP_MODELS, modules=PIPELINE_MODULES, llm: bool = True, analysis: bool = False,
+            delay: float = WARMUP_DELAY, background: bool = True):
+    """
+    Запускает прогрев один раз на процесс (повторные вызовы ничего не делают).
+
+    :param models: Модели Whisper для загрузки
+    :param modules: Модули, которые нужно импортировать заранее
+    :param llm: Импортировать SDK YandexGPT
+    :param analysis: Загрузить spaCy (нужен только приложению)
+    :param delay: Пауза перед началом прогрева, в секундах
+    :param background: Прогревать в фоновом потоке
+    :return: Поток прогрева или None
+    """
+    global _thread, _started
+    if not WARMUP:
+        return None
+    plan = steps(models, modules, llm, analysis)
+
+    def _run():
+        if delay > 0:
+            time.sleep(delay)
+        run(plan)
+
+    with _lock:
+        if _started:
+            return _thread
+        _started = True
+        if background:
+            _thread = threading.Thread(target=_run, name="warmup", daemon=True)
+            _thread.start()
+            return _thread
+    _run()
+    return None
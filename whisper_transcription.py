@@ -1,33 +1,78 @@
-import whisper
+import os
+import time
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import numpy as np
+
+import metrics
+from audio_preprocessing import prepare, PREPROCESS
+from model_registry import get_model
+from transcription_backends import get_backend, SAMPLE_RATE
+from transcription_cache import cache, file_sha256
+
+# ---- Настройки режима chunked ----
+# Целевая длина окна и зона поиска паузы вокруг его границы, в секундах
+CHUNK_SECONDS = 60.0
+SILENCE_SEARCH_SECONDS = 10.0
+# Перекрытие соседних окон, в секундах
+OVERLAP_SECONDS = 1.5
+# С какой длины записи режим auto переключается на chunked
+CHUNKED_MIN_SECONDS = 180.0
+# Количество процессов распознавания
+CHUNK_WORKERS = int(os.getenv("WHISPER_CHUNK_WORKERS", str(max(1, min(4, (os.cpu_count() or 1) // 2)))))
+# Через сколько секунд простоя пул chunked закрывается вместе с копиями модели в его процессах
+POOL_IDLE_TTL = float(os.getenv("WHISPER_POOL_IDLE_TTL", "120"))
+
+# ---- Настройки режима cascade ----
+# Быстрая модель первого прохода
+CASCADE_DRAFT_MODEL = os.getenv("CASCADE_DRAFT_MODEL", "small")
+# Сегмент считается неуверенным, если средний логарифм вероятности токенов ниже порога,
+# вероятность тишины выше порога при непустом тексте или текст подозрительно повторяется
+CASCADE_LOGPROB_THRESHOLD = float(os.getenv("CASCADE_LOGPROB_THRESHOLD", "-0.7"))
+CASCADE_NO_SPEECH_THRESHOLD = float(os.getenv("CASCADE_NO_SPEECH_THRESHOLD", "0.6"))
+CASCADE_COMPRESSION_THRESHOLD = float(os.getenv("CASCADE_COMPRESSION_THRESHOLD", "2.4"))
+# Неуверенные сегменты ближе этого промежутка распознаются одним отрезком, в секундах
+CASCADE_MERGE_GAP = float(os.getenv("CASCADE_MERGE_GAP", "1.0"))
+# Контекст вокруг отрезка и минимальная длина повторно распознаваемого куска, в секундах
+CASCADE_PADDING = float(os.getenv("CASCADE_PADDING", "0.5"))
+CASCADE_MIN_SECONDS = float(os.getenv("CASCADE_MIN_SECONDS", "3.0"))
+
+TRANSCRIPTION_MODES = ("full", "chunked", "auto", "cascade")
+
+
 def transcribe_audio(
     input_path,
     model_name: str = "medium",
     save_to_file: bool = True,
-    output_path: str = "trans/1"
+    output_path: str = "trans/1",
+    language: str = "ru",
+    mode: str = "full",
+    backend: str = None,
+    use_cache: bool = True
 ) -> str:
     """
     Транскрибирует аудиофайл в текст с помощью Whisper.
-    
+
     Параметры:
     input_path (str): Путь к входному аудиофайлу (mp3, wav и др.)
     model_name (str): Выбор модели (tiny, base, small, medium, large). По умолчанию 'base'
     save_to_file (bool): Сохранить ли результат в текстовый файл
     output_path (str): Путь для сохранения результата (если не указан, будет создан рядом с входным файлом)
-    
+    language (str): Язык распознавания
+    mode (str): Режим распознавания: full, chunked, auto или cascade
+    backend (str): Движок распознавания (openai-whisper, faster-whisper), по умолчанию из TRANSCRIPTION_BACKEND
+    use_cache (bool): Искать результат в кэше транскрипций
+
     Возвращает:
     str: Транскрибированный текст
     """
-    # Проверка существования файла
-    if not Path(input_path).exists():
-        raise FileNotFoundError(f"Файл {input_path} не найден")
-
-    # Загрузка модели
-    model = whisper.load_model(model_name)
-
-    # Загрузка и транскрипция аудио
-    result = model.transcribe(input_path,  language="ru")
+    result = transcribe(input_path, model_name=model_name, language=language, mode=mode, backend=backend,
+                        use_cache=use_cache)
+    print_stats(result)
 
     # Получение текста
     text = str(result["text"])
@@ -40,3 +85,414 @@ def transcribe_audio(
         print(f"Транскрипция сохранена в: {output_path}")
 
     return text
+
+
+def print_stats(result: dict):
+    """Печатает статистику подготовки аудио и каскада, если она есть в результате"""
+    stats = result.get("preprocess")
+    if stats:
+        print(f"Подготовка аудио: из {stats['audio_seconds']} с распознано {stats['kept_seconds']} с, "
+              f"усиление {stats['gain_db']} дБ")
+    stats = result.get("cascade")
+    if stats:
+        print(f"Cascade {stats['draft_model']} -> {stats['final_model']}: "
+              f"повторно распознано {stats['escalated_seconds']} из {stats['audio_seconds']} с "
+              f"({stats['escalated_ratio']:.0%}, отрезков: {stats['spans']})")
+
+
+def cache_model_name(model_name: str, backend: str = None, mode: str = "full") -> str:
+    """Имя модели в кэше транскрипций: результаты разных движков, каскада и подготовки аудио не смешиваются"""
+    name = get_backend(backend).cache_name(model_name)
+    if mode == "cascade":
+        name = f"{name}+{CASCADE_DRAFT_MODEL}"
+    return f"{name}+pre" if PREPROCESS else name
+
+
+def transcribe(input_path, model_name: str = "medium", language: str = "ru", mode: str = "full",
+               use_cache: bool = True, backend: str = None, digest: str = None) -> dict:
+    """
+    Транскрибирует аудиофайл и возвращает текст вместе с сегментами.
+
+    :param input_path: Путь к аудиофайлу
+    :param model_name: Имя модели Whisper
+    :param language: Язык распознавания
+    :param mode: full - одним вызовом Whisper, chunked - окнами по паузам
+                 в нескольких процессах, auto - chunked для длинных записей,
+                 cascade - черновая модель CASCADE_DRAFT_MODEL и model_name
+                 только для неуверенных отрезков
+    :param use_cache: Искать результат в кэше транскрипций по SHA-256 файла
+    :param backend: Движок распознавания, по умолчанию TRANSCRIPTION_BACKEND
+    :param digest: SHA-256 файла, если уже посчитан (например, при сохранении в artifacts)
+    :return: {"text": str, "segments": [{"start", "end", "text", ...}]}
+    """
+    if mode not in TRANSCRIPTION_MODES:
+        raise ValueError(f"Неизвестный режим транскрипции: {mode}")
+
+    # Проверка существования файла
+    if not Path(input_path).exists():
+        raise FileNotFoundError(f"Файл {input_path} не найден")
+
+    engine = get_backend(backend)
+    # Результат каскада отличается от распознавания одной моделью
+    cache_name = cache_model_name(model_name, engine.name, mode)
+    if use_cache:
+        digest = digest or file_sha256(input_path)
+        cached = cache.get(digest, cache_name, language)
+        metrics.inc("shopper_transcription_cache_total", result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+
+    with metrics.span("whisper.transcribe", model=model_name, mode=mode) as details:
+        result = _transcribe(input_path, model_name, language, mode, engine, digest)
+        segments = result.get("segments") or []
+        audio_seconds = result.get("preprocess", {}).get("audio_seconds") or (segments[-1]["end"] if segments else 0.0)
+        details["audio_seconds"] = audio_seconds
+    metrics.inc("shopper_audio_seconds_total", audio_seconds, model=model_name)
+    if use_cache:
+        cache.put(digest, cache_name, language, result)
+    return result
+
+
+def _transcribe(input_path, model_name: str, language: str, mode: str, engine, digest: str = None) -> dict:
+    if not PREPROCESS:
+        if mode == "full":
+            # Модель берется из общего реестра и не загружается заново
+            model = get_model(model_name, language, engine.name)
+            return engine.transcribe(model, str(input_path), language)
+        # Аудио декодируется один раз, дальше работаем с массивом
+        return _transcribe_array(engine.load_audio(str(input_path)), model_name, language, mode, engine)
+
+    # Декодирование (или массив из кэша), нормализация громкости и обрезка тишины
+    with metrics.span("audio.prepare"):
+        prepared = prepare(input_path, engine, digest)
+    result = _transcribe_array(prepared.audio, model_name, language, mode, engine)
+    # Время сегментов - в исходной записи, а не в склеенной без пауз
+    prepared.time_map.remap(result["segments"])
+    result["preprocess"] = prepared.stats
+    return result
+
+
+def _transcribe_array(audio: np.ndarray, model_name: str, language: str, mode: str, engine) -> dict:
+    if mode == "full":
+        model = get_model(model_name, language, engine.name)
+        return engine.transcribe(model, audio, language)
+    if mode == "cascade":
+        return transcribe_cascade(audio, model_name=model_name, language=language, backend=engine.name)
+    if mode == "auto" and len(audio) < CHUNKED_MIN_SECONDS * SAMPLE_RATE:
+        model = get_model(model_name, language, engine.name)
+        return engine.transcribe(model, audio, language)
+
+    return transcribe_chunked(audio, model_name=model_name, language=language, backend=engine.name)
+
+
+# ---- Режим chunked ----
+def split_on_silence(audio: np.ndarray,
+                     chunk_seconds: float = CHUNK_SECONDS,
+                     search_seconds: float = SILENCE_SEARCH_SECONDS) -> list:
+    """
+    Делит запись на окна примерно по chunk_seconds, разрезая в самом тихом
+    месте рядом с границей окна.
+
+    :return: Список границ окон в отсчетах [(start, end), ...] без перекрытия
+    """
+    total = len(audio)
+    step = int(chunk_seconds * SAMPLE_RATE)
+    search = int(search_seconds * SAMPLE_RATE)
+    if total <= step + search:
+        return [(0, total)]
+
+    # Энергия по кадрам 30 мс, сглаженная на ~0.3 с, чтобы искать паузы, а не щелчки
+    frame = int(0.03 * SAMPLE_RATE)
+    n_frames = total // frame
+    energy = np.sqrt(np.mean(audio[:n_frames * frame].reshape(n_frames, frame) ** 2, axis=1))
+    energy = np.convolve(energy, np.ones(10) / 10, mode="same")
+
+    bounds = [0]
+    pos = 0
+    while total - pos > step + search:
+        lo = (pos + step - search) // frame
+        hi = min(n_frames, (pos + step + search) // frame)
+        cut = (lo + int(np.argmin(energy[lo:hi]))) * frame + frame // 2
+        bounds.append(cut)
+        pos = cut
+    bounds.append(total)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _init_worker(model_name: str, language: str, threads: int, backend: str):
+    # Модель загружается в процесс один раз и остается в его реестре
+    get_backend(backend).set_threads(threads)
+    get_model(model_name, language, backend)
+
+
+def _transcribe_window(model_name: str, language: str, audio: np.ndarray, offset: float, backend: str) -> list:
+    engine = get_backend(backend)
+    model = get_model(model_name, language, backend)
+    result = engine.transcribe(model, audio, language, condition_on_previous_text=False)
+    segments = []
+    for seg in result["segments"]:
+        seg = dict(seg)
+        seg["start"] += offset
+        seg["end"] += offset
+        segments.append(seg)
+    return segments
+
+
+def _get_pool(model_name: str, language: str, workers: int, backend: str) -> ProcessPoolExecutor:
+    key = (backend, model_name, language, workers)
+    with _pools_lock:
+        entry = _pools.get(key)
+        if entry is None:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model_name, language, threads, backend),
+            )
+            entry = _pools[key] = {"pool": pool, "active": 0, "last_used": time.monotonic()}
+        entry["active"] += 1
+        return entry["pool"]
+
+
+def _release_pool(model_name: str, language: str, workers: int, backend: str):
+    with _pools_lock:
+        entry = _pools[(backend, model_name, language, workers)]
+        entry["active"] -= 1
+        entry["last_used"] = time.monotonic()
+    if POOL_IDLE_TTL > 0:
+        timer = threading.Timer(POOL_IDLE_TTL + 1, shutdown_idle_pools)
+        timer.daemon = True
+        timer.start()
+
+
+@contextlib.contextmanager
+def _chunk_pool(model_name: str, language: str, workers: int, backend: str):
+    pool = _get_pool(model_name, language, workers, backend)
+    try:
+        yield pool
+    finally:
+        _release_pool(model_name, language, workers, backend)
+
+
+def shutdown_idle_pools(idle_ttl: float = None) -> int:
+    """
+    Закрывает пулы chunked, которые не использовались дольше idle_ttl.
+
+    Каждый процесс пула держит свою копию модели вне реестра моделей, поэтому
+    пул не живет дольше, чем нужен; следующая длинная запись создаст его заново.
+
+    :param idle_ttl: Секунд простоя, по умолчанию POOL_IDLE_TTL; 0 - закрыть все свободные
+    :return: Число закрытых пулов
+    """
+    idle_ttl = POOL_IDLE_TTL if idle_ttl is None else idle_ttl
+    now = time.monotonic()
+    with _pools_lock:
+        stale = [key for key, entry in _pools.items()
+                 if entry["active"] == 0 and now - entry["last_used"] >= idle_ttl]
+        pools = [_pools.pop(key)["pool"] for key in stale]
+    for pool in pools:
+        pool.shutdown(wait=True)
+    return len(pools)
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def stitch_segments(windows: list, results: list) -> list:
+    """
+    Склеивает сегменты соседних окон.
+
+    Из каждого окна берутся сегменты, середина которых попадает в его
+    собственную (без перекрытия) часть, а повторы на стыках отбрасываются.
+
+    :param windows: Границы окон без перекрытия в секундах [(start, end), ...]
+    :param results: Сегменты каждого окна с абсолютным временем
+    """
+    stitched = []
+    for (core_start, core_end), segments in zip(windows, results):
+        for seg in segments:
+            middle = (seg["start"] + seg["end"]) / 2
+            if not core_start <= middle < core_end:
+                continue
+            if stitched:
+                prev = stitched[-1]
+                if (_normalize(seg["text"]) == _normalize(prev["text"])
+                        and seg["start"] < prev["end"] + OVERLAP_SECONDS):
+                    continue
+            stitched.append(seg)
+
+    for i, seg in enumerate(stitched):
+        seg["id"] = i
+    return stitched
+
+
+def transcribe_chunked(audio: np.ndarray, model_name: str = "medium", language: str = "ru",
+                       workers: int = CHUNK_WORKERS, backend: str = None) -> dict:
+    """
+    Распознает длинную запись окнами с перекрытием в пуле процессов.
+
+    :param audio: Аудио 16 кГц моно, float32
+    :return: {"text": str, "segments": list, "language": str}
+    """
+    overlap = int(OVERLAP_SECONDS * SAMPLE_RATE)
+    windows = split_on_silence(audio)
+
+    backend = get_backend(backend).name
+    if len(windows) == 1:
+        # Одно окно - пул процессов не нужен, модель берется из реестра этого процесса
+        results = [_transcribe_window(model_name, language, audio, 0.0, backend)]
+    else:
+        with _chunk_pool(model_name, language, workers, backend) as pool:
+            futures = []
+            for start, end in windows:
+                lo = max(0, start - overlap)
+                hi = min(len(audio), end + overlap)
+                futures.append(pool.submit(_transcribe_window, model_name, language,
+                                           audio[lo:hi], lo / SAMPLE_RATE, backend))
+            results = [f.result() for f in futures]
+
+    core = [(start / SAMPLE_RATE, end / SAMPLE_RATE) for start, end in windows]
+    # Последнее окно забирает все, что заканчивается ровно в конце записи
+    core[-1] = (core[-1][0], float("inf"))
+    segments = stitch_segments(core, results)
+    return {
+        "text": "".join(seg["text"] for seg in segments),
+        "segments": segments,
+        "language": language,
+    }
+
+
+# ---- Режим cascade ----
+def is_uncertain(seg: dict, logprob_threshold: float = CASCADE_LOGPROB_THRESHOLD,
+                 no_speech_threshold: float = CASCADE_NO_SPEECH_THRESHOLD,
+                 compression_threshold: float = CASCADE_COMPRESSION_THRESHOLD) -> bool:
+    """
+    Сегмент черновой модели, который стоит распознать заново большой моделью:
+    низкая средняя уверенность, вероятная галлюцинация в тишине или зацикливание.
+    """
+    if seg.get("avg_logprob", 0.0) < logprob_threshold:
+        return True
+    if seg.get("no_speech_prob", 0.0) > no_speech_threshold and seg["text"].strip():
+        return True
+    return seg.get("compression_ratio", 0.0) > compression_threshold
+
+
+def uncertain_spans(segments: list, merge_gap: float = CASCADE_MERGE_GAP, **thresholds) -> list:
+    """
+    Объединяет соседние неуверенные сегменты в отрезки для повторного распознавания.
+
+    :return: Список отрезков [(start, end), ...] в секундах
+    """
+    spans = []
+    for seg in segments:
+        if not is_uncertain(seg, **thresholds):
+            continue
+        if spans and seg["start"] - spans[-1][1] <= merge_gap:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], seg["end"]))
+        else:
+            spans.append((seg["start"], seg["end"]))
+    return spans
+
+
+def _padded(span: tuple, duration: float) -> tuple:
+    start, end = span
+    # Короткие обрывки Whisper распознает плохо, даем ему контекст вокруг отрезка
+    missing = max(0.0, CASCADE_MIN_SECONDS - (end - start)) / 2
+    pad = max(CASCADE_PADDING, missing)
+    return max(0.0, start - pad), min(duration, end + pad)
+
+
+def transcribe_cascade(audio: np.ndarray, model_name: str = "medium", draft_model: str = None,
+                       language: str = "ru", backend: str = None, **thresholds) -> dict:
+    """
+    Двухпроходное распознавание: вся запись - быстрой черновой моделью,
+    неуверенные отрезки - заново моделью model_name.
+
+    :param audio: Аудио 16 кГц моно, float32
+    :param model_name: Точная модель для неуверенных отрезков
+    :param draft_model: Черновая модель, по умолчанию CASCADE_DRAFT_MODEL
+    :param thresholds: Пороги is_uncertain()
+    :return: {"text", "segments", "language", "cascade": статистика}
+    """
+    engine = get_backend(backend)
+    draft_model = draft_model or CASCADE_DRAFT_MODEL
+    duration = len(audio) / SAMPLE_RATE
+
+    started = time.perf_counter()
+    draft = engine.transcribe(get_model(draft_model, language, engine.name), audio, language)
+    draft_seconds = time.perf_counter() - started
+
+    spans = uncertain_spans(draft["segments"], **thresholds)
+    segments = [seg for seg in draft["segments"]
+                if not any(start <= (seg["start"] + seg["end"]) / 2 <= end for start, end in spans)]
+
+    started = time.perf_counter()
+    escalated = 0.0
+    if spans:
+        model = get_model(model_name, language, engine.name)
+        for span in spans:
+            lo, hi = _padded(span, duration)
+            escalated += hi - lo
+            result = engine.transcribe(model, audio[int(lo * SAMPLE_RATE):int(hi * SAMPLE_RATE)], language,
+                                       condition_on_previous_text=False)
+            # Берем только сегменты, середина которых внутри самого отрезка, а не в добавленном контексте
+            redecoded = []
+            for seg in result["segments"]:
+                seg = dict(seg, start=seg["start"] + lo, end=seg["end"] + lo)
+                if span[0] <= (seg["start"] + seg["end"]) / 2 <= span[1]:
+                    redecoded.append(seg)
+            if not redecoded:
+                # Большая модель ничего не услышала - оставляем черновик, чтобы не потерять речь
+                redecoded = [seg for seg in draft["segments"]
+                             if span[0] <= (seg["start"] + seg["end"]) / 2 <= span[1]]
+            segments.extend(redecoded)
+    final_seconds = time.perf_counter() - started
+
+    segments.sort(key=lambda seg: seg["start"])
+    for i, seg in enumerate(segments):
+        seg["id"] = i
+    stats = {
+        "draft_model": draft_model,
+        "final_model": model_name,
+        "audio_seconds": round(duration, 1),
+        "escalated_seconds": round(escalated, 1),
+        "escalated_ratio": round(escalated / duration, 3) if duration else 0.0,
+        "spans": len(spans),
+        "draft_segments": len(draft["segments"]),
+        "draft_seconds": round(draft_seconds, 2),
+        "final_seconds": round(final_seconds, 2),
+    }
+    _record_cascade(stats)
+    return {
+        "text": "".join(seg["text"] for seg in segments),
+        "segments": segments,
+        "language": language,
+        "cascade": stats,
+    }
+
+
+_cascade_totals = {"runs": 0, "audio_seconds": 0.0, "escalated_seconds": 0.0,
+                   "draft_seconds": 0.0, "final_seconds": 0.0}
+_cascade_lock = threading.Lock()
+
+
+def _record_cascade(stats: dict):
+    with _cascade_lock:
+        _cascade_totals["runs"] += 1
+        for key in ("audio_seconds", "escalated_seconds", "draft_seconds", "final_seconds"):
+            _cascade_totals[key] += stats[key]
+
+
+def cascade_stats() -> dict:
+    """Сводка по всем распознаваниям cascade в процессе"""
+    with _cascade_lock:
+        totals = dict(_cascade_totals)
+    audio = totals["audio_seconds"]
+    totals["escalated_ratio"] = round(totals["escalated_seconds"] / audio, 3) if audio else 0.0
+    return totals
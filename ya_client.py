@@ -0,0 +1,233 @@
+import os
+import random
+import asyncio
+import threading
+
+import metrics
+from llm_cache import llm_cache, prompt_key
+
+# ---- Настройки YandexGPT ----
+FOLDER_ID = os.getenv("YC_FOLDER_ID", "b1g7chuh6anjq5op0j2f")
+API_KEY = os.getenv("YC_API_KEY", "")
+# Адрес API; можно указать локальный тестовый сервер
+ENDPOINT = os.getenv("YC_ENDPOINT") or None
+# Соединение без TLS - только для локального тестового сервера
+INSECURE = os.getenv("YC_INSECURE", "0") == "1"
+MODEL_NAME = "yandexgpt"
+MODEL_VERSION = "rc"
+# Сколько запросов к модели выполняется одновременно
+MAX_CONCURRENCY = int(os.getenv("YC_MAX_CONCURRENCY", "4"))
+# Повторы с экспоненциальной задержкой
+MAX_RETRIES = int(os.getenv("YC_MAX_RETRIES", "4"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+# gRPC-статусы, при которых запрос имеет смысл повторить
+RETRYABLE_CODES = {"UNAVAILABLE", "RESOURCE_EXHAUSTED", "DEADLINE_EXCEEDED", "INTERNAL", "ABORTED"}
+
+NO_ANSWER = "Не удалось обработать ответ"
+
+
+def extract_text(result) -> str:
+    """Достает текст из ответа YandexGPT"""
+    if hasattr(result, 'result') and result.result.alternatives:
+        first_alternative = result.result.alternatives[0]
+        if hasattr(first_alternative, 'message'):
+            return first_alternative.message.text
+    elif hasattr(result, 'alternatives') and result.alternatives:
+        return result.alternatives[0].text
+    elif hasattr(result, 'text'):
+        return result.text
+
+    return NO_ANSWER
+
+
+def load_sdk():
+    """
+    Импортирует SDK YandexGPT.
+
+    SDK тянет gRPC и protobuf, поэтому загружается при первом запросе или
+    заранее при прогреве (warmup.py), а не при импорте модуля.
+
+    :return: (AsyncYCloudML, NoRetryPolicy)
+    """
+    from yandex_cloud_ml_sdk import AsyncYCloudML
+    from yandex_cloud_ml_sdk.retry import NoRetryPolicy
+    return AsyncYCloudML, NoRetryPolicy
+
+
+def is_retryable(error: Exception) -> bool:
+    code = getattr(error, "code", None)
+    if callable(code):
+        try:
+            return code().name in RETRYABLE_CODES
+        except Exception:
+            return False
+    return isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError))
+
+
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с полным джиттером"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class YandexGPTClient:
+    """
+    Долгоживущий клиент YandexGPT.
+
+    SDK, канал и настроенные модели (по одной на температуру) создаются один
+    раз и живут в отдельном потоке со своим event loop. Одновременно
+    выполняется не больше max_concurrency запросов; временные ошибки
+    повторяются с экспоненциальной задержкой.
+
+    Из синхронного кода используется complete_sync(), из асинхронного -
+    await complete(), в том числе из любого другого event loop.
+    """
+
+    def __init__(self, folder_id: str = FOLDER_ID, auth: str = API_KEY, endpoint: str = ENDPOINT,
+                 model_name: str = MODEL_NAME, model_version: str = MODEL_VERSION,
+                 max_concurrency: int = MAX_CONCURRENCY, max_retries: int = MAX_RETRIES,
+                 insecure: bool = INSECURE):
+        self.folder_id = folder_id
+        self.auth = auth
+        self.endpoint = endpoint
+        self.insecure = insecure
+        self.model_name = model_name
+        self.model_version = model_version
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._sdk = None
+        self._models = {}
+        self._loop = None
+        self._semaphore = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def _run():
+                asyncio.set_event_loop(loop)
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                ready.set()
+                loop.run_forever()
+
+            threading.Thread(target=_run, name="yandexgpt-loop", daemon=True).start()
+            ready.wait()
+            self._loop = loop
+            return loop
+
+    def _get_model(self, temperature: float):
+        # Вызывается только из потока клиента
+        if self._sdk is None:
+            AsyncYCloudML, NoRetryPolicy = load_sdk()
+            kwargs = {"folder_id": self.folder_id, "auth": self.auth,
+                      # Повторы делает сам клиент, чтобы не умножать их на повторы SDK
+                      "retry_policy": NoRetryPolicy()}
+            if self.endpoint:
+                kwargs["endpoint"] = self.endpoint
+            if self.insecure:
+                kwargs["verify"] = False
+            self._sdk = AsyncYCloudML(**kwargs)
+        model = self._models.get(temperature)
+        if model is None:
+            model = self._sdk.models.completions(self.model_name, model_version=self.model_version)
+            model = model.configure(temperature=temperature)
+            self._models[temperature] = model
+        return model
+
+    async def _complete(self, messages: list, temperature: float) -> str:
+        model = self._get_model(temperature)
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    result = await model.run(messages)
+                _count_tokens(result)
+                return extract_text(result)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                metrics.inc("shopper_llm_retries_total")
+                # Ждем вне семафора, чтобы не занимать слот другим запросам
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+
+    def _cache_key(self, system: str, text: str, temperature: float):
+        if not llm_cache.eligible(temperature):
+            return None
+        return prompt_key(self.model_name, self.model_version, temperature, system, text)
+
+    def _cached(self, system: str, text: str, temperature: float, use_cache: bool):
+        key = self._cache_key(system, text, temperature)
+        if key is None or not use_cache:
+            return None
+        cached = llm_cache.get(key)
+        metrics.inc("shopper_llm_cache_total", result="miss" if cached is None else "hit")
+        return cached
+
+    def _store(self, key, response: str):
+        if key is not None and response != NO_ANSWER:
+            llm_cache.put(key, response)
+
+    async def complete(self, system: str, text: str, temperature: float, use_cache: bool = True) -> str:
+        """
+        Асинхронно отправляет запрос модели.
+
+        :param system: Системный промпт
+        :param text: Текст пользователя
+        :param temperature: Температура генерации
+        :param use_cache: Брать ответ из кэша, если такой запрос уже выполнялся;
+                          при False ответ запрашивается заново и обновляет кэш
+        :return: Текст ответа модели
+        """
+        cached = self._cached(system, text, temperature, use_cache)
+        if cached is not None:
+            return cached
+
+        key = self._cache_key(system, text, temperature)
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(
+            self._complete(_messages(system, text), temperature), loop)
+        response = await asyncio.wrap_future(future)
+        self._store(key, response)
+        return response
+
+    def complete_sync(self, system: str, text: str, temperature: float, use_cache: bool = True) -> str:
+        """Синхронный вариант complete() для потоков бота и Streamlit"""
+        cached = self._cached(system, text, temperature, use_cache)
+        if cached is not None:
+            return cached
+
+        key = self._cache_key(system, text, temperature)
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(
+            self._complete(_messages(system, text), temperature), loop)
+        response = future.result()
+        self._store(key, response)
+        return response
+
+
+def _count_tokens(result):
+    """Токены запроса и ответа из usage ответа SDK"""
+    usage = getattr(result, "usage", None)
+    if usage is None:
+        return
+    for kind, attr in (("input", "input_text_tokens"), ("completion", "completion_tokens")):
+        value = getattr(usage, attr, None)
+        if value:
+            metrics.inc("shopper_llm_tokens_total", float(value), kind=kind)
+
+
+def _messages(system: str, text: str) -> list:
+    return [
+        {"role": "system", "text": system},
+        {"role": "user", "text": text},
+    ]
+
+
+# Общий клиент процесса
+client = YandexGPTClient()
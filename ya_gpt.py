@@ -1,65 +1,159 @@
-from yandex_cloud_ml_sdk import YCloudML
-
-def ya_request_1(text):
-    sdk = YCloudML(
-        folder_id="b1g7chuh6anjq5op0j2f", auth=""
-    )
-
-    model = sdk.models.completions("yandexgpt", model_version="rc")
-    model = model.configure(temperature=0.12)
-    result = model.run(
-        [
-            {"role": "system", "text": "Тебе передана транскрипция диалога. Преобразуй в диалог вида : Продавец: ... Покупатель ...). Исправь очевидные ошибки транскрипции. Уточни реплики для улучшения читаемости, без изменения смысла."},
-            {
-                "role": "user",
-                "text": text,
-            },
-        ]
-    )
-    # Обрабатываем структуру ответа YandexGPT
-    if hasattr(result, 'result') and result.result.alternatives:
-        first_alternative = result.result.alternatives[0]
-        if hasattr(first_alternative, 'message'):
-            return first_alternative.message.text
-    elif hasattr(result, 'text'):
-        return result.text
-
-    return "Не удалось обработать ответ"
-
-def ya_request_2(text, questions):
-    sdk = YCloudML(
-        folder_id="b1g7chuh6anjq5op0j2f", auth=""
-    )
-
-    model = sdk.models.completions("yandexgpt", model_version="rc")
-    model = model.configure(temperature=0.2)
-    full_text = text + questions
-    print(full_text)
-    result = model.run(
-        [
-            {"role": "system", "text": 
-            """
+import ast
+import json
+import asyncio
+
+import metrics
+from ya_client import client
+
+DIALOGUE_TEMPERATURE = 0.12
+ANSWERS_TEMPERATURE = 0.2
+
+DIALOGUE_PROMPT = "Тебе передана транскрипция диалога. Преобразуй в диалог вида : Продавец: ... Покупатель ...). Исправь очевидные ошибки транскрипции. Уточни реплики для улучшения читаемости, без изменения смысла."
+
+ANSWERS_PROMPT = """
             У меня есть готовый диалог и список вопросов. Твоя задача на основании диалога вернуть развернутые ответы на вопросы в формате json. Ключ - id вопроса, значение - ответ на вопрос.
-            Пример: 
+            Пример:
             {
-            "133224414": "Да, говорит здравствуйте", 
+            "133224414": "Да, говорит здравствуйте",
             "123321223": "Нет, он был вежлив"
             }
             Если ты не можешь дать ответ из контекста - нужно прислать в значении null
-            """},
-            {
-                "role": "user",
-                "text": full_text,
-            },
-        ]
-    )
-
-    # Обрабатываем структуру ответа YandexGPT
-    if hasattr(result, 'result') and result.result.alternatives:
-        first_alternative = result.result.alternatives[0]
-        if hasattr(first_alternative, 'message'):
-            return first_alternative.message.text
-    elif hasattr(result, 'text'):
-        return result.text
-
-    return "Не удалось обработать ответ"
\ No newline at end of file
+            """
+
+
+# use_cache=False - запросить модель заново, даже если ответ уже есть в кэше
+@metrics.span("llm.dialogue")
+def ya_request_1(text, use_cache=True):
+    return client.complete_sync(DIALOGUE_PROMPT, text, DIALOGUE_TEMPERATURE, use_cache=use_cache)
+
+@metrics.span("llm.answers")
+def ya_request_2(text, questions, use_cache=True, mode="single"):
+    """
+    mode: single - один запрос со всеми вопросами, mapreduce - группы вопросов
+    по окнам диалога параллельно, auto - mapreduce для длинных диалогов
+    """
+    if mode not in ANSWER_MODES:
+        raise ValueError(f"Неизвестный режим: {mode}")
+    if mode == "mapreduce" or (mode == "auto" and len(text) > WINDOW_CHARS):
+        if isinstance(questions, str):
+            questions = ast.literal_eval(questions)
+        return ya_request_2_mapreduce(text, questions, use_cache=use_cache)
+
+    full_text = text + str(questions)
+    return client.complete_sync(ANSWERS_PROMPT, full_text, ANSWERS_TEMPERATURE, use_cache=use_cache)
+
+
+# ---- Асинхронные варианты для параллельной обработки нескольких проверок ----
+async def ya_request_1_async(text, use_cache=True):
+    return await client.complete(DIALOGUE_PROMPT, text, DIALOGUE_TEMPERATURE, use_cache=use_cache)
+
+async def ya_request_2_async(text, questions, use_cache=True):
+    return await client.complete(ANSWERS_PROMPT, text + questions, ANSWERS_TEMPERATURE, use_cache=use_cache)
+
+
+# ---- Map-reduce для длинных диалогов ----
+# Вопросов в одном запросе
+QUESTIONS_PER_GROUP = 10
+# Длина окна диалога и перекрытие соседних окон, в символах
+WINDOW_CHARS = 6000
+WINDOW_OVERLAP_CHARS = 600
+ANSWER_MODES = ("single", "mapreduce", "auto")
+
+
+def split_dialogue(text: str, window_chars: int = WINDOW_CHARS, overlap_chars: int = WINDOW_OVERLAP_CHARS) -> list:
+    """
+    Делит диалог на окна по границам реплик с перекрытием.
+
+    :return: Список фрагментов диалога
+    """
+    if len(text) <= window_chars:
+        return [text]
+
+    lines = text.splitlines(keepends=True)
+    windows = []
+    current = []
+    size = 0
+    for line in lines:
+        if current and size + len(line) > window_chars:
+            windows.append("".join(current))
+            # Новое окно начинается с последних реплик предыдущего
+            tail = []
+            tail_size = 0
+            for prev in reversed(current):
+                if tail_size + len(prev) > overlap_chars:
+                    break
+                tail.insert(0, prev)
+                tail_size += len(prev)
+            current = tail
+            size = tail_size
+        current.append(line)
+        size += len(line)
+    if current:
+        windows.append("".join(current))
+    return windows
+
+
+def group_questions(questions: dict, size: int = QUESTIONS_PER_GROUP) -> list:
+    items = list(questions.items())
+    return [dict(items[i:i + size]) for i in range(0, len(items), size)]
+
+
+def _parse_answers(result) -> dict:
+    try:
+        answers = json.loads(str(result).replace("```json", "").replace("```", ""))
+    except ValueError:
+        return {}
+    return answers if isinstance(answers, dict) else {}
+
+
+def _is_null(answer) -> bool:
+    return answer is None or str(answer).strip().lower() in ("", "null", "none")
+
+
+def _is_negative(answer) -> bool:
+    return str(answer).strip().lower().startswith("нет")
+
+
+def merge_answers(partials: list, question_ids) -> dict:
+    """
+    Сводит ответы из разных окон диалога.
+
+    Непустой ответ важнее null, а подтверждение ("Да, ...") важнее отрицания:
+    окно, где нужного фрагмента разговора нет, обычно отвечает "Нет".
+    """
+    merged = {str(q_id): None for q_id in question_ids}
+    for answers in partials:
+        for q_id, answer in answers.items():
+            q_id = str(q_id)
+            if q_id not in merged or _is_null(answer):
+                continue
+            current = merged[q_id]
+            if _is_null(current) or (_is_negative(current) and not _is_negative(answer)):
+                merged[q_id] = answer
+    return merged
+
+
+async def ya_request_2_mapreduce_async(text, questions: dict, use_cache=True):
+    """
+    Отвечает на вопросы анкеты группами по окнам диалога, все запросы параллельно.
+
+    :param text: Диалог
+    :param questions: Словарь {question_id: question_text}
+    :return: JSON с ответами в том же формате, что и ya_request_2
+    """
+    windows = split_dialogue(text)
+    requests = [
+        client.complete(ANSWERS_PROMPT, window + str(group), ANSWERS_TEMPERATURE, use_cache=use_cache)
+        for group in group_questions(questions)
+        for window in windows
+    ]
+    results = await asyncio.gather(*requests, return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors and len(errors) == len(results):
+        raise errors[0]
+    partials = [_parse_answers(r) for r in results if not isinstance(r, Exception)]
+    return json.dumps(merge_answers(partials, questions.keys()), ensure_ascii=False, indent=2)
+
+
+def ya_request_2_mapreduce(text, questions: dict, use_cache=True):
+    return asyncio.run(ya_request_2_mapreduce_async(text, questions, use_cache=use_cache))